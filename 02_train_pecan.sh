@@ -5,11 +5,14 @@
 #SBATCH --time=48:00:00
 #SBATCH --mem=32G
 #SBATCH --output=logs/train_%j.log
+#SBATCH --open-mode=append
+#SBATCH --requeue
 
 mkdir -p logs
 source ~/.bashrc
 conda activate ai_env
 
+# Preempted or requeued jobs resume each run from its last checkpoint (completed runs are skipped)
 for app in hvac waterheater ev laundry dishwasher refrigeration kitchen; do
     for s in 0 1 2; do
         echo "Training: ${app} seed=${s}"
@@ -19,7 +22,7 @@ for app in hvac waterheater ev laundry dishwasher refrigeration kitchen; do
             --appliance ${app} \
             --window_size 128 \
             --name_model NILMFormer \
-            --seed ${s}
+            --seed ${s} \
+            --resume
     done
 done
-EOF
\ No newline at end of file
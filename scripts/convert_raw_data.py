@@ -0,0 +1,57 @@
+#################################################################################################################
+#
+# @copyright : ©2025 EDF
+# @author : Adrien Petralia
+# @description : NILMFormer - Convert raw text data to columnar (Parquet) store
+#
+#################################################################################################################
+
+import argparse
+import logging
+
+from src.helpers.columnar import convert_ukdale, convert_refit, convert_pecanstreet
+
+
+def main(dataset, data_path):
+    """
+    One-time conversion of the raw text files of a dataset to typed columnar files,
+    then transparently used by the corresponding DataBuilder.
+
+    Args:
+        dataset (str): Name of the dataset (UKDALE, REFIT or PECANSTREET).
+        data_path (str): Root data folder (as 'data_path' in configs/expes.yaml).
+    """
+    logging.info("Convert %s raw data to columnar files ...", dataset)
+
+    if dataset == "UKDALE":
+        convert_ukdale(f"{data_path}/UKDALE/")
+    elif dataset == "REFIT":
+        convert_refit(f"{data_path}/REFIT/RAW_DATA_CLEAN/")
+    elif dataset == "PECANSTREET":
+        convert_pecanstreet(f"{data_path}/pecanstreet/")
+    else:
+        raise ValueError(
+            "Dataset {} unknown. Only 'UKDALE', 'REFIT' and 'PECANSTREET' available.".format(
+                dataset
+            )
+        )
+
+    logging.info("             ... Done.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert NILM raw data to columnar (Parquet) files."
+    )
+    parser.add_argument(
+        "--dataset",
+        required=True,
+        type=str,
+        help="Dataset name (UKDALE, REFIT or PECANSTREET).",
+    )
+    parser.add_argument(
+        "--data_path", default="data", type=str, help="Root data folder."
+    )
+
+    args = parser.parse_args()
+    main(dataset=args.dataset, data_path=args.data_path)
@@ -0,0 +1,165 @@
+#################################################################################################################
+#
+# @copyright : ©2025 EDF
+# @author : Adrien Petralia
+# @description : NILMFormer - Export windowed NILM datasets in shards
+#
+#################################################################################################################
+
+import argparse
+import logging
+
+import yaml
+
+from src.helpers.preprocessing import (
+    UKDALE_DataBuilder,
+    REFIT_DataBuilder,
+    PecanStreet_DataBuilder,
+)
+from src.helpers.shards import export_nilm_shards
+
+
+def main(
+    dataset,
+    sampling_rate,
+    window_size,
+    appliance,
+    out_dir,
+    data_path="data",
+    window_stride=None,
+    shard_size=65536,
+    dtype="float64",
+):
+    """
+    Build windows of all houses with the selected appliance and export them in shards
+    (see src/helpers/shards.py), to be streamed for training with NILMShardDataset.
+
+    Args:
+        dataset (str): Name of the dataset (UKDALE, REFIT or PECANSTREET).
+        sampling_rate (str): Selected sampling rate.
+        window_size (int or str): Size of the window (converted to int if possible not day, week or month).
+        appliance (str): Selected appliance.
+        out_dir (str): Output folder of the shards and manifest.
+        data_path (str): Root data folder (as 'data_path' in configs/expes.yaml).
+        window_stride (int): Step between windows (default: window_size, no overlap).
+        shard_size (int): Number of windows per shard.
+        dtype (str): Dtype of exported windows (float64, float32 or float16).
+    """
+    try:
+        window_size = int(window_size)
+    except ValueError:
+        pass
+
+    with open("configs/datasets.yaml", "r") as f:
+        datasets_config = yaml.safe_load(f)
+
+    if dataset not in datasets_config:
+        raise ValueError(
+            "Dataset {} unknown. Only 'UKDALE', 'REFIT' and 'PECANSTREET' available.".format(
+                dataset
+            )
+        )
+    if appliance not in datasets_config[dataset]:
+        raise ValueError(
+            "Appliance {} unknown. List of available appliances (for selected {} dataset): {}, ".format(
+                appliance, dataset, list(datasets_config[dataset].keys())
+            )
+        )
+    app_config = datasets_config[dataset][appliance]
+
+    builder_kwargs = {
+        "mask_app": app_config["app"],
+        "sampling_rate": sampling_rate,
+        "window_size": window_size,
+        "window_stride": window_stride,
+        "dtype": dtype,
+    }
+    if dataset == "UKDALE":
+        data_builder = UKDALE_DataBuilder(data_path=f"{data_path}/UKDALE/", **builder_kwargs)
+        house_indicies = [1, 2, 3, 4, 5]
+    elif dataset == "REFIT":
+        data_builder = REFIT_DataBuilder(
+            data_path=f"{data_path}/REFIT/RAW_DATA_CLEAN/", **builder_kwargs
+        )
+        house_indicies = app_config["house_with_app_i"]
+    else:
+        data_builder = PecanStreet_DataBuilder(
+            data_path=f"{data_path}/pecanstreet/", **builder_kwargs
+        )
+        house_indicies = app_config["house_with_app_i"]
+
+    logging.info("Export %s %s windows in shards to %s ...", dataset, appliance, out_dir)
+    manifest = export_nilm_shards(
+        data_builder, house_indicies, out_dir, shard_size=shard_size
+    )
+    logging.info(
+        "             ... Done: %s windows in %s shards.",
+        sum(shard["n_windows"] for shard in manifest["shards"]),
+        len(manifest["shards"]),
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Export windowed NILM datasets in shards for streaming training."
+    )
+    parser.add_argument(
+        "--dataset",
+        required=True,
+        type=str,
+        help="Dataset name (UKDALE, REFIT or PECANSTREET).",
+    )
+    parser.add_argument(
+        "--sampling_rate",
+        required=True,
+        type=str,
+        help="Sampling rate, e.g. '30s', '1min', '10min', etc.).",
+    )
+    parser.add_argument(
+        "--window_size",
+        required=True,
+        type=str,
+        help="Window size, e.g. '128' or 'day'.",
+    )
+    parser.add_argument(
+        "--appliance",
+        required=True,
+        type=str,
+        help="Selected appliance, e.g., 'WashingMachine'.",
+    )
+    parser.add_argument(
+        "--out_dir", required=True, type=str, help="Output folder of the shards."
+    )
+    parser.add_argument(
+        "--data_path", default="data", type=str, help="Root data folder."
+    )
+    parser.add_argument(
+        "--window_stride",
+        default=None,
+        type=int,
+        help="Step between windows (default: window size).",
+    )
+    parser.add_argument(
+        "--shard_size", default=65536, type=int, help="Number of windows per shard."
+    )
+    parser.add_argument(
+        "--dtype",
+        default="float64",
+        type=str,
+        help="Dtype of exported windows (float64, float32 or float16).",
+    )
+
+    args = parser.parse_args()
+    main(
+        dataset=args.dataset,
+        sampling_rate=args.sampling_rate,
+        window_size=args.window_size,
+        appliance=args.appliance,
+        out_dir=args.out_dir,
+        data_path=args.data_path,
+        window_stride=args.window_stride,
+        shard_size=args.shard_size,
+        dtype=args.dtype,
+    )
@@ -0,0 +1,79 @@
+#################################################################################################################
+#
+# @copyright : ©2025 EDF
+# @author : Adrien Petralia
+# @description : NILMFormer - List and purge preprocessed datasets cache
+#
+#################################################################################################################
+
+import argparse
+
+import pandas as pd
+
+from src.helpers.cache import DatasetCache, FrameCache
+
+
+def main(cache_dir, purge=None, purge_all=False, frame_cache_dir=None):
+    """
+    List cached datasets (or house frames), or remove some (or all) of them.
+
+    Args:
+        cache_dir (str): Cache folder (by default '{data_path}/cache', see configs/expes.yaml).
+        purge (list): Keys of the entries to remove.
+        purge_all (bool): Remove all entries.
+        frame_cache_dir (str): If provided, on-disk house frames cache folder listed or purged instead of datasets
+            ('frame_cache_dir' in configs/expes.yaml).
+    """
+    if frame_cache_dir is not None:
+        cache, cache_dir, kind = FrameCache(max_bytes=0, cache_dir=frame_cache_dir), frame_cache_dir, "frame"
+    else:
+        cache, kind = DatasetCache(cache_dir=cache_dir), "dataset"
+
+    if purge_all or purge:
+        removed = cache.purge(keys=None if purge_all else purge)
+        print(f"Removed {len(removed)} cached {kind}(s).")
+        for key in removed:
+            print(f"  {key}")
+        return
+
+    entries = cache.list_entries()
+    if len(entries) == 0:
+        print(f"No cached {kind} in {cache_dir}.")
+        return
+
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(entries.to_string(index=False, float_format="{:.1f}".format))
+    print(f"Total: {entries['size_MB'].sum():.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="List or purge the preprocessed NILM datasets cache."
+    )
+    parser.add_argument(
+        "--cache_dir", default="data/cache", type=str, help="Cache folder."
+    )
+    parser.add_argument(
+        "--purge",
+        nargs="+",
+        default=None,
+        type=str,
+        help="Keys of the cached datasets (or frames) to remove.",
+    )
+    parser.add_argument(
+        "--frame_cache_dir",
+        default=None,
+        type=str,
+        help="House frames cache folder: list or purge frames instead of datasets.",
+    )
+    parser.add_argument(
+        "--purge_all", action="store_true", help="Remove all cached datasets (or frames)."
+    )
+
+    args = parser.parse_args()
+    main(
+        cache_dir=args.cache_dir,
+        purge=args.purge,
+        purge_all=args.purge_all,
+        frame_cache_dir=args.frame_cache_dir,
+    )
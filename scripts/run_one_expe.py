@@ -10,9 +10,7 @@ import argparse
 import yaml
 import logging
 import numpy as np
-import hashlib
-import pickle
-from pathlib import Path
+import torch
 
 from omegaconf import OmegaConf
 
@@ -24,150 +22,163 @@ from src.helpers.preprocessing import (
     split_train_test_pdl_nilmdataset,
     nilmdataset_to_tser,
 )
-from src.helpers.dataset import NILMscaler
-from src.helpers.expes import launch_models_training
+from src.helpers.dataset import NILMscaler, NILMArrayView
+from src.helpers.cache import DatasetCache, get_nilm_dataset_cached
+from src.helpers.expes import launch_models_training, is_expe_completed
+from src.helpers.distributed import (
+    init_distributed,
+    cleanup_distributed,
+    distributed_device,
+    is_distributed,
+    is_main_process,
+    local_main_process_first,
+    wait_processes,
+)
 from src.helpers.preprocessing import PecanStreet_DataBuilder
 
 
-def get_cache_key(dataset, app, sampling_rate, window_size, house_list):
-    """Generate a unique cache key based on data parameters"""
-    key_str = f"{dataset}_{app}_{sampling_rate}_{window_size}_{sorted(house_list)}"
-    return hashlib.md5(key_str.encode()).hexdigest()[:12]
-
+def get_nilm_data(data_builder, house_indicies, cache, expes_config):
+    """
+    Get NILM dataset of provided houses (from cache if available).
 
-def load_cached_data(cache_path):
-    """Load cached data if exists"""
-    if cache_path.exists():
-        logging.info(f"Loading cached data from {cache_path}")
-        with open(cache_path, 'rb') as f:
-            return pickle.load(f)
-    return None
+    If out_of_core, data stays on disk: the cached array is opened read-only and wrapped in a NILMArrayView
+    (splits only keep row indexes and scaling is applied on access).
+    If virtual_windows, windows are not materialized (NILMSeries: continuous series of each house and windows index).
+    """
+    data, st_date = get_nilm_dataset_cached(
+        data_builder,
+        house_indicies,
+        cache=cache,
+        n_jobs=expes_config.n_jobs,
+        mmap_mode="r" if expes_config.out_of_core else "c",
+        virtual=expes_config.virtual_windows,
+    )
 
+    if expes_config.out_of_core and not isinstance(data, NILMArrayView):
+        data = NILMArrayView(data)
 
-def save_cached_data(cache_path, data_dict):
-    """Save processed data to cache"""
-    cache_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(cache_path, 'wb') as f:
-        pickle.dump(data_dict, f)
-    logging.info(f"Cached data saved to {cache_path}")
+    return data, st_date
 
 
 def launch_one_experiment(expes_config: OmegaConf):
     np.random.seed(seed=expes_config.seed)
+    if is_distributed():
+        # Same torch RNG in all processes (e.g. epoch seeds of iterable datasets)
+        torch.manual_seed(expes_config.seed)
 
-    # Setup cache
-    cache_dir = Path(expes_config.data_path) / "cache"
-    
-    logging.info("Process data ...")
-    if expes_config.dataset == "UKDALE":
-        data_builder = UKDALE_DataBuilder(
-            data_path=f"{expes_config.data_path}/UKDALE/",
-            mask_app=expes_config.app,
-            sampling_rate=expes_config.sampling_rate,
-            window_size=expes_config.window_size,
+    # Setup preprocessed datasets cache
+    # (cached datasets are memory mapped copy-on-write: pages are shared by concurrent runs until scaled inplace)
+    if expes_config.out_of_core and not expes_config.data_cache:
+        raise ValueError(
+            "out_of_core requires data_cache: datasets are kept on disk in the cache folder."
         )
 
-        data, st_date = data_builder.get_nilm_dataset(house_indicies=[1, 2, 3, 4, 5])
-
-        if isinstance(expes_config.window_size, str):
-            expes_config.window_size = data_builder.window_size
-
-        data_train, st_date_train = data_builder.get_nilm_dataset(
-            house_indicies=expes_config.ind_house_train
-        )
-        data_test, st_date_test = data_builder.get_nilm_dataset(
-            house_indicies=expes_config.ind_house_test
+    if expes_config.data_cache:
+        cache = DatasetCache(
+            cache_dir=f"{expes_config.data_path}/cache",
+            max_bytes=int(expes_config.data_cache_size_gb * 1024**3),
         )
-
-        data_train, st_date_train, data_valid, st_date_valid = (
-            split_train_test_nilmdataset(
-                data_train,
-                st_date_train,
-                perc_house_test=0.2,
-                seed=expes_config.seed,
+    else:
+        cache = None
+
+    # In distributed training, datasets are built (and cached) by the first process of each node
+    with local_main_process_first():
+        logging.info("Process data ...")
+        if expes_config.dataset == "UKDALE":
+            data_builder = UKDALE_DataBuilder(
+                data_path=f"{expes_config.data_path}/UKDALE/",
+                mask_app=expes_config.app,
+                sampling_rate=expes_config.sampling_rate,
+                window_size=expes_config.window_size,
+                window_stride=expes_config.window_stride,
+                frame_cache_dir=expes_config.frame_cache_dir,
+                frame_cache_disk_bytes=int(expes_config.frame_cache_size_gb * 1024**3),
+                dtype=expes_config.data_dtype,
             )
-        )
 
-    elif expes_config.dataset == "REFIT":
-        data_builder = REFIT_DataBuilder(
-            data_path=f"{expes_config.data_path}/REFIT/RAW_DATA_CLEAN/",
-            mask_app=expes_config.app,
-            sampling_rate=expes_config.sampling_rate,
-            window_size=expes_config.window_size,
-        )
-
-        data, st_date = data_builder.get_nilm_dataset(
-            house_indicies=expes_config.house_with_app_i
-        )
+            data, st_date = get_nilm_data(
+                data_builder, [1, 2, 3, 4, 5], cache, expes_config
+            )
 
-        if isinstance(expes_config.window_size, str):
-            expes_config.window_size = data_builder.window_size
+            if isinstance(expes_config.window_size, str):
+                expes_config.window_size = data_builder.window_size
 
-        data_train, st_date_train, data_test, st_date_test = (
-            split_train_test_pdl_nilmdataset(
-                data.copy(), st_date.copy(), nb_house_test=2, seed=expes_config.seed
+            data_train, st_date_train = get_nilm_data(
+                data_builder, expes_config.ind_house_train, cache, expes_config
+            )
+            data_test, st_date_test = get_nilm_data(
+                data_builder, expes_config.ind_house_test, cache, expes_config
             )
-        )
 
-        data_train, st_date_train, data_valid, st_date_valid = (
-            split_train_test_pdl_nilmdataset(
-                data_train, st_date_train, nb_house_test=1, seed=expes_config.seed
+            data_train, st_date_train, data_valid, st_date_valid = (
+                split_train_test_nilmdataset(
+                    data_train,
+                    st_date_train,
+                    perc_house_test=0.2,
+                    seed=expes_config.seed,
+                )
             )
-        )
 
-    elif expes_config.dataset == "PECANSTREET":
-        # Generate cache key
-        cache_key = get_cache_key(
-            expes_config.dataset,
-            expes_config.app,
-            expes_config.sampling_rate,
-            expes_config.window_size,
-            expes_config.house_with_app_i
-        )
-        cache_path = cache_dir / f"{cache_key}.pkl"
-        
-        # Try to load from cache
-        cached = load_cached_data(cache_path)
-        
-        if cached is not None:
-            data = cached['data']
-            st_date = cached['st_date']
-            data_builder = PecanStreet_DataBuilder(
-                data_path=f"{expes_config.data_path}/pecanstreet/",
+        elif expes_config.dataset == "REFIT":
+            data_builder = REFIT_DataBuilder(
+                data_path=f"{expes_config.data_path}/REFIT/RAW_DATA_CLEAN/",
                 mask_app=expes_config.app,
                 sampling_rate=expes_config.sampling_rate,
                 window_size=expes_config.window_size,
+                window_stride=expes_config.window_stride,
+                dtype=expes_config.data_dtype,
             )
-        else:
+
+            data, st_date = get_nilm_data(
+                data_builder, expes_config.house_with_app_i, cache, expes_config
+            )
+
+            if isinstance(expes_config.window_size, str):
+                expes_config.window_size = data_builder.window_size
+
+            data_train, st_date_train, data_test, st_date_test = (
+                split_train_test_pdl_nilmdataset(
+                    data, st_date, nb_house_test=2, seed=expes_config.seed
+                )
+            )
+
+            data_train, st_date_train, data_valid, st_date_valid = (
+                split_train_test_pdl_nilmdataset(
+                    data_train, st_date_train, nb_house_test=1, seed=expes_config.seed
+                )
+            )
+
+        elif expes_config.dataset == "PECANSTREET":
             data_builder = PecanStreet_DataBuilder(
                 data_path=f"{expes_config.data_path}/pecanstreet/",
                 mask_app=expes_config.app,
                 sampling_rate=expes_config.sampling_rate,
                 window_size=expes_config.window_size,
+                window_stride=expes_config.window_stride,
+                dtype=expes_config.data_dtype,
             )
 
-            data, st_date = data_builder.get_nilm_dataset(house_indicies=expes_config.house_with_app_i)
-            
-            # Save to cache
-            save_cached_data(cache_path, {'data': data, 'st_date': st_date})
+            data, st_date = get_nilm_data(
+                data_builder, expes_config.house_with_app_i, cache, expes_config
+            )
 
-        if isinstance(expes_config.window_size, str):
-            expes_config.window_size = data_builder.window_size
+            if isinstance(expes_config.window_size, str):
+                expes_config.window_size = data_builder.window_size
 
-        # Split: 16 train, 2 valid, 2 test
-        data_train, st_date_train, data_test, st_date_test = (
-            split_train_test_pdl_nilmdataset(
-                data.copy(), st_date.copy(), nb_house_test=2, seed=expes_config.seed
+            # Split: 16 train, 2 valid, 2 test
+            data_train, st_date_train, data_test, st_date_test = (
+                split_train_test_pdl_nilmdataset(
+                    data, st_date, nb_house_test=2, seed=expes_config.seed
+                )
             )
-        )
 
-        data_train, st_date_train, data_valid, st_date_valid = (
-            split_train_test_pdl_nilmdataset(
-                data_train, st_date_train, nb_house_test=2, seed=expes_config.seed
+            data_train, st_date_train, data_valid, st_date_valid = (
+                split_train_test_pdl_nilmdataset(
+                    data_train, st_date_train, nb_house_test=2, seed=expes_config.seed
+                )
             )
-        )
 
-    logging.info("             ... Done.")
+        logging.info("             ... Done.")
 
     scaler = NILMscaler(
         power_scaling_type=expes_config.power_scaling_type,
@@ -217,7 +228,7 @@ def launch_one_experiment(expes_config: OmegaConf):
     launch_models_training(tuple_data, scaler, expes_config)
 
 
-def main(dataset, sampling_rate, window_size, appliance, name_model, seed):
+def main(dataset, sampling_rate, window_size, appliance, name_model, seed, resume=False):
     """
     Main function to load configuration, update it with parameters,
     and launch an experiment.
@@ -229,6 +240,8 @@ def main(dataset, sampling_rate, window_size, appliance, name_model, seed):
         appliance (str): Selected appliance.
         name_model (str): Name of the model to use for the experiment.
         seed (int): Random seed for reproducibility.
+        resume (bool): Resume training from its last resume checkpoint (see resume_every in configs/expes.yaml),
+            completed experiments being skipped.
     """
 
     # Attempt to convert window_size to int
@@ -298,6 +311,7 @@ def main(dataset, sampling_rate, window_size, appliance, name_model, seed):
     expes_config["sampling_rate"] = sampling_rate
     expes_config["seed"] = seed
     expes_config["name_model"] = name_model
+    expes_config["resume"] = resume
 
     # Create directories for results
     result_path = create_dir(expes_config["result_path"])
@@ -312,8 +326,25 @@ def main(dataset, sampling_rate, window_size, appliance, name_model, seed):
         f"{result_path}{expes_config.name_model}_{expes_config.seed}"
     )
 
+    if resume and is_expe_completed(expes_config.result_path):
+        logging.info(
+            "Experiment already completed (%s.pt): skipped.", expes_config.result_path
+        )
+        return
+
+    # Distributed training if launched with torchrun (one process per device)
+    if init_distributed(backend=expes_config.dist_backend, device=expes_config.device):
+        expes_config.device = distributed_device(expes_config.device)
+        if not is_main_process():
+            logging.getLogger().setLevel(logging.WARNING)
+
     # Launch experiments
-    launch_one_experiment(expes_config)
+    try:
+        launch_one_experiment(expes_config)
+        # Processes wait for rank 0 evaluation before tearing down the process group
+        wait_processes()
+    finally:
+        cleanup_distributed()
 
 
 if __name__ == "__main__":
@@ -345,6 +376,11 @@ if __name__ == "__main__":
     parser.add_argument(
         "--seed", required=True, type=int, help="Random seed for reproducibility."
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume training from its last checkpoint and skip completed experiments.",
+    )
 
     args = parser.parse_args()
     main(
@@ -354,4 +390,5 @@ if __name__ == "__main__":
         appliance=args.appliance,
         name_model=args.name_model,
         seed=args.seed,
+        resume=args.resume,
     )
\ No newline at end of file
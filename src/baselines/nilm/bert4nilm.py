@@ -422,8 +422,8 @@ class BERT4NILM(nn.Module):
 
             loss.backward()
             optimizer.step()
-            total_loss += loss.item()
+            total_loss += loss.detach().double()
 
-        total_loss = total_loss / len(loader)
+        total_loss = float(total_loss) / len(loader)
 
         return total_loss
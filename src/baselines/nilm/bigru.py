@@ -119,23 +119,23 @@ class BiGRU(nn.Module):
 
             optimizer.zero_grad()
             loss, mse_loss, bce_loss = self.forward_loss(seqs, labels_energy, status)
-            total_loss += loss.item()
-            total_mse_loss += mse_loss.item()
-            total_bce_loss += bce_loss.item()
+            total_loss += loss.detach().double()
+            total_mse_loss += mse_loss.detach().double()
+            total_bce_loss += bce_loss.detach().double()
 
             loss.backward()
             optimizer.step()
 
-        total_loss = total_loss / len(loader)
+        total_loss = float(total_loss) / len(loader)
 
         if self.verbose_loss:
             print(
                 "Tot. loss:",
                 total_loss,
                 " | MSE loss:",
-                total_mse_loss / len(loader),
+                float(total_mse_loss) / len(loader),
                 " | BCE loss:",
-                total_bce_loss / len(loader),
+                float(total_bce_loss) / len(loader),
             )
 
         return total_loss
@@ -158,20 +158,20 @@ class BiGRU(nn.Module):
             )
 
             loss, mse_loss, bce_loss = self.forward_loss(seqs, labels_energy, status)
-            total_loss += loss.item()
-            total_mse_loss += mse_loss.item()
-            total_bce_loss += bce_loss.item()
+            total_loss += loss.detach().double()
+            total_mse_loss += mse_loss.detach().double()
+            total_bce_loss += bce_loss.detach().double()
 
-        total_loss = total_loss / len(loader)
+        total_loss = float(total_loss) / len(loader)
 
         if self.verbose_loss:
             print(
                 "Tot. loss:",
                 total_loss,
                 " | MSE loss:",
-                total_mse_loss / len(loader),
+                float(total_mse_loss) / len(loader),
                 " | BCE loss:",
-                total_bce_loss / len(loader),
+                float(total_bce_loss) / len(loader),
             )
 
         return total_loss
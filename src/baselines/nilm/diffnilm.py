@@ -310,12 +310,12 @@ class DiffNILM(nn.Module):
 
             self.optimizer.zero_grad()
             loss = self.forward((seqs, labels_energy, status))
-            total_loss += loss.item()
+            total_loss += loss.detach().double()
 
             loss.backward()
             self.optimizer.step()
 
-        total_loss = total_loss / len(loader)
+        total_loss = float(total_loss) / len(loader)
 
         return total_loss
 
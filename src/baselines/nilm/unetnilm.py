@@ -319,22 +319,22 @@ class UNetNiLM(nn.Module):
 
             optimizer.zero_grad()
             loss, q_loss, bce_loss = self.forward_loss(seqs, labels_energy, status)
-            total_q_loss += q_loss.item()
-            total_bce_loss += bce_loss.item()
-            total_loss += loss.item()
+            total_q_loss += q_loss.detach().double()
+            total_bce_loss += bce_loss.detach().double()
+            total_loss += loss.detach().double()
             loss.backward()
             optimizer.step()
 
-        total_loss = total_loss / len(loader)
+        total_loss = float(total_loss) / len(loader)
 
         if self.verbose_loss:
             print(
                 "Tot. loss:",
                 total_loss,
                 " | Quantiles loss:",
-                total_q_loss / len(loader),
+                float(total_q_loss) / len(loader),
                 " | BCE loss:",
-                total_bce_loss / len(loader),
+                float(total_bce_loss) / len(loader),
             )
 
         return total_loss
@@ -355,10 +355,10 @@ class UNetNiLM(nn.Module):
             status = torch.Tensor(status.float()).to(device)
 
             loss, q_loss, bce_loss = self.forward_loss(seqs, labels_energy, status)
-            total_q_loss += q_loss.item()
-            total_bce_loss += bce_loss.item()
-            total_loss += loss.item()
+            total_q_loss += q_loss.detach().double()
+            total_bce_loss += bce_loss.detach().double()
+            total_loss += loss.detach().double()
 
-        total_loss = total_loss / len(loader)
+        total_loss = float(total_loss) / len(loader)
 
         return total_loss
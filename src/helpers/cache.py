@@ -0,0 +1,657 @@
+#################################################################################################################
+#
+# @copyright : ©2025 EDF
+# @author : Adrien Petralia
+# @description : NILMFormer - Preprocessing caches
+#
+#################################################################################################################
+
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+import logging
+import contextlib
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from src.helpers.dataset import NILMSeries
+
+
+def hash_params(params):
+    """
+    Stable short hash of a (json serializable) dict of parameters.
+    """
+    key_str = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.md5(key_str.encode()).hexdigest()[:16]
+
+
+def files_signature(files):
+    """
+    Size and modification time of a list of files (missing files are skipped).
+    """
+    signature = []
+    for file in sorted(files):
+        if os.path.isfile(file):
+            stat = os.stat(file)
+            signature.append([os.path.basename(file), stat.st_size, stat.st_mtime_ns])
+
+    return signature
+
+
+def unique_tmp_path(path):
+    """
+    Temporary path next to path, unique to the process (concurrent runs never write in the same temporary file).
+    """
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+@contextlib.contextmanager
+def file_lock(lock_path):
+    """
+    Exclusive lock (fcntl) on lock_path, held across processes for the duration of the context.
+    """
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# ===================== House frame memo ===================== #
+class FrameCache(object):
+    """
+    House-keyed memo of processed (resampled) house dataframes.
+
+    In-memory entries are kept in a LRU bounded in bytes (max_bytes, 0 to disable).
+    If cache_dir is provided, frames are also pickled on disk and reused across processes and runs:
+    the on-disk key must then contain everything the frame depends on (parameters, raw files signature,
+    preprocessing code version). On-disk frames are evicted least recently used first (modification time,
+    updated at each read) when their total size exceeds max_disk_bytes, under a lock file ('.lock').
+
+    The in-memory LRU only lives in the process using it: a pickled copy (e.g. sent to the worker processes
+    of a DataBuilder with n_jobs > 1) has it disabled and only uses the on-disk layer, if any.
+    """
+
+    def __init__(self, max_bytes=2 * 1024**3, cache_dir=None, max_disk_bytes=20 * 1024**3):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.n_bytes = 0
+        self._frames = OrderedDict()
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        # Do not ship in-memory frames to workers processes, whose in-memory frames would be lost with them
+        state = self.__dict__.copy()
+        state["_frames"] = OrderedDict()
+        state["n_bytes"] = 0
+        state["max_bytes"] = 0
+        return state
+
+    def __len__(self):
+        return len(self._frames)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _lock(self):
+        return file_lock(os.path.join(self.cache_dir, ".lock"))
+
+    def get(self, key):
+        """
+        Return : cached pd.core.frame.DataFrame instance or None
+        """
+        if key in self._frames:
+            self._frames.move_to_end(key)
+            return self._frames[key][0]
+
+        if self.cache_dir is not None:
+            try:
+                frame = pd.read_pickle(self._disk_path(key))
+                # Last access time of the on-disk frame (LRU eviction)
+                os.utime(self._disk_path(key))
+            except FileNotFoundError:
+                # Not cached, or evicted by a concurrent run
+                return None
+
+            self._put_memory(key, frame)
+            return frame
+
+        return None
+
+    def put(self, key, frame):
+        self._put_memory(key, frame)
+
+        if self.cache_dir is not None:
+            # Write then rename to never leave a partial file
+            path = self._disk_path(key)
+            tmp_path = unique_tmp_path(path)
+            frame.to_pickle(tmp_path)
+
+            with self._lock():
+                os.replace(tmp_path, path)
+                self._evict(keep=path)
+
+        return
+
+    def _disk_entries(self):
+        # On-disk frames (path, size, last access), least recently used first
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, file)
+            if file.endswith(".pkl"):
+                stat = os.stat(path)
+                entries.append((path, stat.st_size, stat.st_mtime))
+
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def _evict(self, keep=None):
+        """
+        Remove least recently used on-disk frames (except keep) until their total size fits in max_disk_bytes.
+        """
+        entries = self._disk_entries()
+        total_size = sum(size for _, size, _ in entries)
+
+        for path, size, _ in entries:
+            if total_size <= self.max_disk_bytes:
+                break
+            if path == keep:
+                continue
+
+            os.remove(path)
+            total_size -= size
+
+        return
+
+    def list_entries(self):
+        """
+        Return : pd.core.frame.DataFrame instance with one row per on-disk frame (most recently used first)
+        """
+        entries = pd.DataFrame(
+            [
+                {
+                    "key": os.path.basename(path)[: -len(".pkl")],
+                    "size_MB": size / 1024**2,
+                    "last_access": pd.Timestamp(mtime, unit="s"),
+                }
+                for path, size, mtime in self._disk_entries()
+            ],
+            columns=["key", "size_MB", "last_access"],
+        )
+
+        return entries.sort_values("last_access", ascending=False).reset_index(
+            drop=True
+        )
+
+    def purge(self, keys=None):
+        """
+        Remove provided on-disk frames (all frames if keys is None).
+
+        Return : list of removed keys
+        """
+        with self._lock():
+            cached = list(self.list_entries()["key"])
+            keys = cached if keys is None else [k for k in keys if k in cached]
+
+            for key in keys:
+                os.remove(self._disk_path(key))
+
+        return keys
+
+    def _put_memory(self, key, frame):
+        size = int(frame.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+
+        if key in self._frames:
+            self.n_bytes -= self._frames.pop(key)[1]
+
+        self._frames[key] = (frame, size)
+        self.n_bytes += size
+
+        while self.n_bytes > self.max_bytes:
+            _, (_, old_size) = self._frames.popitem(last=False)
+            self.n_bytes -= old_size
+
+        return
+
+    def clear(self):
+        self._frames.clear()
+        self.n_bytes = 0
+        return
+
+
+# ===================== Start dates index ===================== #
+def st_date_to_index(st_date):
+    """
+    Compact start dates index of a NILM dataset.
+
+    Return : house ids (np.ndarray int64), start dates (np.ndarray int64, ns since epoch in UTC),
+             dict with timezone and resolution of start dates
+    """
+    start_dates = pd.DatetimeIndex(st_date["start_date"])
+    tz = None if start_dates.tz is None else str(start_dates.tz)
+
+    return (
+        np.asarray(st_date.index, dtype=np.int64),
+        start_dates.as_unit("ns").asi8,
+        {"tz": tz, "unit": start_dates.unit},
+    )
+
+
+def st_date_from_index(house_ids, start_dates, tz=None, unit="ns"):
+    """
+    Rebuild st_date DataFrame (index: house id, column 'start_date') from its compact index.
+    """
+    if tz is None:
+        start_dates = pd.to_datetime(start_dates, unit="ns")
+    else:
+        start_dates = pd.to_datetime(start_dates, unit="ns", utc=True).tz_convert(tz)
+
+    return pd.DataFrame(
+        data={"start_date": start_dates.as_unit(unit)}, index=np.asarray(house_ids, dtype=np.int64)
+    )
+
+
+# ===================== NILM dataset cache ===================== #
+CODE_FILES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "preprocessing.py"),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "columnar.py"),
+    os.path.abspath(__file__),
+]
+
+
+def code_version():
+    """
+    Hash of the preprocessing (and cache format) source code: any code change invalidates cached datasets.
+    """
+    md5 = hashlib.md5()
+    for file in CODE_FILES:
+        with open(file, "rb") as f:
+            md5.update(f.read())
+
+    return md5.hexdigest()[:16]
+
+
+def builder_params(data_builder):
+    """
+    Parameters of a DataBuilder that define its output (thresholds, window, stride, soft_label, ...).
+    """
+    return {
+        k: v
+        for k, v in vars(data_builder).items()
+        if k not in ["data_path", "frame_cache"]
+    }
+
+
+def dataset_cache_key(data_builder, house_indicies, virtual=False):
+    """
+    Content-addressed key of a NILM dataset: builder type and parameters, houses (in order),
+    raw files size and mtime, preprocessing code version and storage (windows or virtual windows).
+
+    Return : key (str), description of the key inputs (dict)
+    """
+    description = {
+        "dataset": type(data_builder).__name__.split("_")[0],
+        "house_indicies": [int(indice) for indice in house_indicies],
+        "params": builder_params(data_builder),
+        "raw_files": files_signature(data_builder._raw_files(house_indicies)),
+        "code_version": code_version(),
+    }
+    if virtual:
+        description["virtual"] = True
+
+    return f"{description['dataset']}_{hash_params(description)}", description
+
+
+class DatasetCache(object):
+    """
+    Cache of NILM datasets (output of DataBuilders get_nilm_dataset) stored in cache_dir.
+
+    Each entry is a folder holding the 4D array as a raw .npy file ('data.npy', opened as a memory map,
+    so that concurrent runs share the same pages of the OS cache) and a compact start dates index
+    ('house_ids.npy', 'start_dates.npy' and timezone/resolution in 'index.json').
+    Virtual datasets (NILMSeries) are stored as their continuous series ('series.npy', memory mapped)
+    and windows index ('starts.npy' and window size in 'series.json') instead of 'data.npy',
+    with their NaN-free spans if any ('spans.npy' and spans start dates index 'span_house_ids.npy', 'span_start_dates.npy').
+
+    A manifest (manifest.json) keeps size, creation and last access time of each entry,
+    and least recently used entries are evicted when the total size exceeds max_bytes.
+
+    The cache can be shared by concurrent runs: manifest updates, commits and evictions are done
+    under a lock file ('.lock'), and an entry is built by one run at a time (see build_lock).
+    """
+
+    def __init__(self, cache_dir, max_bytes=50 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.lock_dir = os.path.join(cache_dir, ".locks")
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    # ===================== Locks ===================== #
+    def _lock(self):
+        # Lock of the manifest and entries folders
+        return file_lock(os.path.join(self.cache_dir, ".lock"))
+
+    def build_lock(self, key):
+        """
+        Lock of the build of entry key: concurrent runs missing the same entry wait for the first one
+        to build it (and then read it) instead of building it again.
+        """
+        return file_lock(os.path.join(self.lock_dir, f"{key}.lock"))
+
+    # ===================== Manifest ===================== #
+    def _load_manifest(self):
+        if not os.path.isfile(self.manifest_path):
+            return {}
+
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+
+        # Drop entries whose files have been removed
+        return {
+            key: entry
+            for key, entry in manifest.items()
+            if os.path.exists(os.path.join(self.cache_dir, entry["file"]))
+        }
+
+    def _save_manifest(self, manifest):
+        # Only called with the lock held
+        tmp_path = unique_tmp_path(self.manifest_path)
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        return
+
+    def list_entries(self):
+        """
+        Return : pd.core.frame.DataFrame instance with one row per cached dataset (most recently used first)
+        """
+        manifest = self._load_manifest()
+        entries = pd.DataFrame(
+            [
+                {
+                    "key": key,
+                    "dataset": entry["description"]["dataset"],
+                    "apps": ",".join(entry["description"]["params"]["mask_app"][1:]),
+                    "window_size": entry["description"]["params"]["window_size"],
+                    "n_houses": len(entry["description"]["house_indicies"]),
+                    "size_MB": entry["size"] / 1024**2,
+                    "created": pd.Timestamp(entry["created"], unit="s"),
+                    "last_access": pd.Timestamp(entry["last_access"], unit="s"),
+                }
+                for key, entry in manifest.items()
+            ],
+            columns=[
+                "key",
+                "dataset",
+                "apps",
+                "window_size",
+                "n_houses",
+                "size_MB",
+                "created",
+                "last_access",
+            ],
+        )
+
+        return entries.sort_values("last_access", ascending=False).reset_index(
+            drop=True
+        )
+
+    # ===================== Entries ===================== #
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, mmap_mode="r"):
+        """
+        Return : cached (data, st_date) or None, data being a np.memmap (mmap_mode, None to load in memory)
+                 or a NILMSeries over a np.memmap for virtual datasets
+        """
+        # Files are opened under the lock: the entry can not be evicted or replaced meanwhile
+        # (an opened memory map stays valid if the entry is removed afterwards)
+        with self._lock():
+            manifest = self._load_manifest()
+            if key not in manifest:
+                return None
+
+            data, st_date = self._read_entry(key, mmap_mode=mmap_mode)
+
+            manifest[key]["last_access"] = time.time()
+            self._save_manifest(manifest)
+
+        return data, st_date
+
+    def _read_entry(self, key, mmap_mode="r"):
+        path = self._entry_path(key)
+        if os.path.isfile(os.path.join(path, "series.npy")):
+            with open(os.path.join(path, "series.json")) as f:
+                series_meta = json.load(f)
+            span_index = series_meta.pop("span_index", None)
+
+            if span_index is not None:
+                spans = np.load(os.path.join(path, "spans.npy"))
+                span_st_date = st_date_from_index(
+                    np.load(os.path.join(path, "span_house_ids.npy")),
+                    np.load(os.path.join(path, "span_start_dates.npy")),
+                    **span_index,
+                )
+            else:
+                spans, span_st_date = None, None
+
+            data = NILMSeries(
+                np.load(os.path.join(path, "series.npy"), mmap_mode=mmap_mode),
+                np.load(os.path.join(path, "starts.npy")),
+                spans=spans,
+                span_st_date=span_st_date,
+                **series_meta,
+            )
+        else:
+            data = np.load(os.path.join(path, "data.npy"), mmap_mode=mmap_mode)
+
+        with open(os.path.join(path, "index.json")) as f:
+            index_meta = json.load(f)
+        st_date = st_date_from_index(
+            np.load(os.path.join(path, "house_ids.npy")),
+            np.load(os.path.join(path, "start_dates.npy")),
+            **index_meta,
+        )
+
+        return data, st_date
+
+    def put(self, key, data, st_date, description=None):
+        with self._new_entry(key) as tmp_path:
+            self._write_entry(tmp_path, data)
+            self._commit(key, tmp_path, st_date, description=description)
+
+        return
+
+    def _write_entry(self, tmp_path, data):
+        if isinstance(data, NILMSeries):
+            starts = data.starts if data.rows is None else data.starts[data.rows]
+            np.save(os.path.join(tmp_path, "series.npy"), np.ascontiguousarray(data.data))
+            np.save(os.path.join(tmp_path, "starts.npy"), starts)
+            series_meta = {
+                "window_size": int(data.window_size),
+                "skip_all_off": bool(data.skip_all_off),
+            }
+
+            if data.spans is not None:
+                span_house_ids, span_start_dates, series_meta["span_index"] = (
+                    st_date_to_index(data.span_st_date)
+                )
+                np.save(os.path.join(tmp_path, "spans.npy"), data.spans)
+                np.save(os.path.join(tmp_path, "span_house_ids.npy"), span_house_ids)
+                np.save(os.path.join(tmp_path, "span_start_dates.npy"), span_start_dates)
+
+            with open(os.path.join(tmp_path, "series.json"), "w") as f:
+                json.dump(series_meta, f)
+        else:
+            np.save(os.path.join(tmp_path, "data.npy"), np.ascontiguousarray(data))
+
+        return
+
+    def build(self, key, f_build, description=None):
+        """
+        Build an entry in place: f_build(out_file) writes the 4D array in the memory-mapped .npy file out_file
+        (e.g. DataBuilder.get_nilm_dataset with out_file) and returns (data, st_date),
+        so that the dataset never needs to fit in memory.
+        """
+        with self._new_entry(key) as tmp_path:
+            data, st_date = f_build(os.path.join(tmp_path, "data.npy"))
+            del data
+            self._commit(key, tmp_path, st_date, description=description)
+
+        return
+
+    @contextlib.contextmanager
+    def _new_entry(self, key):
+        # Entry written in a temporary folder (unique to the process) then renamed to never expose a partial entry,
+        # the folder being removed if the build fails
+        tmp_path = unique_tmp_path(self._entry_path(key))
+        os.makedirs(tmp_path)
+        try:
+            yield tmp_path
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _commit(self, key, tmp_path, st_date, description=None):
+        path = self._entry_path(key)
+        house_ids, start_dates, index_meta = st_date_to_index(st_date)
+
+        np.save(os.path.join(tmp_path, "house_ids.npy"), house_ids)
+        np.save(os.path.join(tmp_path, "start_dates.npy"), start_dates)
+        with open(os.path.join(tmp_path, "index.json"), "w") as f:
+            json.dump(index_meta, f)
+        size = sum(
+            os.path.getsize(os.path.join(tmp_path, file)) for file in os.listdir(tmp_path)
+        )
+
+        with self._lock():
+            manifest = self._load_manifest()
+            if key in manifest:
+                # Entry committed by a concurrent run meanwhile: keep it (it may already be opened)
+                return
+
+            if os.path.exists(path):
+                # Stale folder not referenced by the manifest
+                self._remove_files({"file": os.path.basename(path)})
+            os.replace(tmp_path, path)
+
+            now = time.time()
+            manifest[key] = {
+                "file": os.path.basename(path),
+                "size": size,
+                "created": now,
+                "last_access": now,
+                "description": description,
+            }
+            self._evict(manifest, keep=key)
+            self._save_manifest(manifest)
+
+        return
+
+    def _evict(self, manifest, keep=None):
+        """
+        Remove least recently used entries (except keep) until total size fits in max_bytes.
+        """
+        lru_keys = sorted(manifest, key=lambda k: manifest[k]["last_access"])
+        total_size = sum(entry["size"] for entry in manifest.values())
+
+        for key in lru_keys:
+            if total_size <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+
+            total_size -= manifest[key]["size"]
+            self._remove_files(manifest.pop(key))
+
+        return
+
+    def _remove_files(self, entry):
+        # Renamed first so that the entry disappears at once, then removed
+        path = os.path.join(self.cache_dir, entry["file"])
+        if os.path.exists(path):
+            tmp_path = unique_tmp_path(path)
+            os.replace(path, tmp_path)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+
+    def purge(self, keys=None):
+        """
+        Remove provided cache entries (all entries if keys is None).
+
+        Return : list of removed keys
+        """
+        with self._lock():
+            manifest = self._load_manifest()
+            keys = list(manifest) if keys is None else [k for k in keys if k in manifest]
+
+            for key in keys:
+                self._remove_files(manifest.pop(key))
+            self._save_manifest(manifest)
+
+        return keys
+
+
+def get_nilm_dataset_cached(
+    data_builder, house_indicies, cache=None, n_jobs=1, mmap_mode="r", virtual=False
+):
+    """
+    Get NILM dataset from a DataBuilder, reading it from the cache if already built with same inputs.
+
+    Cached data is returned as a np.memmap opened with mmap_mode ('r': read-only, 'c': copy-on-write).
+    If virtual, windows are not materialized (NILMSeries, see DataBuilder.get_nilm_dataset).
+
+    Return : see DataBuilder.get_nilm_dataset
+    """
+    if cache is None:
+        return data_builder.get_nilm_dataset(
+            house_indicies, n_jobs=n_jobs, virtual=virtual
+        )
+
+    key, description = dataset_cache_key(data_builder, house_indicies, virtual=virtual)
+    cached = cache.get(key, mmap_mode=mmap_mode)
+
+    if cached is not None:
+        logging.info(f"Loading cached data {key}")
+        return cached
+
+    with cache.build_lock(key):
+        # Entry built by a concurrent run while waiting for the lock
+        cached = cache.get(key, mmap_mode=mmap_mode)
+        if cached is not None:
+            logging.info(f"Loading cached data {key}")
+            return cached
+
+        if virtual:
+            # Continuous series are small enough to be built in memory
+            data, st_date = data_builder.get_nilm_dataset(
+                house_indicies, n_jobs=n_jobs, virtual=True
+            )
+            cache.put(key, data, st_date, description=description)
+            del data
+        else:
+            # Windows directly written in the cache entry (never held in memory)
+            cache.build(
+                key,
+                lambda out_file: data_builder.get_nilm_dataset(
+                    house_indicies, n_jobs=n_jobs, out_file=out_file
+                ),
+                description=description,
+            )
+        logging.info(f"Cached data saved as {key}")
+
+    return cache.get(key, mmap_mode=mmap_mode)
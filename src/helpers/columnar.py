@@ -0,0 +1,161 @@
+#################################################################################################################
+#
+# @copyright : ©2025 EDF
+# @author : Adrien Petralia
+# @description : NILMFormer - Columnar (Parquet) raw data store
+#
+#################################################################################################################
+
+import os
+import glob
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+def _check_pyarrow():
+    if pq is None:
+        raise ImportError(
+            "pyarrow is required to read or write the columnar raw data store, please install it (e.g. 'uv sync --extra columnar')."
+        )
+
+
+def columnar_path(file):
+    """
+    Path of the columnar (Parquet) version of a raw text file.
+    """
+    return os.path.splitext(file)[0] + ".parquet"
+
+
+def has_columnar(file):
+    """
+    Check if the columnar version of a raw text file exists.
+    """
+    return os.path.isfile(columnar_path(file))
+
+
+def read_columnar(file, columns=None):
+    """
+    Read columnar version of a raw text file, only loading the requested columns (if available in the file).
+
+    Return : pd.core.frame.DataFrame instance
+    """
+    _check_pyarrow()
+    path = columnar_path(file)
+
+    if columns is not None:
+        available = set(pq.read_schema(path).names)
+        columns = [c for c in columns if c in available]
+
+    return pq.read_table(path, columns=columns).to_pandas()
+
+
+def write_columnar(df, file):
+    """
+    Write a DataFrame as the columnar version of a raw text file.
+    """
+    _check_pyarrow()
+    df.to_parquet(columnar_path(file), index=False, engine="pyarrow")
+    return
+
+
+def _to_float32(df, exclude):
+    for col in df.columns:
+        if col not in exclude:
+            df[col] = df[col].astype(np.float32)
+    return df
+
+
+# ===================== Raw data conversion ===================== #
+def convert_ukdale(data_path, house_indicies=None):
+    """
+    Convert UKDALE 'House{i}/channel_{n}.dat' files to 'House{i}/channel_{n}.parquet' files.
+
+    Columns: 'time' (int64 unix timestamp) and 'power' (float32).
+    """
+    if house_indicies is None:
+        path_houses = sorted(glob.glob(os.path.join(data_path, "House*")))
+    else:
+        path_houses = [os.path.join(data_path, f"House{i}") for i in house_indicies]
+
+    for path_house in path_houses:
+        for file in sorted(glob.glob(os.path.join(path_house, "channel_*.dat"))):
+            channel = pd.read_csv(
+                file,
+                sep=" ",
+                header=None,
+                usecols=[0, 1],
+                names=["time", "power"],
+                dtype={"time": np.int64, "power": np.float32},
+            )
+            write_columnar(channel, file)
+
+    return
+
+
+def convert_refit(data_path, house_indicies=None):
+    """
+    Convert REFIT 'CLEAN_House{i}.csv' files to 'CLEAN_House{i}.parquet' files.
+
+    Columns are named according to HOUSES_Labels: 'Time' (int64 timestamp in ns),
+    appliances power (float32) and 'Issues' (int8).
+    """
+    labels_houses = pd.read_csv(os.path.join(data_path, "HOUSES_Labels")).set_index(
+        "House_id"
+    )
+
+    if house_indicies is None:
+        house_indicies = list(labels_houses.index)
+
+    for indice in house_indicies:
+        file = os.path.join(data_path, f"CLEAN_House{indice}.csv")
+        if not os.path.isfile(file):
+            continue
+
+        house_data = pd.read_csv(file)
+        house_data.columns = list(labels_houses.loc[int(indice)].values)
+        house_data = house_data.drop(columns=["Unix"])
+        house_data["Time"] = (
+            pd.to_datetime(house_data["Time"]).values.astype("datetime64[ns]").astype(np.int64)
+        )
+        house_data["Issues"] = house_data["Issues"].astype(np.int8)
+        house_data = _to_float32(house_data, exclude=["Time", "Issues"])
+
+        write_columnar(house_data, file)
+
+    return
+
+
+def pecanstreet_house_file(data_path, dataid):
+    """
+    Path of the (text-like) per house file of PecanStreet: its columnar version is the per house Parquet file.
+    """
+    return os.path.join(data_path, "1minute_data_austin", f"{int(dataid)}.csv")
+
+
+def convert_pecanstreet(data_path):
+    """
+    Convert PecanStreet '1minute_data_austin.csv' to one '1minute_data_austin/{dataid}.parquet' file per house.
+
+    Columns: 'localminute' (int64 UTC timestamp in ns) and power columns (float32).
+    """
+    df = pd.read_csv(os.path.join(data_path, "1minute_data_austin.csv"))
+    df["localminute"] = (
+        pd.to_datetime(df["localminute"], utc=True)
+        .values.astype("datetime64[ns]")
+        .astype(np.int64)
+    )
+
+    os.makedirs(os.path.join(data_path, "1minute_data_austin"), exist_ok=True)
+
+    for dataid, house in df.groupby("dataid", sort=False):
+        house = house.drop(columns=["dataid"]).sort_values("localminute")
+        house = _to_float32(house.reset_index(drop=True), exclude=["localminute"])
+        write_columnar(house, pecanstreet_house_file(data_path, dataid))
+
+    return
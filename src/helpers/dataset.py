@@ -6,10 +6,321 @@
 #
 #################################################################################################################
 
+import copy
 import torch
 import numpy as np
 import pandas as pd
 
+from numpy.lib.stride_tricks import sliding_window_view
+from pandas.tseries.frequencies import to_offset
+
+from src.helpers.exogene import calendar_codes, exogene_lut, apply_exogene_lut
+from src.helpers.distributed import get_rank, get_world_size
+
+
+class _MemmapRef(object):
+    """
+    Picklable reference to a np.memmap (file, dtype, shape, offset, order), reopened read-only.
+    """
+
+    def __init__(self, memmap):
+        self.filename = memmap.filename
+        self.dtype = memmap.dtype.str
+        self.shape = memmap.shape
+        self.offset = memmap.offset
+        self.order = "F" if np.isfortran(memmap) else "C"
+
+    def open(self):
+        return np.memmap(
+            self.filename,
+            dtype=self.dtype,
+            mode="r",
+            shape=self.shape,
+            offset=self.offset,
+            order=self.order,
+        )
+
+
+class SharedArraysMixin(object):
+    """
+    Hold large backing arrays of a dataset in torch shared-memory tensors.
+
+    DataLoader worker processes then map one physical copy of the arrays: tensors are sent by handle
+    when the dataset is pickled to spawned workers, and never written (no copy-on-write) with forked workers.
+    Arrays already backed by a file (np.memmap, NILMArrayView) are left as is.
+    """
+
+    def _share_arrays(self, *names):
+        self._shared_tensors = {}
+
+        for name in names:
+            array = getattr(self, name, None)
+            if type(array) is not np.ndarray:
+                continue
+
+            tensor = torch.from_numpy(np.ascontiguousarray(array)).share_memory_()
+            self._shared_tensors[name] = tensor
+            setattr(self, name, tensor.numpy())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in state.get("_shared_tensors", {}):
+            # NumPy views are rebuilt from the shared tensors (not pickled by value)
+            state[name] = None
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name, tensor in state.get("_shared_tensors", {}).items():
+            setattr(self, name, tensor.numpy())
+
+
+class NILMArrayView(object):
+    """
+    Out-of-core NILM dataset: lazy view over rows of a 4D array kept on disk (np.memmap, e.g. a cached dataset)
+
+    [N_sequences, Card[Agg_Power, 1_appliance,.., M_appliance], 2-dim:0:Power/1:States, Window Length]
+
+    - rows: np.ndarray of rows of data in the view (None: all rows), taking rows (take) only composes indexes
+    - scalers: NILMscaler instances applied (in order) to rows read, i.e. scaling is computed per batch on access
+
+    Indexing (view[idx], view[idx, 0, :1, :], ...) reads rows by chunks of chunk_size rows and returns np.ndarray.
+    """
+
+    def __init__(self, data, rows=None, scalers=(), chunk_size=4096):
+        self.data = data
+        self.rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+        self.scalers = tuple(scalers)
+        self.chunk_size = chunk_size
+
+    def __getstate__(self):
+        # Reopen memory maps in worker processes instead of pickling their content
+        state = self.__dict__.copy()
+        for name, value in state.items():
+            if isinstance(value, np.memmap) and value.filename is not None:
+                state[name] = _MemmapRef(value)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            if isinstance(value, _MemmapRef):
+                state[name] = value.open()
+        self.__dict__.update(state)
+
+    def _replace(self, **kwargs):
+        # Same view with some attributes replaced (underlying data shared)
+        view = copy.copy(self)
+        view.__dict__.update(kwargs)
+        return view
+
+    def _n_base_rows(self):
+        return len(self.data)
+
+    @property
+    def shape(self):
+        return (len(self),) + self.data.shape[1:]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        return self._n_base_rows() if self.rows is None else len(self.rows)
+
+    def _base_rows(self, rows):
+        """
+        Rows of the underlying array of provided rows of the view (int, slice, indexes or boolean mask).
+        """
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(len(self)))
+        else:
+            rows = np.asarray(rows)
+            if rows.dtype == bool:
+                rows = np.flatnonzero(rows)
+            rows = np.where(rows < 0, rows + len(self), rows).astype(np.int64).ravel()
+
+        return rows if self.rows is None else self.rows[rows]
+
+    def _gather(self, base_rows):
+        """
+        Read (in memory) rows of the underlying array.
+        """
+        if len(base_rows) and np.array_equal(
+            base_rows, np.arange(base_rows[0], base_rows[0] + len(base_rows))
+        ):
+            return np.array(self.data[base_rows[0] : base_rows[0] + len(base_rows)])
+
+        return np.array(self.data[base_rows])
+
+    def _read(self, base_rows):
+        """
+        Read (in memory) and scale rows of the underlying array.
+        """
+        block = self._gather(base_rows)
+
+        for scaler in self.scalers:
+            block = scaler.transform(block)
+
+        return block
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows, rest = key[0], (slice(None),) + key[1:]
+
+        is_scalar = not isinstance(rows, slice) and np.ndim(rows) == 0
+        base_rows = self._base_rows(rows)
+
+        out = [
+            self._read(base_rows[start : start + self.chunk_size])[rest]
+            for start in range(0, len(base_rows), self.chunk_size)
+        ]
+        out = np.concatenate(out) if len(out) else self._read(base_rows)[rest]
+
+        return out[0] if is_scalar else out
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+    def take(self, indices, axis=0):
+        """
+        View of provided rows (no read).
+        """
+        assert axis == 0, "NILMArrayView only supports taking rows (axis=0)."
+        return self._replace(rows=self._base_rows(indices))
+
+    def copy(self):
+        # Underlying data is never modified: copying the view is enough
+        return self._replace()
+
+    def with_scaler(self, scaler):
+        """
+        View scaled by provided (fitted) NILMscaler on access.
+        """
+        return self._replace(scalers=self.scalers + (scaler,))
+
+    def chunk_stats(self, channel):
+        """
+        Mean, std, min and max of one channel (power of the provided appliance, 0 for aggregate) computed by chunks
+        (mean and std in float64, min and max in data dtype).
+
+        Return : dict
+        """
+        return chunked_stats(
+            (
+                self[start : start + self.chunk_size, channel, 0, :]
+                for start in range(0, len(self), self.chunk_size)
+            ),
+            self.dtype,
+        )
+
+
+def chunked_stats(chunks, dtype):
+    """
+    Mean, std, min and max of values provided by chunks (iterable of np.ndarray), in one pass
+    (mean and std in float64, min and max in dtype).
+
+    Return : dict
+    """
+    n, mean, m2 = 0, 0.0, 0.0
+    vmin, vmax = np.inf, -np.inf
+
+    for values in chunks:
+        if values.size == 0:
+            continue
+
+        # Chan et al. parallel update of mean and sum of squared deviations
+        chunk_mean = values.mean(dtype=np.float64)
+        chunk_m2 = np.square(values - chunk_mean, dtype=np.float64).sum()
+        delta = chunk_mean - mean
+        n_tot = n + values.size
+        mean += delta * values.size / n_tot
+        m2 += chunk_m2 + delta**2 * n * values.size / n_tot
+        n = n_tot
+
+        vmin = min(vmin, values.min())
+        vmax = max(vmax, values.max())
+
+    return {
+        "mean": np.float64(mean),
+        "std": np.float64(np.sqrt(m2 / n)) if n else np.float64(np.nan),
+        "min": np.dtype(dtype).type(vmin),
+        "max": np.dtype(dtype).type(vmax),
+    }
+
+
+class NILMSeries(NILMArrayView):
+    """
+    Virtual NILM dataset: continuous series of each house stored once, windows built on access
+
+    Overlapping windows (window_stride < window_size) are not materialized: a window is a view of the series,
+    only windows read (batch) are copied. Same interface as NILMArrayView (take, lazy scaling, chunked statistics).
+
+    - series: np.ndarray (or np.memmap) of size [2 * M_appliances, T], continuous stems of all houses
+              concatenated, ordered as (load curve, states) of aggregate then of each appliance
+    - starts: np.ndarray of size [N_sequences], starting index in series of each (valid) window
+    - spans: np.ndarray of size [N_spans, 2], [start, end) indexes in series of maximal NaN-free runs of each house
+             (at least window_size long), any window inside a span is valid (see NILMRandomCropDataset)
+    - span_st_date: pd.DataFrame of the timestamp of the first value of each span (index: house id,
+                    column 'start_date'), same convention as st_date
+    - skip_all_off: if True, windows where all appliances are OFF are not indexed in starts (nor cropped)
+    """
+
+    def __init__(
+        self,
+        series,
+        starts,
+        window_size,
+        spans=None,
+        span_st_date=None,
+        skip_all_off=False,
+        rows=None,
+        scalers=(),
+        chunk_size=4096,
+    ):
+        super().__init__(series, rows=rows, scalers=scalers, chunk_size=chunk_size)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.window_size = window_size
+        self.spans = None if spans is None else np.asarray(spans, dtype=np.int64)
+        self.span_st_date = span_st_date
+        self.skip_all_off = skip_all_off
+
+    def _n_base_rows(self):
+        return len(self.starts)
+
+    @property
+    def shape(self):
+        return (len(self), self.data.shape[0] // 2, 2, self.window_size)
+
+    def _gather(self, base_rows):
+        return self._gather_at(self.starts[base_rows])
+
+    def _gather_at(self, starts):
+        # View of all windows as [2 * M_appliances, T - Win_Size + 1, Win_Size] (no copy)
+        windows = sliding_window_view(self.data, self.window_size, axis=1)
+        block = windows[:, starts].transpose(1, 0, 2)
+
+        return np.ascontiguousarray(block).reshape((len(starts),) + self.shape[1:])
+
+    def read_at(self, starts):
+        """
+        Read (and scale) windows starting at provided indexes of the series (not limited to indexed windows).
+
+        Return : np.ndarray of size [len(starts), M_appliances, 2, Win_Size]
+        """
+        block = self._gather_at(np.asarray(starts, dtype=np.int64))
+
+        for scaler in self.scalers:
+            block = scaler.transform(block)
+
+        return block
+
 
 class NILMscaler:
     """
@@ -17,6 +328,10 @@ class NILMscaler:
 
     Nilm data need to be 4D Numpy array following the convention:
     [N_sequences, Card[Agg_Power, 1_appliance,.., M_appliance], 2-dim:0:Power/1:States, Window Length]
+    (float64, or float32/float16 for compact datasets: statistics are computed in float64)
+
+    or a NILMArrayView (out-of-core dataset) or NILMShards (sharded dataset): statistics are computed by chunks,
+    and transform returns a view scaled on access instead of scaling data inplace
 
     Follow sklearn convention (fit/transform/fit_transform) and is callable
     """
@@ -72,28 +387,28 @@ class NILMscaler:
         return scale_data_train, scale_data_test
 
     def fit(self, data):
+        stat = self._stats_getter(data)
+
         if isinstance(self.power_scaling_type, int):
             self.power_stat1 = 0
             self.power_stat2 = self.power_scaling_type
         elif self.power_scaling_type == "StandardScaling":
-            self.power_stat1 = data[:, 0, 0, :].mean()
-            self.power_stat2 = data[:, 0, 0, :].std()
+            self.power_stat1 = stat(0, "mean")
+            self.power_stat2 = stat(0, "std")
         elif self.power_scaling_type == "MinMaxScaling":
-            self.power_stat1 = data[:, 0, 0, :].min()
-            self.power_stat2 = data[:, 0, 0, :].max()
+            self.power_stat1 = stat(0, "min")
+            self.power_stat2 = stat(0, "max")
         elif self.power_scaling_type == "MeanScaling":
             self.power_stat1 = 0
-            self.power_stat2 = data[:, 0, 0, :].mean()
+            self.power_stat2 = stat(0, "mean")
         elif (
             self.power_scaling_type == "MeanMaxScaling"
             or self.power_scaling_type == "MaxScaling"
         ):
             self.power_stat1 = (
-                data[:, 0, 0, :].mean()
-                if self.power_scaling_type == "MeanMaxScaling"
-                else 0
+                stat(0, "mean") if self.power_scaling_type == "MeanMaxScaling" else 0
             )
-            self.power_stat2 = data[:, 0, 0, :].max()
+            self.power_stat2 = stat(0, "max")
 
         if self.appliance_scaling_type is not None:
             self.n_appliance = data.shape[1] - 1
@@ -102,20 +417,20 @@ class NILMscaler:
                 self.appliance_stat1.append(0)
                 self.appliance_stat2.append(self.appliance_scaling_type)
             elif self.appliance_scaling_type == "StandardScaling":
-                self.appliance_stat1.append(data[:, 1, 0, :].mean())
-                self.appliance_stat2.append(data[:, 1, 0, :].std())
+                self.appliance_stat1.append(stat(1, "mean"))
+                self.appliance_stat2.append(stat(1, "std"))
             elif self.appliance_scaling_type == "MinMax":
-                self.appliance_stat1.append(data[:, 1, 0, :].min())
-                self.appliance_stat2.append(data[:, 1, 0, :].max())
+                self.appliance_stat1.append(stat(1, "min"))
+                self.appliance_stat2.append(stat(1, "max"))
             elif (
                 self.appliance_scaling_type == "MeanMaxScaling"
                 or self.appliance_scaling_type == "MaxScaling"
             ):
                 if self.appliance_scaling_type == "MeanMaxScaling":
-                    self.appliance_stat1.append(data[:, 1, 0, :].mean())
+                    self.appliance_stat1.append(stat(1, "mean"))
                 else:
                     self.appliance_stat1.append(0)
-                self.appliance_stat2.append(data[:, 1, 0, :].max())
+                self.appliance_stat2.append(stat(1, "max"))
             elif self.appliance_scaling_type == "SameAsPower":
                 self.appliance_stat1.append(self.power_stat1)
                 self.appliance_stat2.append(self.power_stat2)
@@ -124,9 +439,36 @@ class NILMscaler:
 
         return
 
+    def _stats_getter(self, data):
+        """
+        Return : function (channel, stat name) -> statistic of power values of channel (0: aggregate)
+        """
+        if hasattr(data, "chunk_stats"):
+            # Out-of-core data (NILMArrayView, NILMShards)
+            stats = {}
+
+            def stat(channel, name):
+                # All statistics of a channel computed in one pass over chunks
+                if channel not in stats:
+                    stats[channel] = data.chunk_stats(channel)
+                return stats[channel][name]
+
+        else:
+
+            def stat(channel, name):
+                values = data[:, channel, 0, :]
+                if name in ["mean", "std"]:
+                    return getattr(values, name)(dtype=np.float64)
+                return getattr(values, name)()
+
+        return stat
+
     def transform(self, data):
         assert self.is_fitted, "Not fitted yet."
 
+        if hasattr(data, "with_scaler"):
+            return data.with_scaler(self)
+
         if self.power_scaling_type == "MinMax":
             data[:, 0, 0, :] = (data[:, 0, 0, :] - self.power_stat1) / (
                 self.power_stat2 - self.power_stat1
@@ -169,7 +511,8 @@ class NILMscaler:
         return data
 
     def inverse_transform(self, data):
-        rescale_data = data.copy()
+        # Rescale at least in float32 (compact float16 dataset would lose precision)
+        rescale_data = data.astype(np.promote_types(data.dtype, np.float32))
         assert len(rescale_data.shape) < 5, "Data containing too many dimensions (>5)."
         if len(rescale_data.shape) < 4:
             flag = True
@@ -221,7 +564,7 @@ class NILMscaler:
             if len(rescale_data.shape) == 2:
                 rescale_data = rescale_data.unsqueeze(0)
         else:
-            rescale_data = data.copy()
+            rescale_data = data.astype(np.promote_types(data.dtype, np.float32))
             if len(rescale_data.shape) == 2:
                 rescale_data = np.expand_dims(rescale_data, axis=0)
 
@@ -253,7 +596,7 @@ class NILMscaler:
             if len(rescale_data.shape) == 2:
                 rescale_data = rescale_data.unsqueeze(0)
         else:
-            rescale_data = data.copy()
+            rescale_data = data.astype(np.promote_types(data.dtype, np.float32))
             if len(rescale_data.shape) == 2:
                 rescale_data = np.expand_dims(rescale_data, axis=0)
 
@@ -307,11 +650,13 @@ class TSDataset(torch.utils.data.Dataset):
             return self.samples[idx], self.labels[idx]
 
 
-class TSDatasetScaling(torch.utils.data.Dataset):
+class TSDatasetScaling(SharedArraysMixin, torch.utils.data.Dataset):
     """
     MAP-Style PyTorch Time series Dataset
 
     Scaling computed on the fly
+
+    - share_memory, Boolean : hold samples, labels and calendar codes in shared memory (see SharedArraysMixin)
     """
 
     def __init__(
@@ -326,6 +671,7 @@ class TSDatasetScaling(torch.utils.data.Dataset):
         freq="30T",
         cosinbase=True,
         newRange=(-1, 1),
+        share_memory=False,
     ):
         self.scale_data = scale_data
         self.inst_scaling = inst_scaling
@@ -350,6 +696,18 @@ class TSDatasetScaling(torch.utils.data.Dataset):
                 self.n_var = 2 * len(self.list_exo_variables)
             else:
                 self.n_var = len(self.list_exo_variables)
+
+            # Calendar codes computed once for all samples, encodings in a lookup table
+            # (month, dom and dow shifted by -1 in sin/cos encodings for this dataset)
+            self.exo_codes = calendar_codes(
+                self.st_date, self.L, self.freq, self.list_exo_variables
+            )
+            self.exo_lut = exogene_lut(
+                self.list_exo_variables,
+                cosinbase=self.cosinbase,
+                newRange=self.newRange,
+                shifted=("month", "dom", "dow"),
+            )
         else:
             self.n_var = None
 
@@ -379,76 +737,12 @@ class TSDatasetScaling(torch.utils.data.Dataset):
         else:
             self.labels = labels
 
-    def _create_exogene(self, idx):
-        np_extra = np.zeros((self.n_var, self.L)).astype(np.float32)
-        tmp = pd.date_range(start=self.st_date[idx], periods=self.L, freq=self.freq)
-
-        k = 0
-        for exo_var in self.list_exo_variables:
-            if exo_var == "month":
-                if self.cosinbase:
-                    np_extra[k, :] = np.sin(2 * np.pi * (tmp.month.values - 1) / 12.0)
-                    np_extra[k + 1, :] = np.cos(
-                        2 * np.pi * (tmp.month.values - 1) / 12.0
-                    )
-                    k += 2
-                else:
-                    np_extra[k, :] = self._normalize(
-                        tmp.month.values, xmin=1, xmax=12, newRange=self.newRange
-                    )
-                    k += 1
-            elif exo_var == "dom":
-                if self.cosinbase:
-                    np_extra[k, :] = np.sin(2 * np.pi * (tmp.day.values - 1) / 31.0)
-                    np_extra[k + 1, :] = np.cos(2 * np.pi * (tmp.day.values - 1) / 31.0)
-                    k += 2
-                else:
-                    np_extra[k, :] = self._normalize(
-                        tmp.month.values, xmin=1, xmax=12, newRange=self.newRange
-                    )
-                    k += 1
-            elif exo_var == "dow":
-                if self.cosinbase:
-                    np_extra[k, :] = np.sin(
-                        2 * np.pi * (tmp.dayofweek.values - 1) / 7.0
-                    )
-                    np_extra[k + 1, :] = np.cos(
-                        2 * np.pi * (tmp.dayofweek.values - 1) / 7.0
-                    )
-                    k += 2
-                else:
-                    np_extra[k, :] = self._normalize(
-                        tmp.month.values, xmin=1, xmax=7, newRange=self.newRange
-                    )
-                    k += 1
-            elif exo_var == "hour":
-                if self.cosinbase:
-                    np_extra[k, :] = np.sin(2 * np.pi * tmp.hour.values / 24.0)
-                    np_extra[k + 1, :] = np.cos(2 * np.pi * tmp.hour.values / 24.0)
-                    k += 2
-                else:
-                    np_extra[k, :] = self._normalize(
-                        tmp.month.values, xmin=0, xmax=24, newRange=self.newRange
-                    )
-                    k += 1
-            elif exo_var == "minute":
-                if self.cosinbase:
-                    np_extra[k, :] = np.sin(2 * np.pi * tmp.minute.values / 60.0)
-                    np_extra[k + 1, :] = np.cos(2 * np.pi * tmp.minute.values / 60.0)
-                    k += 2
-                else:
-                    np_extra[k, :] = self.normalize(
-                        tmp.minute.values, xmin=0, xmax=60, newRange=self.newRange
-                    )
-                    k += 1
-            else:
-                raise ValueError(
-                    "Embedding unknown for these Data. Only 'month', 'dow', 'dom', 'hour', 'minute' supported, received {}".format(
-                        exo_var
-                    )
-                )
+        if share_memory:
+            self._share_arrays("samples", "labels", "exo_codes")
 
-        return np_extra
+    def _create_exogene(self, idx):
+        # Encodings gathered from precomputed calendar codes (see src/helpers/exogene.py)
+        return apply_exogene_lut(self.exo_lut, self.exo_codes[idx])
 
     def _normalize(self, x, xmin, xmax, newRange):
         if xmin is None:
@@ -486,13 +780,17 @@ class TSDatasetScaling(torch.utils.data.Dataset):
             return tmp_sample.astype(np.float32), self.labels[idx]
 
 
-class NILMDataset(torch.utils.data.Dataset):
+class NILMDataset(SharedArraysMixin, torch.utils.data.Dataset):
     """
     Pytorch dataset
 
     - X, 4D Numpy array : N subsequences, M appliances, Power/Activation, Values
     - st_date, pd.dataframe : Starting date of each subsequence
     - scaler, Boolean : True if apply scaling
+    - timestamp_encoding, Boolean : return (Aggregate, int64 start timestamp) instead of materialized
+      exogene channels, encoded in the model (see src/nilmformer/layers/timestamp.py)
+    - share_memory, Boolean : hold X, cam and calendar codes in shared memory for DataLoader workers
+      (see SharedArraysMixin, out-of-core X excepted)
     """
 
     def __init__(
@@ -508,10 +806,13 @@ class NILMDataset(torch.utils.data.Dataset):
         cosinbase=True,
         newRange=(-1, 1),
         inst_scaling=False,
+        timestamp_encoding=False,
+        share_memory=False,
     ):
         self.samples = X
 
         self.pretraining = pretraining
+        self.timestamp_encoding = timestamp_encoding
         self.use_temperature = use_temperature
         self.inst_scaling = inst_scaling
 
@@ -539,8 +840,26 @@ class NILMDataset(torch.utils.data.Dataset):
                 self.n_var = 2 * len(self.list_exo_variables)
             else:
                 self.n_var = len(self.list_exo_variables)
+
+            if self.timestamp_encoding:
+                assert self.cosinbase and cam is None, (
+                    "timestamp_encoding only supported with cosinbase encoding and without cam."
+                )
+                # Start timestamps as int64 (ns since epoch)
+                self.st_timestamps = pd.DatetimeIndex(self.st_date).as_unit("ns").asi8
+            else:
+                # Calendar codes computed once for all samples, encodings in a lookup table
+                self.exo_codes = calendar_codes(
+                    self.st_date, self.L, self.freq, self.list_exo_variables
+                )
+                self.exo_lut = exogene_lut(
+                    self.list_exo_variables,
+                    cosinbase=self.cosinbase,
+                    newRange=self.newRange,
+                )
         else:
             self.n_var = None
+            self.timestamp_encoding = False
 
         if cam is not None:
             self.cam = cam
@@ -549,70 +868,12 @@ class NILMDataset(torch.utils.data.Dataset):
         else:
             self.cam = None
 
-    def _create_exogene(self, idx):
-        np_extra = np.zeros((self.n_var, self.L)).astype(np.float32)
-        tmp = pd.date_range(start=self.st_date[idx], periods=self.L, freq=self.freq)
-
-        k = 0
-        for exo_var in self.list_exo_variables:
-            if exo_var == "month":
-                if self.cosinbase:
-                    np_extra[k, :] = np.sin(2 * np.pi * tmp.month.values / 12.0)
-                    np_extra[k + 1, :] = np.cos(2 * np.pi * tmp.month.values / 12.0)
-                    k += 2
-                else:
-                    np_extra[k, :] = self._normalize(
-                        tmp.month.values, xmin=1, xmax=12, newRange=self.newRange
-                    )
-                    k += 1
-            elif exo_var == "dom":
-                if self.cosinbase:
-                    np_extra[k, :] = np.sin(2 * np.pi * tmp.day.values / 31.0)
-                    np_extra[k + 1, :] = np.cos(2 * np.pi * tmp.day.values / 31.0)
-                    k += 2
-                else:
-                    np_extra[k, :] = self._normalize(
-                        tmp.day.values, xmin=1, xmax=31, newRange=self.newRange
-                    )
-                    k += 1
-            elif exo_var == "dow":
-                if self.cosinbase:
-                    np_extra[k, :] = np.sin(2 * np.pi * tmp.dayofweek.values / 7.0)
-                    np_extra[k + 1, :] = np.cos(2 * np.pi * tmp.dayofweek.values / 7.0)
-                    k += 2
-                else:
-                    np_extra[k, :] = self._normalize(
-                        tmp.dayofweek.values, xmin=1, xmax=7, newRange=self.newRange
-                    )
-                    k += 1
-            elif exo_var == "hour":
-                if self.cosinbase:
-                    np_extra[k, :] = np.sin(2 * np.pi * tmp.hour.values / 24.0)
-                    np_extra[k + 1, :] = np.cos(2 * np.pi * tmp.hour.values / 24.0)
-                    k += 2
-                else:
-                    np_extra[k, :] = self._normalize(
-                        tmp.hour.values, xmin=0, xmax=24, newRange=self.newRange
-                    )
-                    k += 1
-            elif exo_var == "minute":
-                if self.cosinbase:
-                    np_extra[k, :] = np.sin(2 * np.pi * tmp.minute.values / 60.0)
-                    np_extra[k + 1, :] = np.cos(2 * np.pi * tmp.minute.values / 60.0)
-                    k += 2
-                else:
-                    np_extra[k, :] = self.normalize(
-                        tmp.minute.values, xmin=0, xmax=60, newRange=self.newRange
-                    )
-                    k += 1
-            else:
-                raise ValueError(
-                    "Embedding unknown for these Data. Only 'month', 'dow', 'dom', 'hour', 'minute' supported, received {}".format(
-                        exo_var
-                    )
-                )
+        if share_memory:
+            self._share_arrays("samples", "cam", "exo_codes", "st_timestamps")
 
-        return np_extra
+    def _create_exogene(self, idx):
+        # Encodings gathered from precomputed calendar codes (see src/helpers/exogene.py)
+        return apply_exogene_lut(self.exo_lut, self.exo_codes[idx])
 
     def _normalize(self, x, xmin=None, xmax=None, newRange=(-1, 1)):
         if xmin is None:
@@ -648,7 +909,9 @@ class NILMDataset(torch.utils.data.Dataset):
                 np.std(tmp_sample, axis=1, keepdims=True) + 1e-9
             )
 
-        if self.n_var is not None:
+        if self.timestamp_encoding:
+            tmp_sample = (tmp_sample, self.st_timestamps[idx])
+        elif self.n_var is not None:
             exo = self._create_exogene(idx)
             tmp_sample = np.concatenate((tmp_sample, exo), axis=0)
 
@@ -663,3 +926,395 @@ class NILMDataset(torch.utils.data.Dataset):
                 self.samples[idx, 1:2, 0, :],
                 self.samples[idx, 1:2, 1, :],
             )
+
+
+class NILMTensorDataset(torch.utils.data.Dataset):
+    """
+    Pytorch dataset returning whole batches, for NILM datasets held in memory
+
+    Model inputs (Aggregate/Temp and precomputed exogene channels), appliance power and activation states
+    are preloaded as contiguous float32 tensors: a batch is gathered with one index_select per tensor
+    instead of collating per sample __getitem__ outputs.
+
+    Indexed by a list of indices (use with a BatchSampler and DataLoader(batch_size=None), see get_batch_loader).
+    Same arguments as NILMDataset (cam and pretraining excepted): with share_memory, tensors are moved in shared memory.
+    """
+
+    def __init__(
+        self,
+        X,
+        list_exo_variables=[],
+        use_temperature=False,
+        st_date=None,
+        mask_date="start_date",
+        freq=None,
+        cosinbase=True,
+        newRange=(-1, 1),
+        inst_scaling=False,
+        timestamp_encoding=False,
+        share_memory=False,
+    ):
+        self.L = X.shape[-1]
+        self.timestamp_encoding = timestamp_encoding and len(list_exo_variables) > 0
+
+        inputs = np.ascontiguousarray(
+            X[:, 0, : 2 if use_temperature else 1, :], dtype=np.float32
+        )
+
+        if inst_scaling:
+            inputs = (inputs - np.mean(inputs, axis=2, keepdims=True)) / (
+                np.std(inputs, axis=2, keepdims=True) + 1e-9
+            )
+
+        if len(list_exo_variables) > 0:
+            assert st_date is not None and freq is not None, (
+                "list_exo_variables provided: please provide st_date and freq to compute exogene variable."
+            )
+            start_dates = st_date[mask_date].values.flatten()
+
+            if self.timestamp_encoding:
+                assert cosinbase, "timestamp_encoding only supported with cosinbase encoding."
+                self.st_timestamps = torch.from_numpy(
+                    pd.DatetimeIndex(start_dates).as_unit("ns").asi8.copy()
+                )
+            else:
+                exo_lut = exogene_lut(
+                    list_exo_variables, cosinbase=cosinbase, newRange=newRange
+                )
+                codes = calendar_codes(start_dates, self.L, freq, list_exo_variables)
+                inputs = np.concatenate(
+                    (inputs, apply_exogene_lut(exo_lut, codes)), axis=1
+                )
+
+        self.inputs = torch.from_numpy(np.ascontiguousarray(inputs))
+        self.power = torch.from_numpy(np.ascontiguousarray(X[:, 1:2, 0, :], dtype=np.float32))
+        self.states = torch.from_numpy(np.ascontiguousarray(X[:, 1:2, 1, :], dtype=np.float32))
+
+        if share_memory:
+            for tensor in (self.inputs, self.power, self.states):
+                tensor.share_memory_()
+            if self.timestamp_encoding:
+                self.st_timestamps.share_memory_()
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def __getitem__(self, indices):
+        """
+        Return batch Tuple: Aggregate/Temp/Encoding, App. Power, App. Activation States
+        """
+        indices = torch.as_tensor(indices, dtype=torch.long)
+
+        inputs = self.inputs.index_select(0, indices)
+        if self.timestamp_encoding:
+            inputs = (inputs, self.st_timestamps.index_select(0, indices))
+
+        return (
+            inputs,
+            self.power.index_select(0, indices),
+            self.states.index_select(0, indices),
+        )
+
+
+def get_batch_loader(
+    dataset,
+    batch_size,
+    shuffle=False,
+    drop_last=False,
+    generator=None,
+    sampler=None,
+    **kwargs,
+):
+    """
+    DataLoader over a dataset indexed by batch of indices (NILMTensorDataset):
+    a BatchSampler yields the indices of each batch, the dataset gathers the whole batch (no collate).
+
+    sampler: sampler of indices (e.g. DistributedSampler), replaces shuffle
+    kwargs: other DataLoader arguments (num_workers, pin_memory, ...)
+    """
+    if sampler is None and shuffle:
+        sampler = torch.utils.data.RandomSampler(dataset, generator=generator)
+    elif sampler is None:
+        sampler = torch.utils.data.SequentialSampler(dataset)
+
+    return torch.utils.data.DataLoader(
+        dataset,
+        sampler=torch.utils.data.BatchSampler(
+            sampler, batch_size=batch_size, drop_last=drop_last
+        ),
+        batch_size=None,
+        **kwargs,
+    )
+
+
+class _NILMIterableDataset(torch.utils.data.IterableDataset):
+    """
+    Base of iterable NILM datasets streaming blocks of windows: same outputs as NILMDataset (cam and pretraining excepted)
+    """
+
+    def _init_inputs(
+        self,
+        list_exo_variables,
+        use_temperature,
+        freq,
+        cosinbase,
+        newRange,
+        inst_scaling,
+        timestamp_encoding,
+    ):
+        assert freq is not None or len(list_exo_variables) == 0, (
+            "Variable freq is None but list_exo_variables provided: please set freq according to data sampling rate."
+        )
+
+        self.list_exo_variables = list_exo_variables
+        self.use_temperature = use_temperature
+        self.freq = freq
+        self.inst_scaling = inst_scaling
+        self.timestamp_encoding = timestamp_encoding and len(list_exo_variables) > 0
+        self.epoch = 0
+        self._n_iter = 0
+
+        if len(list_exo_variables) > 0 and not self.timestamp_encoding:
+            self.exo_lut = exogene_lut(
+                list_exo_variables, cosinbase=cosinbase, newRange=newRange
+            )
+
+    def set_epoch(self, epoch):
+        """
+        Set epoch, mixed in the seed of the samples drawn (see _worker_info), called by trainers at each epoch.
+        """
+        self.epoch = epoch
+        return
+
+    def _needs_dates(self):
+        return len(self.list_exo_variables) > 0 or self.timestamp_encoding
+
+    def _worker_info(self):
+        """
+        In distributed training, workers of all processes are numbered globally: each process reads its own part.
+
+        Return : seed of the epoch (same for all DataLoader workers, drawn from torch RNG), worker id, number of workers
+        """
+        worker = torch.utils.data.get_worker_info()
+        if worker is None:
+            seed, worker_id, num_workers = int(torch.randint(2**62, (1,)).item()), 0, 1
+            n_iter = 0
+        else:
+            # Workers seeds are base_seed + worker id
+            seed, worker_id, num_workers = (
+                worker.seed - worker.id,
+                worker.id,
+                worker.num_workers,
+            )
+            # Persistent workers keep their base seed and their copy of the dataset (epoch of their creation):
+            # also mixed with the number of epochs they already read
+            n_iter = self._n_iter
+            self._n_iter += 1
+
+        # Seed mixed with the epoch: different samples at each epoch whatever the RNG state
+        seed = int(np.random.SeedSequence((seed, self.epoch, n_iter)).generate_state(1)[0])
+
+        return (
+            seed,
+            get_rank() * num_workers + worker_id,
+            get_world_size() * num_workers,
+        )
+
+    def _iter_samples(self, block, start_dates):
+        """
+        Yield samples of a block of windows [B, M_appliances, 2, Win_Size] starting at start_dates
+        (dates as read by NILMDataset from st_date values, None if no exogene variable).
+        """
+        inputs = block[:, 0, : 2 if self.use_temperature else 1, :]
+        if self.inst_scaling:
+            inputs = (inputs - np.mean(inputs, axis=2, keepdims=True)) / (
+                np.std(inputs, axis=2, keepdims=True) + 1e-9
+            )
+
+        if self.timestamp_encoding:
+            timestamps = pd.DatetimeIndex(start_dates).as_unit("ns").asi8
+        elif len(self.list_exo_variables) > 0:
+            codes = calendar_codes(start_dates, self.L, self.freq, self.list_exo_variables)
+            inputs = np.concatenate((inputs, apply_exogene_lut(self.exo_lut, codes)), axis=1)
+
+        for i in range(len(block)):
+            yield (
+                (inputs[i], timestamps[i]) if self.timestamp_encoding else inputs[i],
+                block[i, 1:2, 0, :],
+                block[i, 1:2, 1, :],
+            )
+
+
+def subtract_intervals(intervals, removed):
+    """
+    Parts of [start, end) intervals not covered by any of the removed [start, end) intervals.
+
+    Return : np.ndarray of size [N, 2] of remaining intervals, np.ndarray of size [N] of the index of their interval
+    """
+    intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+    removed = np.asarray(removed, dtype=np.int64).reshape(-1, 2)
+    if len(removed) == 0:
+        return intervals, np.arange(len(intervals))
+
+    # Merge removed intervals (sorted by start, end as running max)
+    removed = removed[np.argsort(removed[:, 0], kind="stable")]
+    r_start, r_end = removed[:, 0], np.maximum.accumulate(removed[:, 1])
+    new = np.r_[True, r_start[1:] > r_end[:-1]]
+    r_start, r_end = r_start[new], r_end[np.r_[np.flatnonzero(new)[1:] - 1, len(new) - 1]]
+
+    parts, index = [], []
+    for i, (start, end) in enumerate(intervals):
+        j0 = np.searchsorted(r_end, start, side="right")
+        j1 = np.searchsorted(r_start, end, side="left")
+        starts = np.maximum(np.r_[start, r_end[j0:j1]], start)
+        ends = np.minimum(np.r_[r_start[j0:j1], end], end)
+        keep = ends > starts
+        parts.append(np.stack([starts[keep], ends[keep]], axis=1))
+        index.append(np.full(keep.sum(), i, dtype=np.int64))
+
+    if not parts:
+        return intervals, np.arange(0)
+
+    return np.concatenate(parts), np.concatenate(index)
+
+
+class NILMRandomCropDataset(_NILMIterableDataset):
+    """
+    Pytorch iterable dataset of windows randomly cropped from continuous series, drawn again at each epoch
+
+    Start offsets are drawn uniformly among all valid (NaN-free) windows of the houses of st_date,
+    i.e. any offset inside the NaN-free spans of a NILMSeries: no window is materialized.
+    Cropped windows never overlap a window of the excluded splits (e.g. valid and test windows
+    of the same houses when splitting windows at random, as for UKDALE).
+    If windows where all appliances are OFF are skipped by the builder (NILMSeries skip_all_off, e.g. PecanStreet),
+    such crops are rejected and redrawn, so that crops follow the same distribution as fixed windows.
+
+    - data, NILMSeries (scaled view of a split, e.g. scaler.transform(data_train))
+    - st_date, pd.dataframe : Starting date of each window of data (only used to select houses of the split)
+    - exclude, list of (NILMSeries, pd.dataframe) : other splits (data, st_date), e.g. [(data_valid, st_date_valid), (data_test, st_date_test)]
+    - n_samples, int : number of windows drawn per epoch, over all processes in distributed training (default: number of windows of data)
+    - chunk_size, int : number of windows drawn and read at once
+
+    Same outputs as NILMDataset (cam and pretraining excepted).
+    Each epoch (and DataLoader worker) uses a different seed derived from torch RNG (reproducible with torch.manual_seed).
+    """
+
+    def __init__(
+        self,
+        data,
+        st_date,
+        n_samples=None,
+        exclude=(),
+        list_exo_variables=[],
+        use_temperature=False,
+        freq=None,
+        cosinbase=True,
+        newRange=(-1, 1),
+        inst_scaling=False,
+        timestamp_encoding=False,
+        chunk_size=1024,
+    ):
+        assert isinstance(data, NILMSeries) and data.spans is not None, (
+            "Random crop requires continuous series with their valid spans (NILMSeries, see virtual_windows)."
+        )
+        self._init_inputs(
+            list_exo_variables,
+            use_temperature,
+            freq,
+            cosinbase,
+            newRange,
+            inst_scaling,
+            timestamp_encoding,
+        )
+
+        self.data = data
+        self.n_samples = len(data) if n_samples is None else n_samples
+        self.chunk_size = chunk_size
+        self.L = data.window_size
+
+        # Spans of the houses of the split, weighted by their number of valid windows
+        houses = st_date.index.unique()
+        keep = np.flatnonzero(np.isin(np.asarray(data.span_st_date.index), houses))
+
+        # Crop starts [start, end - L + 1) of the spans, minus starts overlapping a window of the other splits
+        removed = []
+        for other, other_st_date in exclude:
+            if isinstance(other, NILMSeries) and other.data is data.data:
+                starts = other.starts if other.rows is None else other.starts[other.rows]
+                removed.append(np.stack([starts - self.L + 1, starts + self.L], axis=1))
+            elif np.isin(other_st_date.index.unique(), houses).any():
+                raise ValueError(
+                    "Random crop requires other splits sharing houses with the train split to be views of the same series."
+                )
+        crop_starts, index = subtract_intervals(
+            np.stack([data.spans[keep, 0], data.spans[keep, 1] - self.L + 1], axis=1),
+            np.concatenate(removed) if removed else [],
+        )
+
+        self.spans = np.stack([crop_starts[:, 0], crop_starts[:, 1] + self.L - 1], axis=1)
+        # Dates as read by NILMDataset from st_date values (UTC for timezone aware dates),
+        # of the first value of the original span and shift of the (cut) span from it
+        self.span_start_dates = pd.DatetimeIndex(
+            data.span_st_date["start_date"].values[keep[index]]
+        )
+        self.span_shifts = crop_starts[:, 0] - data.spans[keep[index], 0]
+        self.n_starts = crop_starts[:, 1] - crop_starts[:, 0]
+
+        if data.skip_all_off:
+            # Prefix-sums of ON timesteps: a crop is valid iff not all-OFF, answered in O(1)
+            # (imported here: preprocessing imports this module)
+            from src.helpers.preprocessing import ValidSpanIndex
+
+            self.cum_on = ValidSpanIndex(data.data, skip_all_off=True).cum_on
+            # Spans weighted by their number of valid (not all-OFF) crops
+            is_on = self.cum_on[self.L :] != self.cum_on[: -self.L]
+            cum_valid = np.zeros(len(is_on) + 1, dtype=np.int64)
+            np.cumsum(is_on, out=cum_valid[1:])
+            self.n_windows = cum_valid[crop_starts[:, 1]] - cum_valid[crop_starts[:, 0]]
+        else:
+            self.cum_on = None
+            self.n_windows = self.n_starts
+
+        if self.n_windows.sum() == 0:
+            raise ValueError(
+                "No valid window to crop in provided houses (outside windows of the excluded splits)."
+            )
+
+    def __len__(self):
+        return self.n_samples
+
+    def _draw(self, rng, n):
+        """
+        Draw n windows: starting index in series and starting date (None if no exogene variable).
+        """
+        k = rng.choice(len(self.spans), size=n, p=self.n_windows / self.n_windows.sum())
+        offsets = (rng.random(n) * self.n_starts[k]).astype(np.int64)
+
+        if self.cum_on is not None:
+            # All-OFF crops redrawn in their span: uniform over the valid crops of the span
+            redraw = np.arange(n)
+            while len(redraw):
+                starts = self.spans[k[redraw], 0] + offsets[redraw]
+                redraw = redraw[self.cum_on[starts + self.L] == self.cum_on[starts]]
+                offsets[redraw] = (rng.random(len(redraw)) * self.n_starts[k[redraw]]).astype(np.int64)
+
+        if self._needs_dates():
+            start_dates = self.span_start_dates[k] + (
+                self.span_shifts[k] + offsets
+            ) * pd.Timedelta(to_offset(self.freq))
+        else:
+            start_dates = None
+
+        return self.spans[k, 0] + offsets, start_dates
+
+    def __iter__(self):
+        # Samples of the epoch shared between workers, each drawing with its own seed
+        seed, worker_id, num_workers = self._worker_info()
+        n_samples = self.n_samples // num_workers + (
+            worker_id < self.n_samples % num_workers
+        )
+        rng = np.random.default_rng(seed + worker_id)
+
+        for start in range(0, n_samples, self.chunk_size):
+            starts, start_dates = self._draw(rng, min(self.chunk_size, n_samples - start))
+            yield from self._iter_samples(self.data.read_at(starts), start_dates)
@@ -0,0 +1,189 @@
+#################################################################################################################
+#
+# @copyright : ©2025 EDF
+# @author : Adrien Petralia
+# @description : NILMFormer - Distributed training helpers
+#
+#################################################################################################################
+
+import os
+import logging
+import datetime
+import contextlib
+
+import torch
+import torch.distributed as dist
+
+# Timeout of processes waiting for others outside training steps (e.g. rank 0 building datasets or evaluating)
+WAIT_TIMEOUT = datetime.timedelta(hours=24)
+_wait_group = None
+
+
+def init_distributed(backend=None, device="cpu"):
+    """
+    Initialize the default process group when launched with torchrun (env variables RANK, WORLD_SIZE, MASTER_ADDR, ...).
+
+    - backend: process group backend (default: 'nccl' for cuda devices, else 'gloo')
+
+    Return : True if distributed training (world size > 1), else False
+    """
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1:
+        return False
+
+    if not dist.is_initialized():
+        if backend is None:
+            backend = "nccl" if torch.device(device).type == "cuda" else "gloo"
+        dist.init_process_group(backend=backend)
+
+        # CPU group with a long timeout for waits (see wait_processes)
+        global _wait_group
+        _wait_group = dist.new_group(backend="gloo", timeout=WAIT_TIMEOUT)
+        logging.info(
+            "Distributed training: rank %s/%s (%s backend).",
+            get_rank(),
+            get_world_size(),
+            backend,
+        )
+
+    return True
+
+
+def cleanup_distributed():
+    global _wait_group
+    if is_distributed():
+        dist.destroy_process_group()
+    _wait_group = None
+    return
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    """
+    Return : global rank of the process (also valid in DataLoader workers, read from torchrun env variables)
+    """
+    if is_distributed():
+        return dist.get_rank()
+    return int(os.environ.get("RANK", 0))
+
+
+def get_world_size():
+    if is_distributed():
+        return dist.get_world_size()
+    return int(os.environ.get("WORLD_SIZE", 1))
+
+
+def get_local_rank():
+    return int(os.environ.get("LOCAL_RANK", 0))
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def distributed_device(device):
+    """
+    Device of the process: with cuda devices, one GPU per process of a node (cuda:LOCAL_RANK).
+    """
+    if is_distributed() and torch.device(device).type == "cuda":
+        device = "cuda:{}".format(get_local_rank())
+        torch.cuda.set_device(device)
+
+    return device
+
+
+def wait_processes():
+    """
+    Barrier of all processes with a long timeout (WAIT_TIMEOUT), for waits longer than a training step:
+    e.g. processes waiting for the local first process building datasets, or for rank 0 evaluation
+    before the process group is destroyed.
+    """
+    if is_distributed():
+        dist.barrier(group=_wait_group)
+    return
+
+
+@contextlib.contextmanager
+def local_main_process_first():
+    """
+    Context where the first process of each node runs first (e.g. to build and cache datasets),
+    other processes of the node entering once it is done (and reading the cache).
+    """
+    first = get_local_rank() == 0
+
+    if not first:
+        wait_processes()
+    try:
+        yield
+    finally:
+        if first:
+            wait_processes()
+
+
+def all_reduce_sum(*values):
+    """
+    Sum of values (numbers or 0-dim tensors) over all processes, in float64.
+
+    Return : list of float (values as float if not distributed)
+    """
+    if not is_distributed():
+        return [float(value) for value in values]
+
+    device = "cuda" if dist.get_backend() == "nccl" else "cpu"
+    values = torch.tensor(
+        [float(value) for value in values], dtype=torch.float64, device=device
+    )
+    dist.all_reduce(values, op=dist.ReduceOp.SUM)
+
+    return values.tolist()
+
+
+def all_gather_object(obj):
+    """
+    Return : list of picklable obj of all processes, ordered by rank ([obj] if not distributed)
+    """
+    if not is_distributed():
+        return [obj]
+
+    objects = [None] * get_world_size()
+    dist.all_gather_object(objects, obj)
+
+    return objects
+
+
+def set_loader_epoch(loader, epoch):
+    """
+    Set epoch of the DistributedSampler of a DataLoader (if any): different shuffling at each epoch,
+    and of its dataset if it draws its own samples (set_epoch, e.g. NILMRandomCropDataset).
+    """
+    if hasattr(loader.dataset, "set_epoch"):
+        loader.dataset.set_epoch(epoch)
+
+    sampler = loader.sampler
+    # DataLoader of batches (get_batch_loader): BatchSampler over the sampler of indices
+    sampler = getattr(sampler, "sampler", sampler)
+    if isinstance(sampler, torch.utils.data.DistributedSampler):
+        sampler.set_epoch(epoch)
+    return
+
+
+class DistributedEvalSampler(torch.utils.data.Sampler):
+    """
+    Sampler of a contiguous block of indices of a dataset per process, in order and without padding
+    (unlike DistributedSampler): each evaluation sample is read by exactly one process.
+    """
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        self.num_replicas = get_world_size() if num_replicas is None else num_replicas
+        self.rank = get_rank() if rank is None else rank
+
+        self.start = len(dataset) * self.rank // self.num_replicas
+        self.end = len(dataset) * (self.rank + 1) // self.num_replicas
+
+    def __iter__(self):
+        return iter(range(self.start, self.end))
+
+    def __len__(self):
+        return self.end - self.start
@@ -0,0 +1,151 @@
+#################################################################################################################
+#
+# @copyright : ©2025 EDF
+# @author : Adrien Petralia
+# @description : NILMFormer - Calendar exogene variables
+#
+#################################################################################################################
+
+import numpy as np
+import pandas as pd
+
+from pandas.tseries.frequencies import to_offset
+
+# Calendar fields: (period for sin/cos encoding, xmin, xmax for normalized encoding)
+EXO_FIELDS = {
+    "month": (12.0, 1, 12),
+    "dom": (31.0, 1, 31),
+    "dow": (7.0, 1, 7),
+    "hour": (24.0, 0, 24),
+    "minute": (60.0, 0, 60),
+}
+
+NS_MINUTE = 60 * 10**9
+NS_HOUR = 60 * NS_MINUTE
+NS_DAY = 24 * NS_HOUR
+
+
+def check_exo_variables(list_exo_variables):
+    for exo_var in list_exo_variables:
+        if exo_var not in EXO_FIELDS:
+            raise ValueError(
+                "Embedding unknown for these Data. Only 'month', 'dow', 'dom', 'hour', 'minute' supported, received {}".format(
+                    exo_var
+                )
+            )
+    return
+
+
+def normalize_exogene(x, xmin, xmax, newRange):
+    if xmin is None:
+        xmin = np.min(x)
+    if xmax is None:
+        xmax = np.max(x)
+
+    norm = (x - xmin) / (xmax - xmin)
+    if newRange == (0, 1):
+        return norm
+    elif newRange != (0, 1):
+        return norm * (newRange[1] - newRange[0]) + newRange[0]
+
+
+def _calendar_fields(wall_ns, list_exo_variables, out):
+    """
+    Raw calendar fields (month 1-12, dom 1-31, dow 0-6, hour 0-23, minute 0-59) of wall clock timestamps in ns.
+    """
+    for k, exo_var in enumerate(list_exo_variables):
+        if exo_var == "minute":
+            out[:, k, :] = (wall_ns // NS_MINUTE) % 60
+        elif exo_var == "hour":
+            out[:, k, :] = (wall_ns // NS_HOUR) % 24
+        elif exo_var == "dow":
+            # 1970-01-01 was a Thursday (dayofweek=3)
+            out[:, k, :] = (wall_ns // NS_DAY + 3) % 7
+        elif exo_var == "month":
+            months = wall_ns.view("datetime64[ns]").astype("datetime64[M]")
+            out[:, k, :] = months.astype(np.int64) % 12 + 1
+        elif exo_var == "dom":
+            dates = wall_ns.view("datetime64[ns]")
+            out[:, k, :] = (
+                dates.astype("datetime64[D]")
+                - dates.astype("datetime64[M]").astype("datetime64[D]")
+            ).astype(np.int64) + 1
+
+    return out
+
+
+def calendar_codes(start_dates, window_size, freq, list_exo_variables, chunk_size=4096):
+    """
+    Raw calendar fields of every timestep of every window, computed once and vectorized over all start dates.
+
+    Timestamps are those of pd.date_range(start=start_date, periods=window_size, freq=freq):
+    fields are taken from the wall clock of start dates timezone (if any).
+
+    Return : np.ndarray uint8 of size [N_ts, N_exo_variables, Win_Size]
+    """
+    check_exo_variables(list_exo_variables)
+
+    start_dates = pd.DatetimeIndex(start_dates)
+    tz = start_dates.tz
+    start_ns = start_dates.as_unit("ns").asi8
+    step = pd.Timedelta(to_offset(freq)).value
+    offsets = np.arange(window_size, dtype=np.int64) * step
+
+    codes = np.empty((len(start_ns), len(list_exo_variables), window_size), dtype=np.uint8)
+
+    for i in range(0, len(start_ns), chunk_size):
+        wall_ns = start_ns[i : i + chunk_size, None] + offsets
+        if tz is not None:
+            wall_ns = (
+                pd.DatetimeIndex(wall_ns.ravel(), tz="UTC")
+                .tz_convert(tz)
+                .tz_localize(None)
+                .as_unit("ns")
+                .asi8.reshape(wall_ns.shape)
+            )
+        _calendar_fields(wall_ns, list_exo_variables, codes[i : i + chunk_size])
+
+    return codes
+
+
+def exogene_lut(list_exo_variables, cosinbase=True, newRange=(-1, 1), shifted=()):
+    """
+    Lookup table of exogene encodings indexed by raw calendar field value.
+
+    - cosinbase: sin/cos encoding of each variable, else normalized to newRange
+    - shifted: variables whose raw value is shifted by -1 in sin/cos encoding
+
+    Return : np.ndarray float32 of size [N_exo_variables, 2 (cosinbase) or 1, 64]
+    """
+    check_exo_variables(list_exo_variables)
+
+    values = np.arange(64, dtype=np.float64)
+    lut = np.zeros((len(list_exo_variables), 2 if cosinbase else 1, 64), dtype=np.float32)
+
+    for k, exo_var in enumerate(list_exo_variables):
+        period, xmin, xmax = EXO_FIELDS[exo_var]
+        if cosinbase:
+            shift = 1 if exo_var in shifted else 0
+            lut[k, 0, :] = np.sin(2 * np.pi * (values - shift) / period)
+            lut[k, 1, :] = np.cos(2 * np.pi * (values - shift) / period)
+        else:
+            lut[k, 0, :] = normalize_exogene(values, xmin=xmin, xmax=xmax, newRange=newRange)
+
+    return lut
+
+
+def apply_exogene_lut(lut, codes):
+    """
+    Gather exogene encodings of calendar codes of one ([N_exo, L]) or several ([B, N_exo, L]) windows.
+
+    Return : np.ndarray float32 of size [(B), N_exo * (2 if cosinbase else 1), L]
+    """
+    n_exo, n_enc, _ = lut.shape
+    exo = np.empty(codes.shape[:-2] + (n_exo * n_enc, codes.shape[-1]), dtype=np.float32)
+
+    for k in range(n_exo):
+        exo[..., k * n_enc : (k + 1) * n_enc, :] = np.moveaxis(
+            lut[k][:, codes[..., k, :]], 0, -2
+        )
+
+    return exo
@@ -6,13 +6,28 @@
 #
 #################################################################################################################
 
+import os
 import torch
 import logging
 
 import torch.nn as nn
 
-from src.helpers.trainer import SeqToSeqTrainer, TserTrainer
-from src.helpers.dataset import NILMDataset, TSDatasetScaling
+from src.helpers.trainer import SeqToSeqTrainer, TserTrainer, local_model
+from src.helpers.distributed import (
+    DistributedEvalSampler,
+    get_rank,
+    get_world_size,
+    is_distributed,
+    is_main_process,
+)
+from src.helpers.dataset import (
+    NILMArrayView,
+    NILMDataset,
+    NILMRandomCropDataset,
+    NILMTensorDataset,
+    TSDatasetScaling,
+    get_batch_loader,
+)
 from src.helpers.metrics import NILMmetrics, eval_win_energy_aggregation
 
 
@@ -45,9 +60,77 @@ from src.nilmformer.congif import NILMFormerConfig
 from src.nilmformer.model import NILMFormer
 
 
-def get_model_instance(name_model, c_in, window_size, **kwargs):
+class CompiledModel(nn.Module):
+    """
+    Model compiled with torch.compile, falling back to eager execution if compilation fails.
+
+    A compilation error (at first forward of a graph, or at recompilation e.g. for a new batch size)
+    is logged, and the model then runs eagerly for all subsequent calls.
+    Parameters are those of the underlying model (_orig_mod, as for torch.compile modules, see unwrap_model).
+    """
+
+    def __init__(self, model, mode="default", dynamic=None):
+        super().__init__()
+        self._orig_mod = model
+        # Not registered as a submodule: same parameters as _orig_mod
+        self.__dict__["_compiled"] = torch.compile(model, mode=mode, dynamic=dynamic)
+
+    def forward(self, *args, **kwargs):
+        if self._compiled is None:
+            return self._orig_mod(*args, **kwargs)
+
+        try:
+            return self._compiled(*args, **kwargs)
+        except Exception as e:
+            logging.warning(
+                "Compilation of %s failed (%s): model runs eagerly.",
+                type(self._orig_mod).__name__,
+                e,
+            )
+            self.__dict__["_compiled"] = None
+            return self._orig_mod(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # Other attributes of the underlying model (e.g. model specific methods)
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self._orig_mod, name)
+
+
+def compile_model(inst, mode="default", dynamic=None):
+    """
+    Compile model with torch.compile (see compile, compile_mode and compile_dynamic in configs/expes.yaml).
+
+    - mode: torch.compile mode, e.g. 'default', 'reduce-overhead' or 'max-autotune'
+    - dynamic: None (shapes marked dynamic once they change, e.g. last batch), True or False
+
+    If compilation fails (when called, or at a forward call, see CompiledModel), the error is logged and the model
+    runs eagerly. Models trained by their own train_one_epoch (e.g. DiffNILM) are kept eager.
+    """
+    if hasattr(inst, "train_one_epoch"):
+        logging.warning(
+            "%s trained by its own train_one_epoch: compilation skipped, model runs eagerly.",
+            type(inst).__name__,
+        )
+        return inst
+
+    try:
+        return CompiledModel(inst, mode=mode, dynamic=dynamic)
+    except Exception as e:
+        logging.warning(
+            "Compilation of %s failed (%s): model runs eagerly.", type(inst).__name__, e
+        )
+        return inst
+
+
+def get_model_instance(
+    name_model, c_in, window_size, compile_mode=None, compile_dynamic=None, **kwargs
+):
     """
     Get model instances
+
+    If compile_mode is provided, the model is compiled (see compile_model).
     """
     if name_model == "BiGRU":
         inst = BiGRU(c_in=1, **kwargs)
@@ -86,68 +169,163 @@ def get_model_instance(name_model, c_in, window_size, **kwargs):
     else:
         raise ValueError("Model name {} unknown".format(name_model))
 
+    if compile_mode is not None:
+        inst = compile_model(inst, mode=compile_mode, dynamic=compile_dynamic)
+
     return inst
 
 
+def get_loader_kwargs(expes_config):
+    """
+    DataLoader loading options of the experiment config (num_workers, persistent_workers, prefetch_factor, pin_memory).
+    """
+    loader_kwargs = {
+        "num_workers": expes_config.num_workers,
+        "pin_memory": expes_config.pin_memory,
+    }
+    if expes_config.num_workers > 0:
+        # Only valid with worker processes
+        loader_kwargs["persistent_workers"] = expes_config.persistent_workers
+        loader_kwargs["prefetch_factor"] = expes_config.prefetch_factor
+
+    return loader_kwargs
+
+
+def get_loader(dataset, **kwargs):
+    # Datasets returning whole batches (NILMTensorDataset) are indexed by a BatchSampler
+    if isinstance(dataset, NILMTensorDataset):
+        return get_batch_loader(dataset, **kwargs)
+    return torch.utils.data.DataLoader(dataset, **kwargs)
+
+
+def get_eval_loader(dataset, expes_config, sampler=None):
+    """
+    Evaluation DataLoader (eval_batch_size, not shuffled) over all samples of dataset or the samples of sampler.
+    """
+    return get_loader(
+        dataset,
+        batch_size=expes_config.eval_batch_size,
+        shuffle=False,
+        sampler=sampler,
+        **get_loader_kwargs(expes_config),
+    )
+
+
+def get_data_loaders(train_dataset, valid_dataset, test_dataset, expes_config):
+    """
+    Train, valid and test DataLoaders with loading options of the experiment config
+    (num_workers, persistent_workers, prefetch_factor, pin_memory, eval_batch_size, shuffle_train).
+
+    With worker processes, datasets built with share_memory=True send their backing arrays to workers
+    as shared-memory tensors (see SharedArraysMixin).
+
+    Train samples are shuffled with a generator seeded by the experiment seed
+    (iterable datasets, e.g. random crops, draw their own samples and are not shuffled).
+
+    In distributed training, train samples are split between processes by a DistributedSampler
+    (iterable datasets split their samples themselves) and valid samples by a DistributedEvalSampler
+    (validation loss reduced across processes), test samples being read by all processes.
+    """
+    shuffle_train = expes_config.shuffle_train and not isinstance(
+        train_dataset, torch.utils.data.IterableDataset
+    )
+
+    if is_distributed() and not isinstance(
+        train_dataset, torch.utils.data.IterableDataset
+    ):
+        train_sampler_kwargs = {
+            "sampler": torch.utils.data.DistributedSampler(
+                train_dataset,
+                num_replicas=get_world_size(),
+                rank=get_rank(),
+                shuffle=shuffle_train,
+                seed=expes_config.seed,
+            )
+        }
+    else:
+        train_sampler_kwargs = {
+            "shuffle": shuffle_train,
+            "generator": torch.Generator().manual_seed(expes_config.seed)
+            if shuffle_train
+            else None,
+        }
+
+    train_loader = get_loader(
+        train_dataset,
+        batch_size=expes_config.batch_size,
+        **train_sampler_kwargs,
+        **get_loader_kwargs(expes_config),
+    )
+    valid_loader = get_eval_loader(
+        valid_dataset,
+        expes_config,
+        sampler=DistributedEvalSampler(valid_dataset) if is_distributed() else None,
+    )
+    test_loader = get_eval_loader(test_dataset, expes_config)
+
+    return train_loader, valid_loader, test_loader
+
+
+def nilm_dataset_cls(data, expes_config):
+    """
+    Dataset class of a split: batches gathered from preloaded tensors (tensor_gather) for arrays held in memory,
+    else collated from NILMDataset samples (out-of-core data and virtual windows are read through their view
+    by NILMDataset, never preloaded).
+    """
+    if expes_config.tensor_gather and not isinstance(data, NILMArrayView):
+        return NILMTensorDataset
+    return NILMDataset
+
+
 def nilm_model_training(inst_model, tuple_data, scaler, expes_config):
     if expes_config.name_model == "NILMFormer":
-        train_dataset = NILMDataset(
-            tuple_data[0],
-            st_date=tuple_data[4],
-            list_exo_variables=expes_config.list_exo_variables,
-            freq=expes_config.sampling_rate,
-        )
-
-        valid_dataset = NILMDataset(
-            tuple_data[1],
-            st_date=tuple_data[5],
-            list_exo_variables=expes_config.list_exo_variables,
-            freq=expes_config.sampling_rate,
-        )
+        dataset_kwargs = {
+            "list_exo_variables": expes_config.list_exo_variables,
+            "freq": expes_config.sampling_rate,
+            "timestamp_encoding": expes_config.timestamp_encoding,
+        }
+    elif expes_config.name_model == "DiffNILM":
+        dataset_kwargs = {
+            "list_exo_variables": ["hour", "dow", "month"],
+            "freq": expes_config.sampling_rate,
+            "cosinbase": False,
+            "newRange": (-0.5, 0.5),
+        }
+    else:
+        dataset_kwargs = {}
 
-        test_dataset = NILMDataset(
-            tuple_data[2],
-            st_date=tuple_data[6],
-            list_exo_variables=expes_config.list_exo_variables,
-            freq=expes_config.sampling_rate,
+    if expes_config.random_crop:
+        # Train windows randomly cropped from continuous series at each epoch (virtual_windows data)
+        train_dataset = NILMRandomCropDataset(
+            tuple_data[0],
+            tuple_data[4],
+            n_samples=expes_config.n_crops_per_epoch,
+            exclude=[(tuple_data[1], tuple_data[5]), (tuple_data[2], tuple_data[6])],
+            **dataset_kwargs,
         )
-    elif expes_config.name_model == "DiffNILM":
-        train_dataset = NILMDataset(
+    else:
+        train_dataset = nilm_dataset_cls(tuple_data[0], expes_config)(
             tuple_data[0],
             st_date=tuple_data[4],
-            list_exo_variables=["hour", "dow", "month"],
-            freq=expes_config.sampling_rate,
-            cosinbase=False,
-            newRange=(-0.5, 0.5),
+            share_memory=expes_config.share_memory,
+            **dataset_kwargs,
         )
-        valid_dataset = NILMDataset(
-            tuple_data[1],
-            st_date=tuple_data[5],
-            list_exo_variables=["hour", "dow", "month"],
-            freq=expes_config.sampling_rate,
-            cosinbase=False,
-            newRange=(-0.5, 0.5),
-        )
-        test_dataset = NILMDataset(
-            tuple_data[2],
-            st_date=tuple_data[6],
-            list_exo_variables=["hour", "dow", "month"],
-            freq=expes_config.sampling_rate,
-            cosinbase=False,
-            newRange=(-0.5, 0.5),
-        )
-    else:
-        train_dataset = NILMDataset(tuple_data[0])
-        valid_dataset = NILMDataset(tuple_data[1])
-        test_dataset = NILMDataset(tuple_data[2])
-
-    train_loader = torch.utils.data.DataLoader(
-        train_dataset, batch_size=expes_config.batch_size, shuffle=False
+    valid_dataset = nilm_dataset_cls(tuple_data[1], expes_config)(
+        tuple_data[1],
+        st_date=tuple_data[5],
+        share_memory=expes_config.share_memory,
+        **dataset_kwargs,
+    )
+    test_dataset = nilm_dataset_cls(tuple_data[2], expes_config)(
+        tuple_data[2],
+        st_date=tuple_data[6],
+        share_memory=expes_config.share_memory,
+        **dataset_kwargs,
     )
-    valid_loader = torch.utils.data.DataLoader(
-        valid_dataset, batch_size=1, shuffle=False
+
+    train_loader, valid_loader, test_loader = get_data_loaders(
+        train_dataset, valid_dataset, test_dataset, expes_config
     )
-    test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=1, shuffle=False)
 
     model_trainer = SeqToSeqTrainer(
         inst_model,
@@ -166,14 +344,29 @@ def nilm_model_training(inst_model, tuple_data, scaler, expes_config):
         save_fig=False,
         path_fig=None,
         device=expes_config.device,
-        all_gpu=expes_config.all_gpu,
+        all_gpu=expes_config.all_gpu and not is_distributed(),
         save_checkpoint=True,
         path_checkpoint=expes_config.result_path,
+        precision=expes_config.precision,
+        log_interval=expes_config.log_interval,
+        distributed=is_distributed(),
+        resume_every=expes_config.resume_every,
     )
+    if expes_config.resume:
+        model_trainer.load_resume_checkpoint()
 
     logging.info("Model training...")
     model_trainer.train(expes_config.epochs)
 
+    # Evaluation and final checkpoint by rank 0 only, other processes waiting for it (see run_one_expe)
+    if not is_main_process():
+        return
+
+    if is_distributed():
+        # Model evaluated without DistributedDataParallel (no collective call) on all valid samples
+        model_trainer.model = local_model(model_trainer.model)
+        valid_loader = get_eval_loader(valid_dataset, expes_config)
+
     logging.info("Eval model...")
     model_trainer.restore_best_weights()
     model_trainer.evaluate(
@@ -203,8 +396,9 @@ def nilm_model_training(inst_model, tuple_data, scaler, expes_config):
             freq=expes_config.sampling_rate,
             list_exo_variables=["hour", "dow", "month"],
             cosinbase=False,
-            newRange=(-0.5, 0.5),
+            new_range=(-0.5, 0.5),
             threshold_small_values=expes_config.threshold,
+            batch_size=expes_config.eval_batch_size,
         )
     else:
         eval_win_energy_aggregation(
@@ -219,26 +413,31 @@ def nilm_model_training(inst_model, tuple_data, scaler, expes_config):
             if expes_config.name_model == "NILMFormer"
             else [],
             threshold_small_values=expes_config.threshold,
+            batch_size=expes_config.eval_batch_size,
         )
 
+    model_trainer.log["completed"] = True
     model_trainer.save()
+    model_trainer.remove_resume_checkpoint()
     logging.info(
         "Training and eval completed! Model weights and log save at: {}.pt".format(expes_config.result_path)
     )
 
 
 def tser_model_training(inst_model, tuple_data, scaler, expes_config):
-    train_dataset = TSDatasetScaling(tuple_data[0][0], tuple_data[0][1])
-    valid_dataset = TSDatasetScaling(tuple_data[1][0], tuple_data[1][1])
-    test_dataset = TSDatasetScaling(tuple_data[2][0], tuple_data[2][1])
-
-    train_loader = torch.utils.data.DataLoader(
-        train_dataset, batch_size=expes_config.batch_size, shuffle=False
+    train_dataset = TSDatasetScaling(
+        tuple_data[0][0], tuple_data[0][1], share_memory=expes_config.share_memory
+    )
+    valid_dataset = TSDatasetScaling(
+        tuple_data[1][0], tuple_data[1][1], share_memory=expes_config.share_memory
+    )
+    test_dataset = TSDatasetScaling(
+        tuple_data[2][0], tuple_data[2][1], share_memory=expes_config.share_memory
     )
-    valid_loader = torch.utils.data.DataLoader(
-        valid_dataset, batch_size=1, shuffle=False
+
+    train_loader, valid_loader, test_loader = get_data_loaders(
+        train_dataset, valid_dataset, test_dataset, expes_config
     )
-    test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=1, shuffle=False)
 
     model_trainer = TserTrainer(
         inst_model,
@@ -256,14 +455,29 @@ def tser_model_training(inst_model, tuple_data, scaler, expes_config):
         save_fig=False,
         path_fig=None,
         device=expes_config.device,
-        all_gpu=expes_config.all_gpu,
+        all_gpu=expes_config.all_gpu and not is_distributed(),
         save_checkpoint=True,
         path_checkpoint=expes_config.result_path,
+        precision=expes_config.precision,
+        log_interval=expes_config.log_interval,
+        distributed=is_distributed(),
+        resume_every=expes_config.resume_every,
     )
+    if expes_config.resume:
+        model_trainer.load_resume_checkpoint()
 
     logging.info("Train model...")
     model_trainer.train(expes_config.epochs)
 
+    # Evaluation and final checkpoint by rank 0 only, other processes waiting for it (see run_one_expe)
+    if not is_main_process():
+        return
+
+    if is_distributed():
+        # Model evaluated without DistributedDataParallel (no collective call) on all valid samples
+        model_trainer.model = local_model(model_trainer.model)
+        valid_loader = get_eval_loader(valid_dataset, expes_config)
+
     logging.info("Eval model...")
     model_trainer.restore_best_weights()
     model_trainer.evaluate(
@@ -280,6 +494,9 @@ def tser_model_training(inst_model, tuple_data, scaler, expes_config):
         mask="test_metrics",
     )
 
+    model_trainer.log["completed"] = True
+    model_trainer.save()
+    model_trainer.remove_resume_checkpoint()
     logging.info(
         "Training and eval completed! Model weights and log save at: {}".format(
             expes_config.result_path
@@ -287,6 +504,18 @@ def tser_model_training(inst_model, tuple_data, scaler, expes_config):
     )
 
 
+def is_expe_completed(result_path):
+    """
+    Return : True if the experiment saving its log at result_path (.pt) was completed (training and evaluation)
+    """
+    if not os.path.isfile(result_path + ".pt"):
+        return False
+
+    log = torch.load(result_path + ".pt", map_location="cpu", weights_only=False)
+
+    return log.get("completed", False)
+
+
 def launch_models_training(data_tuple, scaler, expes_config):
     if "cutoff" in expes_config.model_kwargs:
         expes_config.model_kwargs.cutoff = expes_config.cutoff
@@ -294,11 +523,20 @@ def launch_models_training(data_tuple, scaler, expes_config):
     if "threshold" in expes_config.model_kwargs:
         expes_config.model_kwargs.threshold = expes_config.threshold
 
+    model_kwargs = dict(expes_config.model_kwargs)
+    if expes_config.name_model == "NILMFormer" and expes_config.timestamp_encoding:
+        # Exogene variables encoded in the model from start timestamps
+        model_kwargs["timestamp_encoding"] = True
+        model_kwargs["list_exo_variables"] = list(expes_config.list_exo_variables)
+        model_kwargs["freq"] = expes_config.sampling_rate
+
     model_instance = get_model_instance(
         name_model=expes_config.name_model,
         c_in=(1 + 2 * len(expes_config.list_exo_variables)),
         window_size=expes_config.window_size,
-        **expes_config.model_kwargs,
+        compile_mode=expes_config.compile_mode if expes_config.compile else None,
+        compile_dynamic=expes_config.compile_dynamic,
+        **model_kwargs,
     )
 
     if expes_config.name_model in ["ConvNet", "ResNet", "Inception"]:
@@ -11,7 +11,9 @@ import torch
 import numpy as np
 import pandas as pd
 
-from src.helpers.preprocessing import create_exogene
+from pandas.tseries.frequencies import to_offset
+
+from src.helpers.exogene import calendar_codes, exogene_lut, apply_exogene_lut
 from sklearn.metrics import (
     accuracy_score,
     balanced_accuracy_score,
@@ -157,6 +159,54 @@ class REGmetrics:
         return metrics
 
 
+def _predict_windows(
+    data_test,
+    start_dates,
+    model_trainer,
+    scaler,
+    window_size,
+    freq,
+    cosinbase,
+    new_range,
+    list_exo_variables,
+    threshold_small_values,
+    use_temperature,
+    batch_size,
+):
+    """
+    Predict appliance power of every test window by batch (exogene variables computed for the whole batch).
+
+    Return : np.ndarray of size [N_ts, Win_Size]
+    """
+    if list_exo_variables:
+        lut = exogene_lut(list_exo_variables, cosinbase=cosinbase, newRange=new_range)
+
+    preds = []
+    with torch.no_grad():
+        for start in range(0, len(data_test), batch_size):
+            rows = slice(start, start + batch_size)
+
+            input_seq = data_test[rows, 0, : 2 if use_temperature else 1, :]
+            if list_exo_variables:
+                codes = calendar_codes(
+                    start_dates[rows], window_size, freq, list_exo_variables
+                )
+                input_seq = np.concatenate(
+                    (input_seq, apply_exogene_lut(lut, codes)), axis=1
+                )
+
+            input_seq = torch.as_tensor(input_seq, dtype=torch.float32)
+
+            with model_trainer.autocast():
+                pred = model_trainer.model(input_seq.to(model_trainer.device))
+            pred = scaler.inverse_transform_appliance(pred.float())
+            pred[pred < threshold_small_values] = 0
+
+            preds.append(pred.detach().cpu().numpy().reshape(len(input_seq), -1))
+
+    return np.concatenate(preds) if len(preds) else np.empty((0, window_size))
+
+
 def eval_win_energy_aggregation(
     input_data_test,
     input_st_date_test,
@@ -171,14 +221,45 @@ def eval_win_energy_aggregation(
     list_exo_variables=[],
     threshold_small_values=0,
     use_temperature=False,
+    batch_size=1,
 ):
-    data_test = input_data_test.copy()
     st_date_test = input_st_date_test.copy()
 
     st_date_test.index.name = "ID_PDL"
     st_date_test = st_date_test.reset_index()
     list_pdl_test = st_date_test["ID_PDL"].unique()
 
+    # Predictions (computed once by batch), true values and timestamps of every test window
+    start_dates = pd.DatetimeIndex(st_date_test["start_date"])
+    pred_app = _predict_windows(
+        input_data_test,
+        start_dates,
+        model_trainer,
+        scaler,
+        window_size,
+        freq,
+        cosinbase,
+        new_range,
+        list_exo_variables,
+        threshold_small_values,
+        use_temperature,
+        batch_size,
+    )
+
+    # True values rescaled by chunks of windows (test data may be an out-of-core NILMArrayView)
+    chunk_size = 4096
+    dtype = np.promote_types(input_data_test.dtype, np.float32)
+    total_power = np.empty((len(input_data_test), window_size), dtype=dtype)
+    true_app = np.empty((len(input_data_test), window_size), dtype=dtype)
+    for start in range(0, len(input_data_test), chunk_size):
+        rows = slice(start, start + chunk_size)
+        inv_scale = scaler.inverse_transform(np.asarray(input_data_test[rows]))
+        total_power[rows] = inv_scale[:, 0, 0, :]
+        true_app[rows] = inv_scale[:, 1, 0, :]
+
+    offsets = np.arange(window_size, dtype=np.int64) * pd.Timedelta(to_offset(freq)).value
+    dates_ns = start_dates.as_unit("ns").asi8[:, None] + offsets
+
     for freq_agg in ["D", "W", "ME"]:
         df = pd.DataFrame()
 
@@ -188,85 +269,22 @@ def eval_win_energy_aggregation(
         pred_ratio = []
 
         for pdl in list_pdl_test:
-            tmp_st_date_test = st_date_test.loc[st_date_test["ID_PDL"] == pdl]
-
-            list_index = tmp_st_date_test.index
-
-            list_date = []
-            pdl_total_power = []
-            pdl_true_app_power = []
-            pdl_pred_app_power = []
-
-            for k, val in enumerate(list(list_index)):
-                if list_exo_variables is not None:
-                    if use_temperature:
-                        input_seq = torch.Tensor(
-                            create_exogene(
-                                data_test[val, 0, :2, :],
-                                tmp_st_date_test.iloc[k, 1],
-                                list_exo_variables=list_exo_variables,
-                                freq=freq,
-                                cosinbase=cosinbase,
-                                new_range=new_range,
-                            )
-                        )
-                    else:
-                        input_seq = torch.Tensor(
-                            create_exogene(
-                                data_test[val, 0, 0, :],
-                                tmp_st_date_test.iloc[k, 1],
-                                list_exo_variables=list_exo_variables,
-                                freq=freq,
-                                cosinbase=cosinbase,
-                                new_range=new_range,
-                            )
-                        )
-                else:
-                    if use_temperature:
-                        input_seq = torch.Tensor(
-                            np.expand_dims(data_test[val, 0, :2, :], axis=0)
-                        )
-                    else:
-                        input_seq = torch.Tensor(
-                            np.expand_dims(
-                                np.expand_dims(data_test[val, 0, 0, :], axis=0), axis=0
-                            )
-                        )
-
-                pred = model_trainer.model(input_seq.to(model_trainer.device))
+            rows = np.flatnonzero(st_date_test["ID_PDL"].values == pdl)
 
-                pred = scaler.inverse_transform_appliance(pred)
-
-                pred[pred < threshold_small_values] = 0
-
-                inv_scale = scaler.inverse_transform(data_test[val, :, :, :])
-
-                agg = inv_scale[0, 0, :]
-                app = inv_scale[1, 0, :]
-
-                pred = pred.detach().cpu().numpy().flatten()
-
-                list_date.extend(
-                    list(
-                        pd.date_range(
-                            tmp_st_date_test.iloc[k, 1], periods=window_size, freq=freq
-                        )
-                    )
-                )
-                pdl_total_power.extend(list(agg))
-                pdl_true_app_power.extend(list(app))
-                pdl_pred_app_power.extend(list(pred))
+            list_date = pd.DatetimeIndex(dates_ns[rows].ravel(), tz="UTC")
+            list_date = (
+                list_date.tz_localize(None)
+                if start_dates.tz is None
+                else list_date.tz_convert(start_dates.tz)
+            )
 
             df_inst = pd.DataFrame(
-                list(
-                    zip(
-                        list_date,
-                        pdl_total_power,
-                        pdl_true_app_power,
-                        pdl_pred_app_power,
-                    )
-                ),
-                columns=["date", "total_power", "true_app_power", "pred_app_power"],
+                {
+                    "date": list_date,
+                    "total_power": total_power[rows].ravel(),
+                    "true_app_power": true_app[rows].ravel(),
+                    "pred_app_power": pred_app[rows].ravel(),
+                }
             )
             df_inst["date"] = pd.to_datetime(df_inst["date"])
             df_inst = df_inst.set_index("date")
@@ -7,12 +7,29 @@
 #################################################################################################################
 
 import os
+import glob
 import json
+import tempfile
+import multiprocessing
 import numpy as np
 import pandas as pd
 
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
+from pandas.tseries.frequencies import to_offset
 from sklearn.model_selection import train_test_split
 
+from src.helpers.columnar import (
+    has_columnar,
+    read_columnar,
+    pecanstreet_house_file,
+    columnar_path,
+)
+from src.helpers.cache import FrameCache, code_version, hash_params, files_signature
+from src.helpers.exogene import calendar_codes, exogene_lut, apply_exogene_lut
+from src.helpers.dataset import NILMSeries
+
 
 # ========================================= Convert NILM dataset to TSER ========================================= #
 def nilmdataset_to_tser(data):
@@ -25,7 +42,10 @@ def nilmdataset_to_tser(data):
         y: 2D array as (len(X), 1) -> sum of energy consumed in each window
     """
     X = data[:, 0, 0, :]
-    y = np.sum(data[:, 1, 0, :], axis=-1)
+    # Sum at least in float32 (compact float16 dataset would overflow)
+    y = np.sum(
+        data[:, 1, 0, :], axis=-1, dtype=np.promote_types(data.dtype, np.float32)
+    )
 
     return X, y
 
@@ -133,6 +153,20 @@ def split_train_valid_test_pdl(
             return X_train, y_train, X_test, y_test
 
 
+def get_house_rows(st_date, houses):
+    """
+    Row indexes of provided houses in a NILM dataset, computed from the st_date index (house id).
+
+    Return : np.ndarray of row indexes, grouped by house in provided order (original order within a house)
+    """
+    house_ids = np.asarray(st_date.index)
+
+    if len(houses) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    return np.concatenate([np.flatnonzero(house_ids == house) for house in houses])
+
+
 def split_train_test_pdl_nilmdataset(
     data,
     st_date,
@@ -141,7 +175,16 @@ def split_train_test_pdl_nilmdataset(
     perc_house_test=None,
     nb_house_valid=None,
     perc_house_valid=None,
+    return_index=False,
 ):
+    """
+    Split NILM dataset by house (id in st_date index), without copying data other than the selected rows.
+
+    If return_index, only return row indexes of each split (to be used as data.take(rows, axis=0)).
+
+    Return : data_train, st_date_train, (data_valid, st_date_valid), data_test, st_date_test
+             or rows_train, (rows_valid), rows_test if return_index
+    """
     assert nb_house_test is not None or perc_house_test is not None
     assert len(data) == len(st_date)
     assert isinstance(st_date, pd.DataFrame)
@@ -153,14 +196,7 @@ def split_train_test_pdl_nilmdataset(
             perc_house_test is not None and perc_house_valid is not None
         )
 
-    if len(data.shape) > 2:
-        tmp_shape = data.shape
-        data = data.reshape(data.shape[0], -1)
-
-    data = pd.concat([st_date.reset_index(), pd.DataFrame(data)], axis=1).set_index(
-        "index"
-    )
-    list_pdl = np.array(data.index.unique())
+    list_pdl = np.array(st_date.index.unique())
     np.random.shuffle(list_pdl)
 
     if nb_house_test is None:
@@ -181,35 +217,33 @@ def split_train_test_pdl_nilmdataset(
     else:
         pdl_train = list_pdl[nb_house_test:]
 
-    df_train = data.loc[pdl_train, :].copy()
-    df_test = data.loc[pdl_test, :].copy()
-
-    st_date_train = df_train.iloc[:, :1]
-    data_train = df_train.iloc[:, 1:].values.reshape(
-        (len(df_train), tmp_shape[1], tmp_shape[2], tmp_shape[3])
-    )
-    st_date_test = df_test.iloc[:, :1]
-    data_test = df_test.iloc[:, 1:].values.reshape(
-        (len(df_test), tmp_shape[1], tmp_shape[2], tmp_shape[3])
-    )
+    rows_train = get_house_rows(st_date, pdl_train)
+    rows_test = get_house_rows(st_date, pdl_test)
 
     if nb_house_valid is not None:
-        df_valid = data.loc[pdl_valid, :].copy()
-        st_date_valid = df_valid.iloc[:, :1]
-        data_valid = df_valid.iloc[:, 1:].values.reshape(
-            (len(df_valid), tmp_shape[1], tmp_shape[2], tmp_shape[3])
-        )
+        rows_valid = get_house_rows(st_date, pdl_valid)
+
+        if return_index:
+            return rows_train, rows_valid, rows_test
 
         return (
-            data_train,
-            st_date_train,
-            data_valid,
-            st_date_valid,
-            data_test,
-            st_date_test,
+            data.take(rows_train, axis=0),
+            st_date.iloc[rows_train],
+            data.take(rows_valid, axis=0),
+            st_date.iloc[rows_valid],
+            data.take(rows_test, axis=0),
+            st_date.iloc[rows_test],
         )
     else:
-        return data_train, st_date_train, data_test, st_date_test
+        if return_index:
+            return rows_train, rows_test
+
+        return (
+            data.take(rows_train, axis=0),
+            st_date.iloc[rows_train],
+            data.take(rows_test, axis=0),
+            st_date.iloc[rows_test],
+        )
 
 
 def split_train_test_nilmdataset(data, st_date, perc_house_test=0.2, seed=0):
@@ -221,101 +255,25 @@ def split_train_test_nilmdataset(data, st_date, perc_house_test=0.2, seed=0):
     split_index = int(len(data_len) * (1 - perc_house_test))
     train_idx, test_idx = data_len[:split_index], data_len[split_index:]
 
-    data_train, st_date_train = data[train_idx], st_date.iloc[train_idx]
-    data_test, st_date_test = data[test_idx], st_date.iloc[test_idx]
+    data_train, st_date_train = data.take(train_idx, axis=0), st_date.iloc[train_idx]
+    data_test, st_date_test = data.take(test_idx, axis=0), st_date.iloc[test_idx]
 
     return data_train, st_date_train, data_test, st_date_test
 
 
-def normalize_exogene(x, xmin, xmax, newRange):
-    if xmin is None:
-        xmin = np.min(x)
-    if xmax is None:
-        xmax = np.max(x)
-
-    norm = (x - xmin) / (xmax - xmin)
-    if newRange == (0, 1):
-        return norm
-    elif newRange != (0, 1):
-        return norm * (newRange[1] - newRange[0]) + newRange[0]
-
-
 def create_exogene(
     values, st_date, list_exo_variables, freq, cosinbase=True, new_range=(-1, 1)
 ):
-    if cosinbase:
-        n_var = 2 * len(list_exo_variables)
-    else:
-        n_var = len(list_exo_variables)
-
-    np_extra = np.zeros(
-        (1, n_var, len(values[-1]) if len(values.shape) > 1 else len(values))
-    ).astype(np.float32)
+    """
+    Concatenate calendar exogene variables (starting at st_date) to the values of one window.
 
-    tmp = pd.date_range(
-        start=st_date,
-        periods=len(values[-1]) if len(values.shape) > 1 else len(values),
-        freq=freq,
-    )
+    Return : np.ndarray of size [1, N_channels + N_exo_channels, Win_Size]
+    """
+    window_size = len(values[-1]) if len(values.shape) > 1 else len(values)
 
-    k = 0
-    for exo_var in list_exo_variables:
-        if exo_var == "month":
-            if cosinbase:
-                np_extra[0, k, :] = np.sin(2 * np.pi * tmp.month.values / 12.0)
-                np_extra[0, k + 1, :] = np.cos(2 * np.pi * tmp.month.values / 12.0)
-                k += 2
-            else:
-                np_extra[k, :] = normalize_exogene(
-                    tmp.month.values, xmin=1, xmax=12, newRange=new_range
-                )
-                k += 1
-        elif exo_var == "dom":
-            if cosinbase:
-                np_extra[0, k, :] = np.sin(2 * np.pi * tmp.day.values / 31.0)
-                np_extra[0, k + 1, :] = np.cos(2 * np.pi * tmp.day.values / 31.0)
-                k += 2
-            else:
-                np_extra[0, k, :] = normalize_exogene(
-                    tmp.month.values, xmin=1, xmax=12, newRange=new_range
-                )
-                k += 1
-        elif exo_var == "dow":
-            if cosinbase:
-                np_extra[0, k, :] = np.sin(2 * np.pi * tmp.dayofweek.values / 7.0)
-                np_extra[0, k + 1, :] = np.cos(2 * np.pi * tmp.dayofweek.values / 7.0)
-                k += 2
-            else:
-                np_extra[0, k, :] = normalize_exogene(
-                    tmp.month.values, xmin=1, xmax=7, newRange=new_range
-                )
-                k += 1
-        elif exo_var == "hour":
-            if cosinbase:
-                np_extra[0, k, :] = np.sin(2 * np.pi * tmp.hour.values / 24.0)
-                np_extra[0, k + 1, :] = np.cos(2 * np.pi * tmp.hour.values / 24.0)
-                k += 2
-            else:
-                np_extra[0, k, :] = normalize_exogene(
-                    tmp.month.values, xmin=0, xmax=24, newRange=new_range
-                )
-                k += 1
-        elif exo_var == "minute":
-            if cosinbase:
-                np_extra[0, k, :] = np.sin(2 * np.pi * tmp.minute.values / 60.0)
-                np_extra[0, k + 1, :] = np.cos(2 * np.pi * tmp.minute.values / 60.0)
-                k += 2
-            else:
-                np_extra[0, k, :] = normalize_exogene(
-                    tmp.minute.values, xmin=0, xmax=60, newRange=new_range
-                )
-                k += 1
-        else:
-            raise ValueError(
-                "Embedding unknown for these Data. Only 'month', 'dow', 'dom', 'hour', 'minute' supported, received {}".format(
-                    exo_var
-                )
-            )
+    codes = calendar_codes([st_date], window_size, freq, list_exo_variables)
+    lut = exogene_lut(list_exo_variables, cosinbase=cosinbase, newRange=new_range)
+    np_extra = apply_exogene_lut(lut, codes)
 
     if len(values.shape) == 1:
         values = np.expand_dims(np.expand_dims(values, axis=0), axis=0)
@@ -327,8 +285,399 @@ def create_exogene(
     return values
 
 
+# ===================== NILM windows =====================#
+def check_nilm_dtype(dtype):
+    """
+    Check dtype of NILM datasets: float64 (default), or float32 / float16 for a compact dataset.
+
+    Power values are bounded by the builders cutoff, so float16 needs no additional scale factor,
+    and status (0/1 or soft labels in [0, 1]) are exactly or closely represented.
+
+    Return : dtype name (str)
+    """
+    dtype = np.dtype(dtype).name
+    if dtype not in ["float64", "float32", "float16"]:
+        raise ValueError(
+            f"Only float64, float32 and float16 dtype supported for NILM dataset, got: {dtype}"
+        )
+
+    return dtype
+
+
+class ValidSpanIndex(object):
+    """
+    Index of the NaN-free spans of the continuous stems of one house.
+
+    Prefix-sums of NaN (and ON) timesteps are computed in a single pass over the stems, so that the validity
+    of any window [s, s + L) is answered in O(1) for any window size and stride (no rescan of the stems).
+
+    - stems: np.ndarray of size [2 * M_appliances, T] ordered as (load curve, states) of aggregate then of each appliance
+    - skip_all_off: if True, also index ON timesteps of appliances to skip windows where all appliances are OFF
+    """
+
+    def __init__(self, stems, skip_all_off=False):
+        self.length = stems.shape[1]
+        dtype = np.int32 if self.length < 2**31 else np.int64
+
+        self.mask_nan = np.isnan(stems).any(axis=0)
+        self.cum_nan = np.zeros(self.length + 1, dtype=dtype)
+        np.cumsum(self.mask_nan, out=self.cum_nan[1:])
+
+        if skip_all_off:
+            # States are non-negative: a window is all-OFF iff it has no non-zero state
+            self.cum_on = np.zeros(self.length + 1, dtype=dtype)
+            np.cumsum(stems[3::2].sum(axis=0) != 0, out=self.cum_on[1:])
+        else:
+            self.cum_on = None
+
+    def __len__(self):
+        return self.length
+
+    def is_valid(self, starts, window_size):
+        """
+        Validity of windows starting at provided indexes (NaN-free, and not all-OFF if skip_all_off).
+
+        Return : np.ndarray of bool of size [len(starts)]
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = starts + window_size
+
+        valid = (starts >= 0) & (ends <= self.length)
+        starts, ends = np.where(valid, starts, 0), np.where(valid, ends, 0)
+
+        valid &= self.cum_nan[ends] == self.cum_nan[starts]
+        if self.cum_on is not None:
+            valid &= self.cum_on[ends] != self.cum_on[starts]
+
+        return valid
+
+    def window_starts(self, window_size, window_stride):
+        """
+        Return : np.ndarray of size [N_valid] : starting index of each valid window on the window_stride grid
+        """
+        if self.length < window_size:
+            return np.empty(0, dtype=np.int64)
+
+        starts = np.arange(0, self.length - window_size + 1, window_stride, dtype=np.int64)
+
+        return starts[self.is_valid(starts, window_size)]
+
+    def spans(self, window_size):
+        """
+        Maximal NaN-free runs at least window_size long: every window inside a span is NaN-free.
+
+        Return : np.ndarray of size [N_spans, 2] : [start, end) indexes of each span
+        """
+        # Run boundaries from changes of the NaN mask
+        edges = np.diff(np.concatenate(([1], self.mask_nan.view(np.int8), [1])))
+        run_starts = np.flatnonzero(edges == -1)
+        run_ends = np.flatnonzero(edges == 1)
+
+        spans = np.stack((run_starts, run_ends), axis=1).astype(np.int64)
+
+        return spans[spans[:, 1] - spans[:, 0] >= window_size]
+
+
+def get_valid_window_starts(stems, window_size, window_stride, skip_all_off=False):
+    """
+    Find the valid windows of the continuous stems of one house, for any window_stride.
+
+    Validity is checked in O(1) per candidate window from prefix-sums of NaN (and ON) timesteps (see ValidSpanIndex).
+
+    - stems: np.ndarray of size [2 * M_appliances, T] ordered as (load curve, states) of aggregate then of each appliance
+      (or its ValidSpanIndex)
+    - skip_all_off: if True, also skip windows where all appliances are OFF
+
+    Return : np.ndarray of size [N_valid] : starting index in stems of each valid window
+    """
+    if not isinstance(stems, ValidSpanIndex):
+        stems = ValidSpanIndex(stems, skip_all_off=skip_all_off)
+
+    return stems.window_starts(window_size, window_stride)
+
+
+def get_valid_spans(stems, window_size):
+    """
+    Maximal NaN-free runs of the continuous stems of one house (or its ValidSpanIndex), at least window_size long:
+    every window inside a span is valid (without stride constraint).
+
+    Return : np.ndarray of size [N_spans, 2] : [start, end) indexes in stems of each span
+    """
+    if not isinstance(stems, ValidSpanIndex):
+        stems = ValidSpanIndex(stems)
+
+    return stems.spans(window_size)
+
+
+def gather_nilm_windows(stems, starts, window_size, out=None, chunk_size=1024):
+    """
+    Gather windows starting at provided indexes from the continuous stems of one house.
+
+    Windows are copied (and cast to the dtype of out) by chunks of chunk_size windows,
+    so that no temporary array larger than a chunk is allocated.
+
+    - stems: np.ndarray of size [2 * M_appliances, T]
+    - starts: np.ndarray of windows starting indexes (see get_valid_window_starts)
+    - out: if provided, np.ndarray of size [N_valid, M_appliances, 2, Win_Size] where windows are written
+
+    Return : np.ndarray of size [N_valid, M_appliances, 2, Win_Size]
+    """
+    n_channels = stems.shape[0]
+
+    if out is None:
+        out = np.empty((len(starts), n_channels // 2, 2, window_size), dtype=stems.dtype)
+
+    if len(starts):
+        # View of all windows as [2 * M_appliances, T - Win_Size + 1, Win_Size] (no copy)
+        windows = sliding_window_view(stems, window_size, axis=1)
+        out_windows = out.reshape((len(starts), n_channels, window_size))
+
+        for i in range(0, len(starts), chunk_size):
+            out_windows[i : i + chunk_size] = windows[
+                :, starts[i : i + chunk_size]
+            ].transpose(1, 0, 2)
+
+    return out
+
+
+def assemble_nilm_dataset(
+    house_indicies,
+    houses_stems,
+    n_appliances,
+    window_size,
+    dtype=np.float64,
+    out_file=None,
+):
+    """
+    Assemble windows of several houses in one NILM dataset in linear time.
+
+    Output is allocated once, exactly sized from per-house number of valid windows, and each house is
+    directly written into it. Stems of each house are released once written to keep memory close to final array size.
+
+    - houses_stems: list of tuple (stems, start_dates, starts) for each house (consumed)
+    - n_appliances: number of appliances (aggregate included)
+    - dtype: dtype of the output array (e.g. float32 or float16 for a compact dataset)
+    - out_file: if provided, output is a memory-mapped .npy file written on disk (out-of-core dataset)
+
+    Return : np.ndarray (np.memmap if out_file) of size [N_ts, M_appliances, 2, Win_Size],
+             pd.DataFrame of start dates indexed by house id
+    """
+    counts = [len(starts) for _, _, starts in houses_stems]
+    shape = (sum(counts), n_appliances, 2, window_size)
+
+    if out_file is not None:
+        output_data = np.lib.format.open_memmap(
+            out_file, mode="w+", dtype=dtype, shape=shape
+        )
+    else:
+        output_data = np.empty(shape, dtype=dtype)
+    list_st_date = []
+
+    offset = 0
+    for k, count in enumerate(counts):
+        stems, start_dates, starts = houses_stems[k]
+        gather_nilm_windows(
+            stems, starts, window_size, out=output_data[offset : offset + count]
+        )
+        list_st_date.append(start_dates)
+
+        houses_stems[k] = None
+        offset += count
+
+    if out_file is not None:
+        output_data.flush()
+
+    if len(list_st_date):
+        start_date = list_st_date[0].append(list_st_date[1:])
+    else:
+        start_date = pd.DatetimeIndex([])
+
+    st_date = pd.DataFrame(
+        data={"start_date": start_date},
+        index=np.repeat(np.array(house_indicies), counts),
+    )
+
+    return output_data, st_date
+
+
+def assemble_nilm_series(
+    house_indicies,
+    houses_stems,
+    n_appliances,
+    window_size,
+    dtype=np.float64,
+    freq=None,
+    skip_all_off=False,
+):
+    """
+    Assemble continuous stems of several houses in one virtual NILM dataset (windows are not materialized).
+
+    Stems of all houses are concatenated once in a [2 * M_appliances, T] array, and each valid window is only
+    referenced by its starting index in it (see NILMSeries).
+
+    NaN-free spans of each house (see get_valid_spans) are also kept for random cropping, with their starting
+    date computed from the sampling rate freq of the stems (houses without any valid window have no span).
+
+    - houses_stems: list of tuple (stems, start_dates, starts) for each house (consumed)
+    - skip_all_off: windows where all appliances are OFF were skipped from starts (kept in the NILMSeries for random cropping)
+
+    Return : NILMSeries of size [N_ts, M_appliances, 2, Win_Size], pd.DataFrame of start dates indexed by house id
+    """
+    lengths = [stems.shape[1] for stems, _, _ in houses_stems]
+    counts = [len(starts) for _, _, starts in houses_stems]
+
+    series = np.empty((2 * n_appliances, sum(lengths)), dtype=dtype)
+    list_starts = []
+    list_st_date = []
+    list_spans = []
+    list_span_st_date = []
+
+    offset = 0
+    for k, length in enumerate(lengths):
+        stems, start_dates, starts = houses_stems[k]
+        series[:, offset : offset + length] = stems
+        list_starts.append(starts + offset)
+        list_st_date.append(start_dates)
+
+        if freq is not None and len(starts):
+            # Stems are regularly sampled: date of any index from the first window
+            spans = get_valid_spans(stems, window_size)
+            step = pd.Timedelta(to_offset(freq))
+            list_spans.append(spans + offset)
+            list_span_st_date.append(
+                pd.DataFrame(
+                    data={
+                        "start_date": start_dates[0] + (spans[:, 0] - starts[0]) * step
+                    },
+                    index=np.full(len(spans), house_indicies[k]),
+                )
+            )
+
+        houses_stems[k] = None
+        offset += length
+
+    if len(list_st_date):
+        start_date = list_st_date[0].append(list_st_date[1:])
+        starts = np.concatenate(list_starts)
+    else:
+        start_date = pd.DatetimeIndex([])
+        starts = np.empty(0, dtype=np.int64)
+
+    st_date = pd.DataFrame(
+        data={"start_date": start_date},
+        index=np.repeat(np.array(house_indicies), counts),
+    )
+
+    if len(list_spans):
+        spans = np.concatenate(list_spans)
+        span_st_date = pd.concat(list_span_st_date)
+    else:
+        spans, span_st_date = None, None
+
+    return (
+        NILMSeries(
+            series,
+            starts,
+            window_size,
+            spans=spans,
+            span_st_date=span_st_date,
+            skip_all_off=skip_all_off,
+        ),
+        st_date,
+    )
+
+
+def _get_house_stems_worker(data_builder, indice, tmp_dir):
+    """
+    Process one house in a worker process: stems are sent back through a memory-mapped file instead of pickling.
+    """
+    stems, start_dates, starts = data_builder._get_house_stems(indice)
+
+    path = os.path.join(tmp_dir, f"stems_{indice}.npy")
+    np.save(path, stems)
+
+    return path, start_dates, starts
+
+
+def build_nilm_dataset(
+    data_builder, house_indicies, n_jobs=1, out_file=None, virtual=False
+):
+    """
+    Build NILM dataset of provided houses with a DataBuilder, houses being processed sequentially (n_jobs=1)
+    or in a pool of n_jobs processes (-1: all cores).
+
+    Houses results are gathered in the order of house_indicies. Stems computed by workers are passed through
+    memory-mapped files, and worker processes are forked (when available) so that raw data already loaded
+    by the parent process (e.g. PecanStreet partitions) is shared instead of pickled.
+
+    If out_file is provided, windows are written in a memory-mapped .npy file instead of memory.
+    If virtual, windows are not materialized (continuous series of each house and windows index, see NILMSeries).
+
+    Return : see assemble_nilm_dataset (or assemble_nilm_series if virtual)
+    """
+
+    def assemble(houses_stems):
+        if virtual:
+            return assemble_nilm_series(
+                house_indicies,
+                houses_stems,
+                len(data_builder.mask_app),
+                data_builder.window_size,
+                dtype=data_builder.dtype,
+                freq=data_builder.sampling_rate,
+                skip_all_off=data_builder.skip_all_off,
+            )
+
+        return assemble_nilm_dataset(
+            house_indicies,
+            houses_stems,
+            len(data_builder.mask_app),
+            data_builder.window_size,
+            dtype=data_builder.dtype,
+            out_file=out_file,
+        )
+
+    if n_jobs is None:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = os.cpu_count()
+    n_jobs = min(n_jobs, len(house_indicies))
+
+    if n_jobs <= 1:
+        houses_stems = [data_builder._get_house_stems(indice) for indice in house_indicies]
+
+        return assemble(houses_stems)
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("fork")
+        data_builder._load_shared_data()
+    else:
+        mp_context = None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp_context) as pool:
+            results = list(
+                pool.map(
+                    _get_house_stems_worker,
+                    repeat(data_builder),
+                    house_indicies,
+                    repeat(tmp_dir),
+                )
+            )
+
+        houses_stems = [
+            (np.load(path, mmap_mode="r"), start_dates, starts)
+            for path, start_dates, starts in results
+        ]
+
+        return assemble(houses_stems)
+
+
 # ===================== UKDALE DataBuilder =====================#
 class UKDALE_DataBuilder(object):
+    # Windows where all appliances are OFF are kept (see get_valid_window_starts)
+    skip_all_off = False
+
     def __init__(
         self,
         data_path,
@@ -338,6 +687,10 @@ class UKDALE_DataBuilder(object):
         window_stride=None,
         soft_label=False,
         use_status_from_kelly_paper=True,
+        frame_cache_bytes=2 * 1024**3,
+        frame_cache_dir=None,
+        frame_cache_disk_bytes=20 * 1024**3,
+        dtype="float64",
     ):
         # =============== Class variables =============== #
         self.data_path = data_path
@@ -345,6 +698,15 @@ class UKDALE_DataBuilder(object):
         self.sampling_rate = sampling_rate
         self.window_size = window_size
         self.soft_label = soft_label
+        self.dtype = check_nilm_dtype(dtype)
+
+        # Memo of processed house frames (LRU in bytes, optionally on disk), reused across get_nilm_dataset calls:
+        # the in-memory LRU is only filled with n_jobs=1, worker processes (n_jobs > 1) only use the on-disk layer
+        self.frame_cache = FrameCache(
+            max_bytes=frame_cache_bytes,
+            cache_dir=frame_cache_dir,
+            max_disk_bytes=frame_cache_disk_bytes,
+        )
 
         if isinstance(self.mask_app, str):
             self.mask_app = [self.mask_app]
@@ -452,7 +814,7 @@ class UKDALE_DataBuilder(object):
             "get_house_data() implemented to get data from 1 house only at a time."
         )
 
-        return self._get_dataframe(house_indicies[0])
+        return self._get_dataframe(house_indicies[0]).copy()
 
     def get_classif_dataset(self, house_indicies):
         """
@@ -475,10 +837,14 @@ class UKDALE_DataBuilder(object):
 
         return nilm_dataset[:, 0, 0, :], y, st_date
 
-    def get_nilm_dataset(self, house_indicies):
+    def get_nilm_dataset(self, house_indicies, n_jobs=1, out_file=None, virtual=False):
         """
         Process data to build NILM usecase
 
+        - n_jobs: number of processes used to process houses in parallel (1: sequential, -1: all cores)
+        - out_file: if provided, windows are written in this memory-mapped .npy file (out-of-core dataset)
+        - virtual: if True, windows are not materialized and a NILMSeries is returned instead of the 4D array
+
         Return :
             - np.ndarray of size [N_ts, M_appliances, 2, Win_Size] as :
 
@@ -497,64 +863,37 @@ class UKDALE_DataBuilder(object):
                 column 'start_date': Starting timestamp of each TS
         """
 
-        output_data = np.array([])
-        st_date = pd.DataFrame()
+        return build_nilm_dataset(
+            self, house_indicies, n_jobs=n_jobs, out_file=out_file, virtual=virtual
+        )
 
-        for indice in house_indicies:
-            tmp_list_st_date = []
+    def _get_house_stems(self, indice):
+        """
+        Load one house and find its valid windows.
 
-            data = self._get_dataframe(indice)
-            stems, st_date_stems = self._get_stems(data)
+        Return : stems (see _get_stems), start date and starting index in stems of each valid window
+        """
+        data = self._get_dataframe(indice)
+        stems, st_date_stems = self._get_stems(data)
+        starts = get_valid_window_starts(stems, self.window_size, self.window_stride)
 
-            if self.window_size == self.window_stride:
-                n_wins = len(data) // self.window_stride
-            else:
-                n_wins = 1 + ((len(data) - self.window_size) // self.window_stride)
+        return stems, st_date_stems[starts], starts
 
-            X = np.empty(
-                (len(house_indicies) * n_wins, len(self.mask_app), 2, self.window_size)
-            )
+    def _load_shared_data(self):
+        """
+        Load raw data shared by all houses before forking workers (nothing to share: one file per house).
+        """
+        return
 
-            cpt = 0
-            for i in range(n_wins):
-                tmp = stems[
-                    :,
-                    i * self.window_stride : i * self.window_stride + self.window_size,
-                ]
-
-                if not self._check_anynan(
-                    tmp
-                ):  # Check if nan -> skip the subsequences if it's the case
-                    tmp_list_st_date.append(st_date_stems[i * self.window_stride])
-
-                    X[cpt, 0, 0, :] = tmp[0, :]
-                    X[cpt, 0, 1, :] = (tmp[0, :] > 0).astype(dtype=int)
-
-                    key = 1
-                    for j in range(1, len(self.mask_app)):
-                        X[cpt, j, 0, :] = tmp[key, :]
-                        X[cpt, j, 1, :] = tmp[key + 1, :]
-                        key += 2
-
-                    cpt += 1  # Add one subsequence
-
-            tmp_st_date = pd.DataFrame(
-                data=tmp_list_st_date,
-                index=[indice for _ in range(cpt)],
-                columns=["start_date"],
-            )
-            output_data = (
-                np.concatenate((output_data, X[:cpt, :, :, :]), axis=0)
-                if output_data.size
-                else X[:cpt, :, :, :]
-            )
-            st_date = (
-                pd.concat([st_date, tmp_st_date], axis=0)
-                if st_date.size
-                else tmp_st_date
-            )
+    def _raw_files(self, house_indicies):
+        """
+        Raw files used to build data of provided houses (used to invalidate cached datasets).
+        """
+        files = []
+        for indice in house_indicies:
+            files += glob.glob(self.data_path + "House" + str(indice) + os.sep + "*")
 
-        return output_data, st_date
+        return files
 
     def _compute_status(self, initial_status, min_on, min_off, min_activation_time):
         tmp_status = np.zeros_like(initial_status)
@@ -599,41 +938,76 @@ class UKDALE_DataBuilder(object):
 
     def _get_stems(self, dataframe):
         """
-        Extract load curve for each chosen appliances.
+        Extract load curve and states of activation for aggregate and each chosen appliances.
 
-        Return : np.ndarray instance
+        Return : np.ndarray instance of size [2 * M_appliances, T], pd.DatetimeIndex
         """
-        stems = np.empty((1 + (len(self.mask_app) - 1) * 2, dataframe.shape[0]))
+        stems = np.empty((2 * len(self.mask_app), dataframe.shape[0]))
         stems[0, :] = dataframe["aggregate"].values
+        stems[1, :] = stems[0, :] > 0
 
-        key = 1
+        key = 2
         for appliance in self.mask_app[1:]:
             stems[key, :] = dataframe[appliance].values
             stems[key + 1, :] = dataframe[appliance + "_status"].values
             key += 2
 
-        return stems, list(dataframe.index)
+        return stems, dataframe.index
 
     def _get_dataframe(self, indice):
         """
-        Load houses data and return one dataframe with aggregate and appliance resampled at chosen time step.
+        Get processed house dataframe, computed once and then reused from the frame cache.
 
-        Return : pd.core.frame.DataFrame instance
+        Return : pd.core.frame.DataFrame instance (shared with the cache, not to be modified inplace)
         """
         path_house = self.data_path + "House" + str(indice) + os.sep
         self._check_if_file_exist(
             path_house + "labels.dat"
         )  # Check if labels exist at provided path
 
+        key = self._get_frame_key(indice, path_house)
+        house_data = self.frame_cache.get(key)
+
+        if house_data is None:
+            house_data = self._load_dataframe(indice)
+            self.frame_cache.put(key, house_data)
+
+        return house_data
+
+    def _get_frame_key(self, indice, path_house):
+        """
+        Key of a processed house frame: depends on builder parameters, on raw files size and mtime
+        and on preprocessing code version (as cached datasets).
+        """
+        params = {
+            "mask_app": self.mask_app,
+            "sampling_rate": self.sampling_rate,
+            "flag_week": self.flag_week,
+            "flag_day": self.flag_day,
+            "soft_label": self.soft_label,
+            "cutoff": self.cutoff,
+            "use_status_from_kelly_paper": self.use_status_from_kelly_paper,
+            "appliance_param": self.appliance_param,
+            "raw_files": files_signature(glob.glob(path_house + "*")),
+            "code_version": code_version(),
+        }
+
+        return f"UKDALE_House{indice}_{hash_params(params)}"
+
+    def _load_dataframe(self, indice):
+        """
+        Load houses data and return one dataframe with aggregate and appliance resampled at chosen time step.
+
+        Return : pd.core.frame.DataFrame instance
+        """
+        path_house = self.data_path + "House" + str(indice) + os.sep
+
         # House labels
         house_label = pd.read_csv(path_house + "labels.dat", sep=" ", header=None)
         house_label.columns = ["id", "appliance_name"]
 
         # Load aggregate load curve and resample to lowest sampling rate
-        house_data = pd.read_csv(path_house + "channel_1.dat", sep=" ", header=None)
-        house_data.columns = ["time", "aggregate"]
-        house_data["time"] = pd.to_datetime(house_data["time"], unit="s")
-        house_data = house_data.set_index("time")  # Set index to time
+        house_data = self._read_channel(path_house, 1, "aggregate")
         house_data = (
             house_data.resample("10s").mean().ffill(limit=6)
         )  # Resample to minimum of 10s and ffill for 1min30
@@ -670,12 +1044,7 @@ class UKDALE_DataBuilder(object):
                 ].values[0]
 
                 # Load aggregate load curve and resample to lowest sampling rate
-                appl_data = pd.read_csv(
-                    path_house + "channel_" + str(i) + ".dat", sep=" ", header=None
-                )
-                appl_data.columns = ["time", appliance]
-                appl_data["time"] = pd.to_datetime(appl_data["time"], unit="s")
-                appl_data = appl_data.set_index("time")
+                appl_data = self._read_channel(path_house, i, appliance)
                 appl_data = appl_data.resample("10s").mean().ffill(limit=6)
                 appl_data[appl_data < 5] = 0  # Remove small value
 
@@ -736,6 +1105,24 @@ class UKDALE_DataBuilder(object):
 
         return house_data
 
+    def _read_channel(self, path_house, channel, name):
+        """
+        Load one channel of a house, from its columnar version if available (see src/helpers/columnar.py).
+
+        Return : pd.core.frame.DataFrame instance indexed by time with one column named as provided
+        """
+        file = path_house + "channel_" + str(channel) + ".dat"
+
+        if has_columnar(file):
+            channel_data = read_columnar(file, columns=["time", "power"])
+        else:
+            channel_data = pd.read_csv(file, sep=" ", header=None)
+
+        channel_data.columns = ["time", name]
+        channel_data["time"] = pd.to_datetime(channel_data["time"], unit="s")
+
+        return channel_data.set_index("time")  # Set index to time
+
     def _check_appliance_names(self):
         """
         Check appliances names for UKDALE case.
@@ -762,15 +1149,12 @@ class UKDALE_DataBuilder(object):
             raise FileNotFoundError
         return
 
-    def _check_anynan(self, a):
-        """
-        Fast check of NaN in a numpy array.
-        """
-        return np.isnan(np.sum(a))
-
 
 # ===================== REFIT DataBuilder =====================#
 class REFIT_DataBuilder(object):
+    # Windows where all appliances are OFF are kept (see get_valid_window_starts)
+    skip_all_off = False
+
     def __init__(
         self,
         data_path,
@@ -780,12 +1164,14 @@ class REFIT_DataBuilder(object):
         window_stride=None,
         use_status_from_kelly_paper=False,
         soft_label=False,
+        dtype="float64",
     ):
         # =============== Class variables =============== #
         self.data_path = data_path
         self.mask_app = mask_app
         self.sampling_rate = sampling_rate
         self.soft_label = soft_label
+        self.dtype = check_nilm_dtype(dtype)
 
         if isinstance(self.mask_app, str):
             self.mask_app = [self.mask_app]
@@ -908,10 +1294,14 @@ class REFIT_DataBuilder(object):
 
         return nilm_dataset[:, 0, 0, :], y, st_date
 
-    def get_nilm_dataset(self, house_indicies):
+    def get_nilm_dataset(self, house_indicies, n_jobs=1, out_file=None, virtual=False):
         """
         Process data to build NILM usecase
 
+        - n_jobs: number of processes used to process houses in parallel (1: sequential, -1: all cores)
+        - out_file: if provided, windows are written in this memory-mapped .npy file (out-of-core dataset)
+        - virtual: if True, windows are not materialized and a NILMSeries is returned instead of the 4D array
+
         Return :
             - np.ndarray of size [N_ts, M_appliances, 2, Win_Size] as :
 
@@ -930,81 +1320,56 @@ class REFIT_DataBuilder(object):
                 column 'start_date': Starting timestamp of each TS
         """
 
-        output_data = np.array([])
-        st_date = pd.DataFrame()
+        return build_nilm_dataset(
+            self, house_indicies, n_jobs=n_jobs, out_file=out_file, virtual=virtual
+        )
 
-        for indice in house_indicies:
-            tmp_list_st_date = []
+    def _get_house_stems(self, indice):
+        """
+        Load one house and find its valid windows.
 
-            data = self._get_dataframe(indice)
-            stems, st_date_stems = self._get_stems(data)
+        Return : stems (see _get_stems), start date and starting index in stems of each valid window
+        """
+        data = self._get_dataframe(indice)
+        stems, st_date_stems = self._get_stems(data)
+        starts = get_valid_window_starts(stems, self.window_size, self.window_stride)
 
-            if self.window_size == self.window_stride:
-                n_wins = len(data) // self.window_stride
-            else:
-                n_wins = 1 + ((len(data) - self.window_size) // self.window_stride)
+        return stems, st_date_stems[starts], starts
 
-            X = np.empty(
-                (len(house_indicies) * n_wins, len(self.mask_app), 2, self.window_size)
-            )
+    def _load_shared_data(self):
+        """
+        Load raw data shared by all houses before forking workers (nothing to share: one file per house).
+        """
+        return
 
-            cpt = 0
-            for i in range(n_wins):
-                tmp = stems[
-                    :,
-                    i * self.window_stride : i * self.window_stride + self.window_size,
-                ]
-
-                if not self._check_anynan(
-                    tmp
-                ):  # Check if nan -> skip the subsequences if it's the case
-                    tmp_list_st_date.append(st_date_stems[i * self.window_stride])
-
-                    X[cpt, 0, 0, :] = tmp[0, :]
-                    X[cpt, 0, 1, :] = (tmp[0, :] > 0).astype(dtype=int)
-
-                    key = 1
-                    for j in range(1, len(self.mask_app)):
-                        X[cpt, j, 0, :] = tmp[key, :]
-                        X[cpt, j, 1, :] = tmp[key + 1, :]
-                        key += 2
-
-                    cpt += 1  # Add one subsequence
-
-            tmp_st_date = pd.DataFrame(
-                data=tmp_list_st_date,
-                index=[indice for j in range(cpt)],
-                columns=["start_date"],
-            )
-            output_data = (
-                np.concatenate((output_data, X[:cpt, :, :, :]), axis=0)
-                if output_data.size
-                else X[:cpt, :, :, :]
-            )
-            st_date = (
-                pd.concat([st_date, tmp_st_date], axis=0)
-                if st_date.size
-                else tmp_st_date
-            )
+    def _raw_files(self, house_indicies):
+        """
+        Raw files used to build data of provided houses (used to invalidate cached datasets).
+        """
+        files = [self.data_path + "HOUSES_Labels"]
+        for indice in house_indicies:
+            file = self.data_path + "CLEAN_House" + str(indice) + ".csv"
+            files += [file, columnar_path(file)]
 
-        return output_data, st_date
+        return files
 
     def _get_stems(self, dataframe):
         """
-        Extract load curve for each chosen appliances.
+        Extract load curve and states of activation for aggregate and each chosen appliances.
 
-        Return : np.ndarray instance
+        Return : np.ndarray instance of size [2 * M_appliances, T], pd.DatetimeIndex
         """
-        stems = np.empty((1 + (len(self.mask_app) - 1) * 2, dataframe.shape[0]))
+        stems = np.empty((2 * len(self.mask_app), dataframe.shape[0]))
         stems[0, :] = dataframe["Aggregate"].values
+        stems[1, :] = stems[0, :] > 0
 
-        key = 1
+        key = 2
         for appliance in self.mask_app[1:]:
             stems[key, :] = dataframe[appliance].values
             stems[key + 1, :] = dataframe[appliance + "_status"].values
             key += 2
 
-        return stems, list(dataframe.index)
+        return stems, dataframe.index
 
     def _compute_status(self, initial_status, min_on, min_off, min_activation_time):
         tmp_status = np.zeros_like(initial_status)
@@ -1054,15 +1419,24 @@ class REFIT_DataBuilder(object):
         Return : pd.core.frame.DataFrame instance
         """
         file = self.data_path + "CLEAN_House" + str(indice) + ".csv"
-        self._check_if_file_exist(file)
-        labels_houses = pd.read_csv(self.data_path + "HOUSES_Labels").set_index(
-            "House_id"
-        )
 
-        house_data = pd.read_csv(file)
-        house_data.columns = list(labels_houses.loc[int(indice)].values)
-        house_data = house_data.set_index("Time").sort_index()
-        house_data.index = pd.to_datetime(house_data.index)
+        if has_columnar(file):
+            # Only load needed columns
+            house_data = read_columnar(
+                file, columns=["Time"] + self.mask_app + ["Issues"]
+            )
+            house_data["Time"] = pd.to_datetime(house_data["Time"])
+            house_data = house_data.set_index("Time").sort_index()
+        else:
+            self._check_if_file_exist(file)
+            labels_houses = pd.read_csv(self.data_path + "HOUSES_Labels").set_index(
+                "House_id"
+            )
+
+            house_data = pd.read_csv(file)
+            house_data.columns = list(labels_houses.loc[int(indice)].values)
+            house_data = house_data.set_index("Time").sort_index()
+            house_data.index = pd.to_datetime(house_data.index)
         idx_to_drop = house_data[house_data["Issues"] == 1].index
         house_data = house_data.drop(index=idx_to_drop, axis=0)
         house_data = (
@@ -1168,16 +1542,43 @@ class REFIT_DataBuilder(object):
             raise FileNotFoundError
         return
 
-    def _check_anynan(self, a):
-        """
-        Fast check of NaN in a numpy array.
-        """
-        return np.isnan(np.sum(a))
+
+# ===================== PecanStreet DataBuilder =====================#
+# Parsed PecanStreet raw file partitioned by house, shared by every builder instance of the process
+_PECANSTREET_PARTITIONS = {}
+
+
+def load_pecanstreet_partitions(file_path):
+    """
+    Load PecanStreet 1-minute raw csv file once and partition it by house (i.e. 'dataid').
+
+    The partitions are kept at module level and keyed by file path: all PecanStreet_DataBuilder instances
+    of the same process (e.g. one per appliance group) are served from the same parsed data.
+
+    Return : dict {dataid: pd.core.frame.DataFrame indexed and sorted by 'localminute'}
+    """
+    file_path = os.path.abspath(file_path)
+
+    if file_path not in _PECANSTREET_PARTITIONS:
+        df = pd.read_csv(file_path)
+        df["localminute"] = pd.to_datetime(df["localminute"], utc=True)
+
+        _PECANSTREET_PARTITIONS[file_path] = {
+            dataid: house.set_index("localminute").sort_index()
+            for dataid, house in df.groupby("dataid", sort=False)
+        }
+        del df
+
+    return _PECANSTREET_PARTITIONS[file_path]
 
 
 class PecanStreet_DataBuilder(object):
-    def __init__(self, data_path, mask_app, sampling_rate, window_size, window_stride=None, soft_label=False):
+    # Windows where all appliances are OFF are skipped (see get_valid_window_starts)
+    skip_all_off = True
+
+    def __init__(self, data_path, mask_app, sampling_rate, window_size, window_stride=None, soft_label=False, dtype="float64"):
         self.data_path = data_path
+        self.dtype = check_nilm_dtype(dtype)
         self.mask_app = mask_app if isinstance(mask_app, list) else [mask_app]
         self.sampling_rate = sampling_rate
         self.window_size = window_size
@@ -1203,41 +1604,61 @@ class PecanStreet_DataBuilder(object):
         
         self.mask_app = ["grid"] + self.mask_app
 
-    def get_nilm_dataset(self, house_indicies):
-        output_data, st_date = np.array([]), pd.DataFrame()
+    def get_nilm_dataset(self, house_indicies, n_jobs=1, out_file=None, virtual=False):
+        return build_nilm_dataset(
+            self, house_indicies, n_jobs=n_jobs, out_file=out_file, virtual=virtual
+        )
 
+    def _get_house_stems(self, indice):
+        stems, st_date_stems = self._get_stems(self._get_dataframe(indice))
+        # Skip nan and all-OFF windows
+        starts = get_valid_window_starts(stems, self.window_size, self.window_stride, skip_all_off=self.skip_all_off)
+        return stems, st_date_stems[starts], starts
+
+    def _load_shared_data(self):
+        # Parse raw csv once in parent process (shared with forked workers) if no columnar store
+        if not os.path.isdir(os.path.join(self.data_path, "1minute_data_austin")):
+            load_pecanstreet_partitions(f"{self.data_path}1minute_data_austin.csv")
+
+    def _raw_files(self, house_indicies):
+        # Raw files used to build data of provided houses (used to invalidate cached datasets)
+        files = [
+            f"{self.data_path}1minute_data_austin.csv",
+            f"{self.data_path}pecan_processed/groups_meta.json",
+        ]
         for indice in house_indicies:
-            tmp_list_st_date = []
-            data = self._get_dataframe(indice)
-            stems, st_date_stems = self._get_stems(data)
-            n_wins = len(data) // self.window_stride if self.window_size == self.window_stride else 1 + ((len(data) - self.window_size) // self.window_stride)
-            X = np.empty((len(house_indicies) * n_wins, len(self.mask_app), 2, self.window_size))
-
-            cpt = 0
-            for i in range(n_wins):
-                tmp = stems[:, i * self.window_stride : i * self.window_stride + self.window_size]
-                if not self._check_anynan(tmp):
-                    if tmp[2::2, :].sum() == 0:  # Skip all-OFF windows
-                        continue
-                    tmp_list_st_date.append(st_date_stems[i * self.window_stride])
-                    X[cpt, 0, 0, :] = tmp[0, :]
-                    X[cpt, 0, 1, :] = (tmp[0, :] > 0).astype(int)
-                    key = 1
-                    for j in range(1, len(self.mask_app)):
-                        X[cpt, j, 0, :], X[cpt, j, 1, :] = tmp[key, :], tmp[key + 1, :]
-                        key += 2
-                    cpt += 1
-
-            tmp_st_date = pd.DataFrame(tmp_list_st_date, index=[indice] * cpt, columns=["start_date"])
-            output_data = np.concatenate((output_data, X[:cpt, :, :, :]), axis=0) if output_data.size else X[:cpt, :, :, :]
-            st_date = pd.concat([st_date, tmp_st_date], axis=0) if st_date.size else tmp_st_date
-
-        return output_data, st_date
+            files.append(columnar_path(pecanstreet_house_file(self.data_path, indice)))
+
+        return files
+
+    def _get_house_partition(self, indice):
+        """
+        Get raw data of one house, from its columnar file if available (see src/helpers/columnar.py),
+        else from the partitioned (by 'dataid') PecanStreet csv file.
+
+        Return : pd.core.frame.DataFrame instance (empty if house not in the file)
+        """
+        file = pecanstreet_house_file(self.data_path, indice)
+        if has_columnar(file):
+            # Only load needed columns
+            columns = ["localminute", "grid", "solar", "solar2"]
+            for app in self.mask_app[1:]:
+                columns += self.meta[app]['cols'] if app in self.meta else [app]
+
+            house = read_columnar(file, columns=columns)
+            house['localminute'] = pd.to_datetime(house['localminute'], utc=True)
+
+            return house.set_index('localminute')
+
+        partitions = load_pecanstreet_partitions(f"{self.data_path}1minute_data_austin.csv")
+
+        if indice in partitions:
+            return partitions[indice]
+        else:
+            return next(iter(partitions.values())).iloc[:0]
 
     def _get_dataframe(self, indice):
-        df = pd.read_csv(f"{self.data_path}1minute_data_austin.csv")
-        df['localminute'] = pd.to_datetime(df['localminute'], utc=True)
-        house = df[df['dataid'] == indice].set_index('localminute').sort_index().resample('1min').mean().ffill(limit=5)
+        house = self._get_house_partition(indice).resample('1min').mean().ffill(limit=5)
         
         # Add solar to grid
         if 'solar' in house.columns:
@@ -1269,13 +1690,11 @@ class PecanStreet_DataBuilder(object):
         return house
 
     def _get_stems(self, dataframe):
-        stems = np.empty((1 + (len(self.mask_app) - 1) * 2, dataframe.shape[0]))
+        stems = np.empty((2 * len(self.mask_app), dataframe.shape[0]))
         stems[0, :] = dataframe["grid"].values
-        key = 1
+        stems[1, :] = stems[0, :] > 0
+        key = 2
         for appliance in self.mask_app[1:]:
             stems[key, :], stems[key + 1, :] = dataframe[appliance].values, dataframe[f"{appliance}_status"].values
             key += 2
-        return stems, list(dataframe.index)
-
-    def _check_anynan(self, a):
-        return np.isnan(np.sum(a))
\ No newline at end of file
+        return stems, dataframe.index
\ No newline at end of file
@@ -0,0 +1,301 @@
+#################################################################################################################
+#
+# @copyright : ©2025 EDF
+# @author : Adrien Petralia
+# @description : NILMFormer - Sharded NILM datasets
+#
+#################################################################################################################
+
+import os
+import copy
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src.helpers.cache import builder_params, st_date_from_index
+from src.helpers.dataset import _NILMIterableDataset, chunked_stats
+from src.helpers.preprocessing import gather_nilm_windows
+
+MANIFEST = "manifest.json"
+
+
+# ===================== Export ===================== #
+def export_nilm_shards(data_builder, house_indicies, out_dir, shard_size=65536):
+    """
+    Export windows of provided houses built by a DataBuilder in fixed-size shards.
+
+    Houses are processed one at a time and each shard is written as soon as gathered: memory stays bounded
+    by one house stems and one shard whatever the corpus size. A shard only holds windows of one house
+    (house splits select whole shards), written as an uncompressed 'shard_XXXXX.npz' with:
+
+    - power: np.ndarray of size [N_windows, M_appliances, Win_Size] (aggregate then each appliance)
+    - status: np.ndarray of size [N_windows, M_appliances, Win_Size]
+    - start_date: np.ndarray int64 of size [N_windows], start timestamp of each window (ns since epoch, UTC)
+
+    The manifest ('manifest.json', written last) lists the shards (file, house, number of windows)
+    with the builder parameters and the timezone and resolution of start dates.
+
+    Return : manifest (dict)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    shards = []
+    tz, unit = None, "ns"
+    for indice in house_indicies:
+        stems, start_dates, starts = data_builder._get_house_stems(indice)
+        if start_dates.tz is not None:
+            tz = str(start_dates.tz)
+        unit = start_dates.unit
+        start_ns = pd.DatetimeIndex(start_dates).as_unit("ns").asi8
+
+        for start in range(0, len(starts), shard_size):
+            windows = gather_nilm_windows(
+                stems, starts[start : start + shard_size], data_builder.window_size
+            )
+            file = f"shard_{len(shards):05d}.npz"
+
+            # Written under a temporary name: a listed shard is always complete
+            tmp_file = os.path.join(out_dir, file + ".tmp")
+            with open(tmp_file, "wb") as f:
+                np.savez(
+                    f,
+                    power=windows[:, :, 0, :],
+                    status=windows[:, :, 1, :],
+                    start_date=start_ns[start : start + shard_size],
+                )
+            os.replace(tmp_file, os.path.join(out_dir, file))
+
+            shards.append({"file": file, "house": int(indice), "n_windows": len(windows)})
+
+        logging.info("House %s exported: %s windows.", indice, len(starts))
+
+    manifest = {
+        "dataset": type(data_builder).__name__.split("_")[0],
+        "mask_app": list(data_builder.mask_app),
+        "window_size": int(data_builder.window_size),
+        "sampling_rate": data_builder.sampling_rate,
+        "dtype": np.dtype(data_builder.dtype).name,
+        "tz": tz,
+        "unit": unit,
+        "shard_size": shard_size,
+        "params": builder_params(data_builder),
+        "shards": shards,
+    }
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+    return manifest
+
+
+# ===================== Sharded dataset ===================== #
+class NILMShards(object):
+    """
+    Sharded NILM dataset on disk (see export_nilm_shards), read shard by shard with sequential I/O.
+
+    Same conventions as an out-of-core NILMArrayView: shape [N_sequences, M_appliances, 2, Win_Size],
+    statistics computed by chunks (one shard at a time) for NILMscaler.fit, and lazy scaling
+    (NILMscaler.transform returns a copy applying the scaler to each shard read).
+
+    - shard_dir: folder of the exported shards and manifest
+    - houses: if provided, only shards of these houses (e.g. train, valid or test houses)
+    """
+
+    def __init__(self, shard_dir, houses=None, scalers=()):
+        self.shard_dir = shard_dir
+        self.scalers = tuple(scalers)
+
+        with open(os.path.join(shard_dir, MANIFEST), "r") as f:
+            self.manifest = json.load(f)
+
+        self.shards = self.manifest["shards"]
+        if houses is not None:
+            houses = [int(house) for house in houses]
+            self.shards = [shard for shard in self.shards if shard["house"] in houses]
+
+    @property
+    def window_size(self):
+        return self.manifest["window_size"]
+
+    @property
+    def freq(self):
+        return self.manifest["sampling_rate"]
+
+    @property
+    def dtype(self):
+        return np.dtype(self.manifest["dtype"])
+
+    @property
+    def shape(self):
+        return (len(self), len(self.manifest["mask_app"]), 2, self.window_size)
+
+    @property
+    def ndim(self):
+        return 4
+
+    @property
+    def houses(self):
+        return list(dict.fromkeys(shard["house"] for shard in self.shards))
+
+    def __len__(self):
+        return sum(shard["n_windows"] for shard in self.shards)
+
+    def select(self, houses):
+        """
+        Return : NILMShards of the provided houses only
+        """
+        houses = [int(house) for house in houses]
+        new = copy.copy(self)
+        new.shards = [shard for shard in self.shards if shard["house"] in houses]
+
+        return new
+
+    def with_scaler(self, scaler):
+        """
+        Return : NILMShards applying scaler (after already attached ones) to each shard read
+        """
+        new = copy.copy(self)
+        new.scalers = self.scalers + (scaler,)
+
+        return new
+
+    def _load(self, k, keys):
+        with np.load(os.path.join(self.shard_dir, self.shards[k]["file"])) as npz:
+            return [npz[key] for key in keys]
+
+    def read_shard(self, k):
+        """
+        Read (and scale) the k-th shard.
+
+        Return : np.ndarray of size [N_windows, M_appliances, 2, Win_Size],
+                 np.ndarray int64 of start timestamps (ns since epoch, UTC)
+        """
+        power, status, start_date = self._load(k, ["power", "status", "start_date"])
+        block = np.stack((power, status), axis=2)
+
+        for scaler in self.scalers:
+            block = scaler.transform(block)
+
+        return block, start_date
+
+    def chunk_stats(self, channel):
+        """
+        Mean, std, min and max of one channel (power of the provided appliance, 0 for aggregate) computed shard by shard.
+
+        Return : dict
+        """
+        return chunked_stats(
+            (self._load(k, ["power"])[0][:, channel, :] for k in range(len(self.shards))),
+            self.dtype,
+        )
+
+    def get_st_date(self):
+        """
+        Return : pd.DataFrame of start dates indexed by house id (same convention as NILM datasets)
+        """
+        house_ids = np.repeat(
+            [shard["house"] for shard in self.shards],
+            [shard["n_windows"] for shard in self.shards],
+        )
+        start_dates = [self._load(k, ["start_date"])[0] for k in range(len(self.shards))]
+        start_dates = (
+            np.concatenate(start_dates) if len(start_dates) else np.empty(0, dtype=np.int64)
+        )
+
+        return st_date_from_index(
+            house_ids, start_dates, tz=self.manifest["tz"], unit=self.manifest["unit"]
+        )
+
+    def load(self):
+        """
+        Load (and scale) all shards in memory, e.g. for valid and test houses.
+
+        Return : np.ndarray of size [N_sequences, M_appliances, 2, Win_Size], pd.DataFrame of start dates
+        """
+        data = np.empty(self.shape, dtype=self.dtype)
+
+        offset = 0
+        for k in range(len(self.shards)):
+            block, _ = self.read_shard(k)
+            data[offset : offset + len(block)] = block
+            offset += len(block)
+
+        return data, self.get_st_date()
+
+
+class NILMShardDataset(_NILMIterableDataset):
+    """
+    Pytorch iterable dataset streaming windows of a NILMShards (e.g. scaler.transform(NILMShards(...)))
+
+    Shards are split between DataLoader workers (each worker reads its own shards sequentially),
+    and between processes in distributed training.
+    If shuffle, the order of shards is drawn at each epoch and windows are shuffled within each shard,
+    then mixed across shards through a shuffle buffer of shuffle_buffer windows.
+
+    Same outputs as NILMDataset (cam and pretraining excepted).
+    Epoch seeds are drawn from torch RNG (reproducible with torch.manual_seed).
+    """
+
+    def __init__(
+        self,
+        shards,
+        shuffle=False,
+        shuffle_buffer=0,
+        list_exo_variables=[],
+        use_temperature=False,
+        freq=None,
+        cosinbase=True,
+        newRange=(-1, 1),
+        inst_scaling=False,
+        timestamp_encoding=False,
+    ):
+        self._init_inputs(
+            list_exo_variables,
+            use_temperature,
+            shards.freq if freq is None else freq,
+            cosinbase,
+            newRange,
+            inst_scaling,
+            timestamp_encoding,
+        )
+
+        self.shards = shards
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.L = shards.window_size
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __iter__(self):
+        seed, worker_id, num_workers = self._worker_info()
+
+        # Same shards order in all workers, each reading every num_workers-th shard
+        order = np.arange(len(self.shards.shards))
+        if self.shuffle:
+            order = np.random.default_rng(seed).permutation(order)
+        rng = np.random.default_rng(seed + 1 + worker_id)
+
+        buffer = []
+        for k in order[worker_id::num_workers]:
+            block, start_date = self.shards.read_shard(k)
+            if self.shuffle:
+                perm = rng.permutation(len(block))
+                block, start_date = block[perm], start_date[perm]
+
+            # Start dates as read by NILMDataset from st_date values (UTC)
+            start_dates = start_date.view("datetime64[ns]") if self._needs_dates() else None
+
+            for sample in self._iter_samples(block, start_dates):
+                if self.shuffle and self.shuffle_buffer > 1:
+                    if len(buffer) < self.shuffle_buffer:
+                        buffer.append(sample)
+                        continue
+                    # Yield a random buffered window, replaced by the new one
+                    j = rng.integers(len(buffer))
+                    buffer[j], sample = sample, buffer[j]
+                yield sample
+
+        rng.shuffle(buffer)
+        yield from buffer
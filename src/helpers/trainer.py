@@ -8,7 +8,9 @@
 
 import os
 import time
+import random
 import logging
+import contextlib
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -17,7 +19,184 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 
+from torch.nn.parallel import DistributedDataParallel
+
 from src.helpers.metrics import NILMmetrics
+from src.helpers.distributed import (
+    all_gather_object,
+    all_reduce_sum,
+    get_rank,
+    get_world_size,
+    is_main_process,
+    set_loader_epoch,
+)
+
+
+PRECISION_DTYPES = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def check_precision(precision):
+    if precision not in PRECISION_DTYPES:
+        raise ValueError(
+            "Precision {} unknown, only 'fp32', 'bf16' or 'fp16'.".format(precision)
+        )
+    return
+
+
+def autocast_context(device, precision="fp32"):
+    """
+    Autocast context for mixed precision forward passes on CPU or accelerators (disabled for fp32).
+    """
+    dtype = PRECISION_DTYPES[precision]
+    if dtype is None:
+        return contextlib.nullcontext()
+
+    return torch.autocast(device_type=torch.device(device).type, dtype=dtype)
+
+
+def get_grad_scaler(device, precision="fp32"):
+    """
+    Gradient scaler of fp16 training (pass-through for fp32 and bf16).
+    """
+    return torch.amp.GradScaler(
+        torch.device(device).type, enabled=precision == "fp16"
+    )
+
+
+def log_step_loss(step, loss_sum, log_interval):
+    """
+    Log running mean train loss every log_interval steps (the only device sync of the training loop).
+    """
+    if log_interval and step % log_interval == 0:
+        logging.info("    Step {} - Train loss : {:.6f}".format(step, float(loss_sum) / step))
+    return
+
+
+def unwrap_model(model):
+    """
+    Underlying model of a DataParallel, DistributedDataParallel and/or compiled (torch.compile) module:
+    its state dict is saved and restored without wrappers prefixes, and can be loaded in a plain model instance.
+    """
+    if isinstance(model, (nn.DataParallel, DistributedDataParallel)):
+        model = model.module
+
+    return getattr(model, "_orig_mod", model)
+
+
+def local_model(model):
+    """
+    Module of a DistributedDataParallel model (other wrappers kept), to be run by a single process
+    (e.g. rank 0 evaluation) without collective calls.
+    """
+    if isinstance(model, DistributedDataParallel):
+        return model.module
+
+    return model
+
+
+def init_lazy_modules(model, inputs):
+    """
+    Dummy forward (on cpu) of a batch of the size of inputs to initialize Lazy Modules (e.g. nn.LazyLinear),
+    required before DataParallel or DistributedDataParallel call.
+    """
+    if not any(
+        isinstance(module, nn.modules.lazy.LazyModuleMixin)
+        and module.has_uninitialized_params()
+        for module in model.modules()
+    ):
+        return
+
+    model.to("cpu")
+    with torch.no_grad():
+        if isinstance(inputs, (tuple, list)):
+            model((torch.rand(inputs[0].shape), inputs[1]))
+        else:
+            model(torch.rand(inputs.shape))
+    return
+
+
+def distributed_model(model, device):
+    """
+    DistributedDataParallel module of model (one process per device: cpu with gloo backend or one GPU per process).
+    """
+    device = torch.device(device)
+    return DistributedDataParallel(
+        model.to(device), device_ids=[device.index] if device.type == "cuda" else None
+    )
+
+
+def join_context(model):
+    """
+    Context of a training epoch: with DistributedDataParallel, processes running out of batches first
+    (uneven number of batches, e.g. iterable datasets) shadow the gradients sync of the others.
+    """
+    if isinstance(model, DistributedDataParallel):
+        return model.join()
+
+    return contextlib.nullcontext()
+
+
+def _loader_generators(loader):
+    """
+    torch.Generator of a DataLoader (workers seeds) and of its sampler (shuffling), if any.
+    """
+    sampler = getattr(loader.sampler, "sampler", loader.sampler)
+
+    generators = []
+    for generator in (getattr(loader, "generator", None), getattr(sampler, "generator", None)):
+        if generator is not None and all(generator is not g for g in generators):
+            generators.append(generator)
+
+    return generators
+
+
+def get_rng_state(loader):
+    """
+    RNG states of the process: python, numpy, torch (cpu and cuda) and generators of the train loader.
+
+    Return : dict
+    """
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+        "loader": [generator.get_state() for generator in _loader_generators(loader)],
+    }
+
+
+def set_rng_state(state, loader):
+    """
+    Restore RNG states saved by get_rng_state.
+    """
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if torch.cuda.is_available() and len(state["cuda"]) == torch.cuda.device_count():
+        torch.cuda.set_rng_state_all(state["cuda"])
+    for generator, generator_state in zip(_loader_generators(loader), state["loader"]):
+        generator.set_state(generator_state)
+    return
+
+
+def save_atomic(obj, path):
+    """
+    torch.save written under a temporary name then renamed: a job killed while saving never leaves a truncated file.
+    """
+    torch.save(obj, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return
+
+
+def _concat_outputs(*outputs):
+    """
+    Concatenate per batch outputs (lists of flat np.ndarray) gathered during evaluation.
+
+    Return : tuple of np.ndarray (empty array for an empty list)
+    """
+    return tuple(
+        np.concatenate(output) if len(output) else np.array([]) for output in outputs
+    )
 
 
 class SeqToSeqTrainer:
@@ -45,11 +224,26 @@ class SeqToSeqTrainer:
         path_fig=None,
         save_checkpoint=False,
         path_checkpoint=None,
+        precision="fp32",
+        log_interval=None,
+        distributed=False,
+        resume_every=None,
     ):
         """
         PyTorch Model Trainer Class for SeqToSeq NILM (per timestamps estimation)
 
         Can be either: classification, values in [0,1] or energy power estimation for each timesteps
+
+        precision: 'fp32', 'bf16' or 'fp16' (with grad scaling) autocast of forward passes,
+        losses and metrics being computed in fp32
+
+        Losses are accumulated on device (read once per epoch), log_interval: log train loss every log_interval steps
+
+        distributed: DistributedDataParallel training (process group initialized, e.g. launched with torchrun),
+        losses being reduced across processes and checkpoints saved by rank 0 only
+
+        resume_every: save the full trainer state every resume_every epochs (see save_resume_checkpoint),
+        training being resumed where it stopped with load_resume_checkpoint
         """
 
         # =======================class variables======================= #
@@ -61,6 +255,8 @@ class SeqToSeqTrainer:
         self.valid_loader = valid_loader
         self.device = device
         self.all_gpu = all_gpu
+        self.distributed = distributed
+        self.resume_every = resume_every
         self.verbose = verbose
         self.plotloss = plotloss
         self.save_checkpoint = save_checkpoint
@@ -77,6 +273,19 @@ class SeqToSeqTrainer:
 
         if self.training_in_model:
             assert hasattr(self.model, "train_one_epoch")
+            if self.distributed:
+                raise ValueError(
+                    "Distributed training not available for models trained by their own train_one_epoch."
+                )
+
+        check_precision(precision)
+        self.precision = precision
+        self.log_interval = log_interval
+        self.grad_scaler = get_grad_scaler(self.device, self.precision)
+        if self.training_in_model and self.precision == "fp16":
+            logging.warning(
+                "No grad scaling in model train_one_epoch: model trained in fp32 (fp16 only used for evaluation)."
+            )
 
         self.train_criterion = criterion
         if valid_criterion is None:
@@ -101,6 +310,8 @@ class SeqToSeqTrainer:
         self.train_time = 0
         self.eval_time = 0
         self.passed_epochs = 0
+        self.start_epoch = 0
+        self.early_stopped = False
         self.best_loss = np.inf
         self.loss_train_history = []
         self.loss_valid_history = []
@@ -110,12 +321,15 @@ class SeqToSeqTrainer:
         if self.patience_es is not None:
             self.early_stopping = EarlyStopper(patience=self.patience_es)
 
-        if self.all_gpu:
+        if self.all_gpu or self.distributed:
             # =========== Dummy forward to intialize Lazy Module =========== #
-            self.model.to("cpu")
             for ts, _, _ in train_loader:
-                self.model(torch.rand(ts.shape))
+                init_lazy_modules(self.model, ts)
                 break
+        if self.distributed:
+            # =========== Distributed Data Parallel Module call =========== #
+            self.model = distributed_model(self.model, self.device)
+        elif self.all_gpu:
             # =========== Data Parrallel Module call =========== #
             self.model = nn.DataParallel(self.model)
         self.model.to(self.device)
@@ -126,24 +340,32 @@ class SeqToSeqTrainer:
         """
 
         # flag_es = 0
-        tmp_time = time.time()
+        # Resumed training: time of previous epochs included
+        tmp_time = time.time() - self.train_time
+
+        for epoch in range(self.start_epoch, n_epochs):
+            if self.early_stopped:
+                break
+            set_loader_epoch(self.train_loader, epoch)
 
-        for epoch in range(n_epochs):
             # =======================one epoch======================= #
             if self.training_in_model:
                 self.model.train()
-                if self.all_gpu:
-                    train_loss = self.model.module.train_one_epoch(
-                        loader=self.train_loader,
-                        optimizer=self.optimizer,
-                        device=self.device,
-                    )
-                else:
-                    train_loss = self.model.train_one_epoch(
-                        loader=self.train_loader,
-                        optimizer=self.optimizer,
-                        device=self.device,
-                    )
+                with autocast_context(
+                    self.device, "fp32" if self.precision == "fp16" else self.precision
+                ):
+                    if self.all_gpu:
+                        train_loss = self.model.module.train_one_epoch(
+                            loader=self.train_loader,
+                            optimizer=self.optimizer,
+                            device=self.device,
+                        )
+                    else:
+                        train_loss = self.model.train_one_epoch(
+                            loader=self.train_loader,
+                            optimizer=self.optimizer,
+                            device=self.device,
+                        )
             else:
                 train_loss = self.__train()
             self.loss_train_history.append(train_loss)
@@ -166,6 +388,7 @@ class SeqToSeqTrainer:
                         # flag_es  = 1
                         epoch + 1
                         self.passed_epochs += 1
+                        self.early_stopped = True
                         if self.verbose:
                             logging.info(
                                 "Early stopping after {} epochs !".format(epoch + 1)
@@ -187,9 +410,7 @@ class SeqToSeqTrainer:
             ):
                 self.best_loss = valid_loss
                 self.log = {
-                    "model_state_dict": self.model.module.state_dict()
-                    if self.device == "cuda" and self.all_gpu
-                    else self.model.state_dict(),
+                    "model_state_dict": unwrap_model(self.model).state_dict(),
                     "optimizer_state_dict": self.optimizer.state_dict(),
                     "loss_train_history": self.loss_train_history,
                     "loss_valid_history": self.loss_valid_history,
@@ -202,12 +423,20 @@ class SeqToSeqTrainer:
 
             self.passed_epochs += 1
 
+            # =======================resume checkpoint======================= #
+            if self.resume_every and self.passed_epochs % self.resume_every == 0:
+                self.train_time = round((time.time() - tmp_time), 3)
+                self.save_resume_checkpoint()
+
         self.train_time = round((time.time() - tmp_time), 3)
 
+        if self.resume_every:
+            self.save_resume_checkpoint()
+
         if self.plotloss:
             self.plot_history()
 
-        if self.save_checkpoint:
+        if self.save_checkpoint and is_main_process():
             self.log["best_model_state_dict"] = torch.load(
                 self.path_checkpoint + ".pt"
             )["model_state_dict"]
@@ -236,13 +465,14 @@ class SeqToSeqTrainer:
         Public function : model evaluation on test dataset
         """
         loss_valid = 0
+        n_samples = 0
 
-        y = np.array([])
-        y_hat = np.array([])
-        y_win = np.array([])
-        y_hat_win = np.array([])
-        y_state = np.array([])
-        y_hat_state = np.array([])
+        y = []
+        y_hat = []
+        y_win = []
+        y_hat_win = []
+        y_state = []
+        y_hat_state = []
 
         start_time = time.time()
         with torch.no_grad():
@@ -250,21 +480,25 @@ class SeqToSeqTrainer:
                 self.model.eval()
 
                 # ===================variables=================== #
-                ts_agg = torch.Tensor(ts_agg.float()).to(self.device)
+                ts_agg = self._input_to_device(ts_agg)
 
                 if self.consumption_pred:
-                    target = torch.Tensor(appl.float()).to(self.device)
+                    target = appl.float().to(self.device, non_blocking=True)
                 else:
-                    target = torch.Tensor(state.float()).to(self.device)
+                    target = state.float().to(self.device, non_blocking=True)
 
                 # ===================forward and loss===================== #
-                if self.loss_in_model:
-                    pred, _ = self.model(ts_agg, target)
-                else:
-                    pred = self.model(ts_agg)
+                with self.autocast():
+                    if self.loss_in_model:
+                        pred, _ = self.model(ts_agg, target)
+                    else:
+                        pred = self.model(ts_agg)
+                pred = pred.float()
 
+                # Loss weighted by batch size: same value whatever the eval batch size
                 loss = self.valid_criterion(pred, target)
-                loss_valid += loss.item()
+                loss_valid += loss.detach().double() * len(target)
+                n_samples += len(target)
 
                 # ===================Evaluate using provided metrics===================== #
                 if self.consumption_pred:
@@ -280,58 +514,24 @@ class SeqToSeqTrainer:
                     target_win = target.sum(dim=-1)
                     pred_win = pred.sum(dim=-1)
 
-                    y = (
-                        np.concatenate(
-                            (y, torch.flatten(target).detach().cpu().numpy())
-                        )
-                        if y.size
-                        else torch.flatten(target).detach().cpu().numpy()
-                    )
-                    y_hat = (
-                        np.concatenate(
-                            (y_hat, torch.flatten(pred).detach().cpu().numpy())
-                        )
-                        if y_hat.size
-                        else torch.flatten(pred).detach().cpu().numpy()
-                    )
-                    y_win = (
-                        np.concatenate(
-                            (y_win, torch.flatten(target_win).detach().cpu().numpy())
-                        )
-                        if y_win.size
-                        else torch.flatten(target_win).detach().cpu().numpy()
-                    )
-                    y_hat_win = (
-                        np.concatenate(
-                            (y_hat_win, torch.flatten(pred_win).detach().cpu().numpy())
-                        )
-                        if y_hat_win.size
-                        else torch.flatten(pred_win).detach().cpu().numpy()
-                    )
-                    y_state = (
-                        np.concatenate((y_state, state.flatten()))
-                        if y_state.size
-                        else state.flatten()
-                    )
+                    y.append(torch.flatten(target).detach().cpu().numpy())
+                    y_hat.append(torch.flatten(pred).detach().cpu().numpy())
+                    y_win.append(torch.flatten(target_win).detach().cpu().numpy())
+                    y_hat_win.append(torch.flatten(pred_win).detach().cpu().numpy())
+                    y_state.append(state.flatten().numpy())
 
                 else:
                     if apply_sigmoid:
                         pred = nn.Sigmoid()(pred)
 
-                    y_state = (
-                        np.concatenate((y_state, state.flatten()))
-                        if y_state.size
-                        else state.flatten()
-                    )
-                    y_hat_state = (
-                        np.concatenate(
-                            (y_hat_state, torch.flatten(pred).detach().cpu().numpy())
-                        )
-                        if y_hat_state.size
-                        else torch.flatten(pred).detach().cpu().numpy()
-                    )
+                    y_state.append(state.flatten().numpy())
+                    y_hat_state.append(torch.flatten(pred).detach().cpu().numpy())
 
-        loss_valid = loss_valid / len(self.valid_loader)
+        loss_valid = float(loss_valid) / max(n_samples, 1)
+
+        y, y_hat, y_win, y_hat_win, y_state, y_hat_state = _concat_outputs(
+            y, y_hat, y_win, y_hat_win, y_state, y_hat_state
+        )
 
         if self.consumption_pred:
             metrics_timestamp = self.f_metrics(
@@ -372,11 +572,116 @@ class SeqToSeqTrainer:
 
         return np.mean(loss_valid)
 
+    def _input_to_device(self, ts_agg):
+        """
+        Private function : send model input to device, either a tensor or a tuple
+        (load curve, int64 start timestamps) for in-model timestamp encoding
+        """
+        if isinstance(ts_agg, (tuple, list)):
+            return (
+                ts_agg[0].float().to(self.device, non_blocking=True),
+                ts_agg[1].to(self.device, non_blocking=True),
+            )
+
+        return ts_agg.float().to(self.device, non_blocking=True)
+
+    def autocast(self):
+        """
+        Public function : autocast context of model forward passes (see precision)
+        """
+        return autocast_context(self.device, self.precision)
+
     def save(self):
         """
-        Public function : save log
+        Public function : save log (rank 0 only in distributed training)
+        """
+        if is_main_process():
+            torch.save(self.log, self.path_checkpoint + ".pt")
+        return
+
+    def save_resume_checkpoint(self):
+        """
+        Public function : save full trainer state (model, optimizer, lr scheduler, early stopping, grad scaler,
+        histories, epoch and RNG states of all processes) at path_checkpoint + '_resume.pt' (rank 0 only)
+        """
+        state = {
+            "model_state_dict": unwrap_model(self.model).state_dict(),
+            "optimizer_state_dict": self.optimizer.state_dict(),
+            "scheduler_state_dict": self.scheduler.state_dict()
+            if hasattr(self, "scheduler")
+            else None,
+            "early_stopping_state_dict": self.early_stopping.state_dict()
+            if hasattr(self, "early_stopping")
+            else None,
+            "grad_scaler_state_dict": self.grad_scaler.state_dict(),
+            "passed_epochs": self.passed_epochs,
+            "early_stopped": self.early_stopped,
+            "best_loss": self.best_loss,
+            "train_time": self.train_time,
+            "loss_train_history": self.loss_train_history,
+            "loss_valid_history": self.loss_valid_history,
+            "log": self.log,
+            "rng_state": all_gather_object(get_rng_state(self.train_loader)),
+        }
+        if is_main_process():
+            save_atomic(state, self.path_checkpoint + "_resume.pt")
+        return
+
+    def load_resume_checkpoint(self):
+        """
+        Public function : restore trainer state saved by save_resume_checkpoint (if any),
+        train then continuing from the next epoch as if never stopped.
+
+        Return : True if trainer state restored, else False
+        """
+        path = self.path_checkpoint + "_resume.pt"
+        if not os.path.isfile(path):
+            return False
+
+        state = torch.load(path, map_location="cpu", weights_only=False)
+
+        unwrap_model(self.model).load_state_dict(state["model_state_dict"])
+        self.optimizer.load_state_dict(state["optimizer_state_dict"])
+        if state["scheduler_state_dict"] is not None:
+            self.scheduler.load_state_dict(state["scheduler_state_dict"])
+        if state["early_stopping_state_dict"] is not None:
+            self.early_stopping.load_state_dict(state["early_stopping_state_dict"])
+        self.grad_scaler.load_state_dict(state["grad_scaler_state_dict"])
+
+        self.passed_epochs = state["passed_epochs"]
+        self.start_epoch = state["passed_epochs"]
+        self.early_stopped = state["early_stopped"]
+        self.best_loss = state["best_loss"]
+        self.train_time = state["train_time"]
+        self.loss_train_history = state["loss_train_history"]
+        self.loss_valid_history = state["loss_valid_history"]
+        self.log = state["log"]
+
+        # Persistent workers draw their seed when started: started before restoring RNG states,
+        # as they were at first epoch before the checkpoint
+        for loader in (self.train_loader, self.valid_loader):
+            if getattr(loader, "persistent_workers", False):
+                iter(loader)
+
+        # RNG states of this process (of rank 0 if the number of processes changed)
+        rng_state = state["rng_state"]
+        set_rng_state(
+            rng_state[get_rank()] if len(rng_state) == get_world_size() else rng_state[0],
+            self.train_loader,
+        )
+
+        logging.info(
+            "Training resumed from {} (after {} epochs).".format(path, self.passed_epochs)
+        )
+        return True
+
+    def remove_resume_checkpoint(self):
+        """
+        Public function : remove resume checkpoint, e.g. once the experiment is completed (rank 0 only)
         """
-        torch.save(self.log, self.path_checkpoint + ".pt")
+        path = self.path_checkpoint + "_resume.pt"
+        if is_main_process() and os.path.isfile(path):
+            os.remove(path)
         return
 
     def plot_history(self):
@@ -412,10 +717,7 @@ class SeqToSeqTrainer:
         Public function : load best model state dict parameters met during training.
         """
         try:
-            if self.all_gpu:
-                self.model.module.load_state_dict(self.log["best_model_state_dict"])
-            else:
-                self.model.load_state_dict(self.log["best_model_state_dict"])
+            unwrap_model(self.model).load_state_dict(self.log["best_model_state_dict"])
             logging.info("Restored best model met during training.")
         except KeyError:
             logging.info("Error during loading log checkpoint state dict : no update.")
@@ -426,36 +728,46 @@ class SeqToSeqTrainer:
         Private function : model training loop over data loader
         """
         loss_train = 0
+        step = 0
 
-        for ts_agg, appl, states in self.train_loader:
-            self.model.train()
-
-            # ===================variables=================== #
-            ts_agg = torch.Tensor(ts_agg.float()).to(self.device)
-            if self.consumption_pred:
-                target = torch.Tensor(appl.float()).to(self.device)
-            else:
-                target = torch.Tensor(states.float()).to(self.device)
-
-            # ===================forward===================== #
-            self.optimizer.zero_grad()
+        with join_context(self.model):
+            for step, (ts_agg, appl, states) in enumerate(self.train_loader, 1):
+                self.model.train()
 
-            if self.loss_in_model:
-                pred, loss = self.model(ts_agg, target)
-            else:
+                # ===================variables=================== #
+                ts_agg = self._input_to_device(ts_agg)
                 if self.consumption_pred:
-                    pred = self.model(ts_agg)
+                    target = appl.float().to(self.device, non_blocking=True)
                 else:
-                    pred = nn.Sigmoid()(self.model(ts_agg))
+                    target = states.float().to(self.device, non_blocking=True)
 
-                loss = self.train_criterion(pred, target)
+                # ===================forward===================== #
+                self.optimizer.zero_grad()
 
-            # ===================backward==================== #
-            loss_train += loss.item()
-            loss.backward()
-            self.optimizer.step()
+                with self.autocast():
+                    if self.loss_in_model:
+                        pred, loss = self.model(ts_agg, target)
+                    else:
+                        pred = self.model(ts_agg)
 
-        loss_train = loss_train / len(self.train_loader)
+                if not self.loss_in_model:
+                    pred = pred.float()
+                    if not self.consumption_pred:
+                        pred = nn.Sigmoid()(pred)
+
+                    loss = self.train_criterion(pred, target)
+
+                # ===================backward==================== #
+                # Detached loss accumulated on device: no sync per step
+                loss_train += loss.detach().double()
+                self.grad_scaler.scale(loss).backward()
+                self.grad_scaler.step(self.optimizer)
+                self.grad_scaler.update()
+                log_step_loss(step, loss_train, self.log_interval)
+
+        # Mean loss over the batches of all processes
+        loss_train, n_steps = all_reduce_sum(loss_train, step)
+        loss_train = loss_train / n_steps
 
         return loss_train
 
@@ -464,6 +776,7 @@ class SeqToSeqTrainer:
         Private function : model evaluation loop over data loader
         """
         loss_valid = 0
+        n_samples = 0
 
         with torch.no_grad():
             for ts_agg, appl, states in self.valid_loader:
@@ -471,22 +784,28 @@ class SeqToSeqTrainer:
 
                 # ===================variables=================== #
 
-                ts_agg = torch.Tensor(ts_agg.float()).to(self.device)
+                ts_agg = self._input_to_device(ts_agg)
                 if self.consumption_pred:
-                    target = torch.Tensor(appl.float()).to(self.device)
+                    target = appl.float().to(self.device, non_blocking=True)
                 else:
-                    target = torch.Tensor(states.float()).to(self.device)
+                    target = states.float().to(self.device, non_blocking=True)
 
                 # ===================forward=================== #
-                if self.loss_in_model:
-                    pred, loss = self.model(ts_agg, target)
-                else:
-                    pred = self.model(ts_agg)
-                    loss = self.valid_criterion(pred, target)
+                with self.autocast():
+                    if self.loss_in_model:
+                        pred, loss = self.model(ts_agg, target)
+                    else:
+                        pred = self.model(ts_agg)
 
-                loss_valid += loss.item()
+                if not self.loss_in_model:
+                    loss = self.valid_criterion(pred.float(), target)
 
-        loss_valid = loss_valid / len(self.valid_loader)
+                loss_valid += loss.detach().double() * len(target)
+                n_samples += len(target)
+
+        # Mean loss over the samples of all processes
+        loss_valid, n_samples = all_reduce_sum(loss_valid, n_samples)
+        loss_valid = loss_valid / max(n_samples, 1)
 
         return loss_valid
 
@@ -515,9 +834,23 @@ class TserTrainer:
         path_fig=None,
         save_checkpoint=False,
         path_checkpoint=None,
+        precision="fp32",
+        log_interval=None,
+        distributed=False,
+        resume_every=None,
     ):
         """
         PyTorch Model Trainer Class for Time Series Extrinsic Regression for NILM
+
+        precision: 'fp32', 'bf16' or 'fp16' (with grad scaling) autocast of forward passes
+
+        Losses are accumulated on device (read once per epoch), log_interval: log train loss every log_interval steps
+
+        distributed: DistributedDataParallel training (process group initialized, e.g. launched with torchrun),
+        losses being reduced across processes and checkpoints saved by rank 0 only
+
+        resume_every: save the full trainer state every resume_every epochs (see save_resume_checkpoint),
+        training being resumed where it stopped with load_resume_checkpoint
         """
 
         # =======================class variables======================= #
@@ -529,6 +862,8 @@ class TserTrainer:
         self.valid_loader = valid_loader
         self.device = device
         self.all_gpu = all_gpu
+        self.distributed = distributed
+        self.resume_every = resume_every
         self.verbose = verbose
         self.plotloss = plotloss
         self.save_checkpoint = save_checkpoint
@@ -544,6 +879,19 @@ class TserTrainer:
 
         if self.training_in_model:
             assert hasattr(self.model, "train_one_epoch")
+            if self.distributed:
+                raise ValueError(
+                    "Distributed training not available for models trained by their own train_one_epoch."
+                )
+
+        check_precision(precision)
+        self.precision = precision
+        self.log_interval = log_interval
+        self.grad_scaler = get_grad_scaler(self.device, self.precision)
+        if self.training_in_model and self.precision == "fp16":
+            logging.warning(
+                "No grad scaling in model train_one_epoch: model trained in fp32 (fp16 only used for evaluation)."
+            )
 
         self.train_criterion = criterion
         if valid_criterion is None:
@@ -568,6 +916,8 @@ class TserTrainer:
         self.train_time = 0
         self.eval_time = 0
         self.passed_epochs = 0
+        self.start_epoch = 0
+        self.early_stopped = False
         self.best_loss = np.inf
         self.loss_train_history = []
         self.loss_valid_history = []
@@ -577,12 +927,15 @@ class TserTrainer:
         if self.patience_es is not None:
             self.early_stopping = EarlyStopper(patience=self.patience_es)
 
-        if self.all_gpu:
+        if self.all_gpu or self.distributed:
             # =========== Dummy forward to intialize Lazy Module =========== #
-            self.model.to("cpu")
             for ts, _ in train_loader:
-                self.model(torch.rand(ts.shape))
+                init_lazy_modules(self.model, ts)
                 break
+        if self.distributed:
+            # =========== Distributed Data Parallel Module call =========== #
+            self.model = distributed_model(self.model, self.device)
+        elif self.all_gpu:
             # =========== Data Parrallel Module call =========== #
             self.model = nn.DataParallel(self.model)
         self.model.to(self.device)
@@ -592,24 +945,32 @@ class TserTrainer:
         Public function : master training loop over epochs
         """
 
-        tmp_time = time.time()
+        # Resumed training: time of previous epochs included
+        tmp_time = time.time() - self.train_time
+
+        for epoch in range(self.start_epoch, n_epochs):
+            if self.early_stopped:
+                break
+            set_loader_epoch(self.train_loader, epoch)
 
-        for epoch in range(n_epochs):
             # =======================one epoch======================= #
             if self.training_in_model:
                 self.model.train()
-                if self.all_gpu:
-                    train_loss = self.model.module.train_one_epoch(
-                        loader=self.train_loader,
-                        optimizer=self.optimizer,
-                        device=self.device,
-                    )
-                else:
-                    train_loss = self.model.train_one_epoch(
-                        loader=self.train_loader,
-                        optimizer=self.optimizer,
-                        device=self.device,
-                    )
+                with autocast_context(
+                    self.device, "fp32" if self.precision == "fp16" else self.precision
+                ):
+                    if self.all_gpu:
+                        train_loss = self.model.module.train_one_epoch(
+                            loader=self.train_loader,
+                            optimizer=self.optimizer,
+                            device=self.device,
+                        )
+                    else:
+                        train_loss = self.model.train_one_epoch(
+                            loader=self.train_loader,
+                            optimizer=self.optimizer,
+                            device=self.device,
+                        )
             else:
                 train_loss = self.__train()
             self.loss_train_history.append(train_loss)
@@ -630,6 +991,7 @@ class TserTrainer:
                 ):  # Avoid n_warmup_epochs first epochs
                     if self.early_stopping.early_stop(valid_loss):
                         self.passed_epochs += 1
+                        self.early_stopped = True
                         if self.verbose:
                             logging.info(
                                 "Early stopping after {} epochs !".format(epoch + 1)
@@ -651,9 +1013,7 @@ class TserTrainer:
             ):
                 self.best_loss = valid_loss
                 self.log = {
-                    "model_state_dict": self.model.module.state_dict()
-                    if self.device == "cuda" and self.all_gpu
-                    else self.model.state_dict(),
+                    "model_state_dict": unwrap_model(self.model).state_dict(),
                     "optimizer_state_dict": self.optimizer.state_dict(),
                     "loss_train_history": self.loss_train_history,
                     "loss_valid_history": self.loss_valid_history,
@@ -666,12 +1026,20 @@ class TserTrainer:
 
             self.passed_epochs += 1
 
+            # =======================resume checkpoint======================= #
+            if self.resume_every and self.passed_epochs % self.resume_every == 0:
+                self.train_time = round((time.time() - tmp_time), 3)
+                self.save_resume_checkpoint()
+
         self.train_time = round((time.time() - tmp_time), 3)
 
+        if self.resume_every:
+            self.save_resume_checkpoint()
+
         if self.plotloss:
             self.plot_history()
 
-        if self.save_checkpoint:
+        if self.save_checkpoint and is_main_process():
             self.log["best_model_state_dict"] = torch.load(
                 self.path_checkpoint + ".pt"
             )["model_state_dict"]
@@ -698,9 +1066,10 @@ class TserTrainer:
         Public function : model evaluation on test dataset
         """
         loss_valid = 0
+        n_samples = 0
 
-        y = np.array([])
-        y_hat = np.array([])
+        y = []
+        y_hat = []
 
         start_time = time.time()
         with torch.no_grad():
@@ -708,20 +1077,24 @@ class TserTrainer:
                 self.model.eval()
 
                 # ===================variables=================== #
-                ts_agg = torch.Tensor(ts_agg.float()).to(self.device)
-                target = torch.Tensor(target.float()).to(self.device)
+                ts_agg = ts_agg.float().to(self.device, non_blocking=True)
+                target = target.float().to(self.device, non_blocking=True)
 
                 if len(target.shape) == 1:
                     target = target.unsqueeze(1)
 
                 # ===================forward and loss===================== #
-                if self.loss_in_model:
-                    pred, _ = self.model(ts_agg, target)
-                else:
-                    pred = self.model(ts_agg)
+                with self.autocast():
+                    if self.loss_in_model:
+                        pred, _ = self.model(ts_agg, target)
+                    else:
+                        pred = self.model(ts_agg)
+                pred = pred.float()
 
+                # Loss weighted by batch size: same value whatever the eval batch size
                 loss = self.valid_criterion(pred, target)
-                loss_valid += loss.item()
+                loss_valid += loss.detach().double() * len(target)
+                n_samples += len(target)
 
                 # ===================Evaluate using provided metrics===================== #
                 if scaler is not None:
@@ -733,18 +1106,12 @@ class TserTrainer:
 
                 pred[pred < threshold_small_values] = 0
 
-                y = (
-                    np.concatenate((y, torch.flatten(target).detach().cpu().numpy()))
-                    if y.size
-                    else torch.flatten(target).detach().cpu().numpy()
-                )
-                y_hat = (
-                    np.concatenate((y_hat, torch.flatten(pred).detach().cpu().numpy()))
-                    if y_hat.size
-                    else torch.flatten(pred).detach().cpu().numpy()
-                )
+                y.append(torch.flatten(target).detach().cpu().numpy())
+                y_hat.append(torch.flatten(pred).detach().cpu().numpy())
+
+        loss_valid = float(loss_valid) / max(n_samples, 1)
 
-        loss_valid = loss_valid / len(self.valid_loader)
+        y, y_hat = _concat_outputs(y, y_hat)
 
         metrics_win = self.f_metrics(y, y_hat)
         self.log[mask + "_win"] = metrics_win
@@ -761,11 +1128,103 @@ class TserTrainer:
 
         return np.mean(loss_valid)
 
+    def autocast(self):
+        """
+        Public function : autocast context of model forward passes (see precision)
+        """
+        return autocast_context(self.device, self.precision)
+
     def save(self):
         """
-        Public function : save log
+        Public function : save log (rank 0 only in distributed training)
         """
-        torch.save(self.log, self.path_checkpoint + ".pt")
+        if is_main_process():
+            torch.save(self.log, self.path_checkpoint + ".pt")
+        return
+
+    def save_resume_checkpoint(self):
+        """
+        Public function : save full trainer state (model, optimizer, lr scheduler, early stopping, grad scaler,
+        histories, epoch and RNG states of all processes) at path_checkpoint + '_resume.pt' (rank 0 only)
+        """
+        state = {
+            "model_state_dict": unwrap_model(self.model).state_dict(),
+            "optimizer_state_dict": self.optimizer.state_dict(),
+            "scheduler_state_dict": self.scheduler.state_dict()
+            if hasattr(self, "scheduler")
+            else None,
+            "early_stopping_state_dict": self.early_stopping.state_dict()
+            if hasattr(self, "early_stopping")
+            else None,
+            "grad_scaler_state_dict": self.grad_scaler.state_dict(),
+            "passed_epochs": self.passed_epochs,
+            "early_stopped": self.early_stopped,
+            "best_loss": self.best_loss,
+            "train_time": self.train_time,
+            "loss_train_history": self.loss_train_history,
+            "loss_valid_history": self.loss_valid_history,
+            "log": self.log,
+            "rng_state": all_gather_object(get_rng_state(self.train_loader)),
+        }
+        if is_main_process():
+            save_atomic(state, self.path_checkpoint + "_resume.pt")
+        return
+
+    def load_resume_checkpoint(self):
+        """
+        Public function : restore trainer state saved by save_resume_checkpoint (if any),
+        train then continuing from the next epoch as if never stopped.
+
+        Return : True if trainer state restored, else False
+        """
+        path = self.path_checkpoint + "_resume.pt"
+        if not os.path.isfile(path):
+            return False
+
+        state = torch.load(path, map_location="cpu", weights_only=False)
+
+        unwrap_model(self.model).load_state_dict(state["model_state_dict"])
+        self.optimizer.load_state_dict(state["optimizer_state_dict"])
+        if state["scheduler_state_dict"] is not None:
+            self.scheduler.load_state_dict(state["scheduler_state_dict"])
+        if state["early_stopping_state_dict"] is not None:
+            self.early_stopping.load_state_dict(state["early_stopping_state_dict"])
+        self.grad_scaler.load_state_dict(state["grad_scaler_state_dict"])
+
+        self.passed_epochs = state["passed_epochs"]
+        self.start_epoch = state["passed_epochs"]
+        self.early_stopped = state["early_stopped"]
+        self.best_loss = state["best_loss"]
+        self.train_time = state["train_time"]
+        self.loss_train_history = state["loss_train_history"]
+        self.loss_valid_history = state["loss_valid_history"]
+        self.log = state["log"]
+
+        # Persistent workers draw their seed when started: started before restoring RNG states,
+        # as they were at first epoch before the checkpoint
+        for loader in (self.train_loader, self.valid_loader):
+            if getattr(loader, "persistent_workers", False):
+                iter(loader)
+
+        # RNG states of this process (of rank 0 if the number of processes changed)
+        rng_state = state["rng_state"]
+        set_rng_state(
+            rng_state[get_rank()] if len(rng_state) == get_world_size() else rng_state[0],
+            self.train_loader,
+        )
+
+        logging.info(
+            "Training resumed from {} (after {} epochs).".format(path, self.passed_epochs)
+        )
+        return True
+
+    def remove_resume_checkpoint(self):
+        """
+        Public function : remove resume checkpoint, e.g. once the experiment is completed (rank 0 only)
+        """
+        path = self.path_checkpoint + "_resume.pt"
+        if is_main_process() and os.path.isfile(path):
+            os.remove(path)
         return
 
     def plot_history(self):
@@ -801,10 +1260,7 @@ class TserTrainer:
         Public function : load best model state dict parameters met during training.
         """
         try:
-            if self.all_gpu:
-                self.model.module.load_state_dict(self.log["best_model_state_dict"])
-            else:
-                self.model.load_state_dict(self.log["best_model_state_dict"])
+            unwrap_model(self.model).load_state_dict(self.log["best_model_state_dict"])
             logging.info("Restored best model met during training.")
         except KeyError:
             logging.info("Error during loading log checkpoint state dict : no update.")
@@ -815,33 +1271,42 @@ class TserTrainer:
         Private function : model training loop over data loader
         """
         loss_train = 0
+        step = 0
 
-        for ts_agg, target in self.train_loader:
-            self.model.train()
+        with join_context(self.model):
+            for step, (ts_agg, target) in enumerate(self.train_loader, 1):
+                self.model.train()
 
-            # ===================variables=================== #
-            ts_agg = torch.Tensor(ts_agg.float()).to(self.device)
-            target = torch.Tensor(target.float()).to(self.device)
+                # ===================variables=================== #
+                ts_agg = ts_agg.float().to(self.device, non_blocking=True)
+                target = target.float().to(self.device, non_blocking=True)
 
-            if len(target.shape) == 1:
-                target = target.unsqueeze(1)
+                if len(target.shape) == 1:
+                    target = target.unsqueeze(1)
 
-            # ===================forward===================== #
-            self.optimizer.zero_grad()
+                # ===================forward===================== #
+                self.optimizer.zero_grad()
 
-            if self.loss_in_model:
-                pred, loss = self.model(ts_agg, target)
-            else:
-                pred = self.model(ts_agg)
+                with self.autocast():
+                    if self.loss_in_model:
+                        pred, loss = self.model(ts_agg, target)
+                    else:
+                        pred = self.model(ts_agg)
 
-                loss = self.train_criterion(pred, target)
+                if not self.loss_in_model:
+                    loss = self.train_criterion(pred.float(), target)
 
-            # ===================backward==================== #
-            loss_train += loss.item()
-            loss.backward()
-            self.optimizer.step()
+                # ===================backward==================== #
+                # Detached loss accumulated on device: no sync per step
+                loss_train += loss.detach().double()
+                self.grad_scaler.scale(loss).backward()
+                self.grad_scaler.step(self.optimizer)
+                self.grad_scaler.update()
+                log_step_loss(step, loss_train, self.log_interval)
 
-        loss_train = loss_train / len(self.train_loader)
+        # Mean loss over the batches of all processes
+        loss_train, n_steps = all_reduce_sum(loss_train, step)
+        loss_train = loss_train / n_steps
 
         return loss_train
 
@@ -850,28 +1315,35 @@ class TserTrainer:
         Private function : model evaluation loop over data loader
         """
         loss_valid = 0
+        n_samples = 0
 
         with torch.no_grad():
             for ts_agg, target in self.valid_loader:
                 self.model.eval()
 
                 # ===================variables=================== #
-                ts_agg = torch.Tensor(ts_agg.float(), device=self.device)
-                target = torch.Tensor(target.float(), device=self.device)
+                ts_agg = ts_agg.float().to(self.device, non_blocking=True)
+                target = target.float().to(self.device, non_blocking=True)
 
                 if len(target.shape) == 1:
                     target = target.unsqueeze(1)
 
                 # ===================forward=================== #
-                if self.loss_in_model:
-                    pred, loss = self.model(ts_agg, target)
-                else:
-                    pred = self.model(ts_agg)
-                    loss = self.valid_criterion(pred, target)
+                with self.autocast():
+                    if self.loss_in_model:
+                        pred, loss = self.model(ts_agg, target)
+                    else:
+                        pred = self.model(ts_agg)
 
-                loss_valid += loss.item()
+                if not self.loss_in_model:
+                    loss = self.valid_criterion(pred.float(), target)
 
-        loss_valid = loss_valid / len(self.valid_loader)
+                loss_valid += loss.detach().double() * len(target)
+                n_samples += len(target)
+
+        # Mean loss over the samples of all processes
+        loss_valid, n_samples = all_reduce_sum(loss_valid, n_samples)
+        loss_valid = loss_valid / max(n_samples, 1)
 
         return loss_valid
 
@@ -899,10 +1371,14 @@ class BasedSelfPretrainer(object):
         save_only_core=False,
         save_checkpoint=False,
         path_checkpoint=None,
+        precision="fp32",
+        log_interval=None,
+        distributed=False,
     ):
         # =======================class variables======================= #
         self.device = device
         self.all_gpu = all_gpu
+        self.distributed = distributed
         self.model = model
         self.criterion = criterion
         self.optimizer = optim.AdamW(
@@ -921,6 +1397,11 @@ class BasedSelfPretrainer(object):
         self.loss_in_model = loss_in_model
         self.name_scheduler = name_scheduler
 
+        check_precision(precision)
+        self.precision = precision
+        self.log_interval = log_interval
+        self.grad_scaler = get_grad_scaler(self.device, self.precision)
+
         if name_scheduler is None:
             self.scheduler = None
         else:
@@ -973,12 +1454,15 @@ class BasedSelfPretrainer(object):
         # else:
         #    self.scheduler = scheduler
 
-        if self.all_gpu:
+        if self.all_gpu or self.distributed:
             # ===========dummy forward to intialize Lazy Module=========== #
-            self.model.to("cpu")
             for ts in train_loader:
-                self.model(torch.rand(ts.shape))
+                init_lazy_modules(self.model, ts)
                 break
+        if self.distributed:
+            # ===========distributed Data Parallel Module call=========== #
+            self.model = distributed_model(self.model, self.device)
+        elif self.all_gpu:
             # ===========data Parrallel Module call=========== #
             self.model = nn.DataParallel(self.model)
         self.model.to(self.device)
@@ -1000,6 +1484,8 @@ class BasedSelfPretrainer(object):
         """
         t = time.time()
         for epoch in range(n_epochs):
+            set_loader_epoch(self.train_loader, epoch)
+
             # =======================one epoch===================== #
             train_loss = self.__train(epoch)
             self.loss_train_history.append(train_loss)
@@ -1019,9 +1505,7 @@ class BasedSelfPretrainer(object):
                 # =========================log========================= #
                 if self.save_only_core:
                     self.log = {
-                        "model_state_dict": self.model.module.core.state_dict()
-                        if self.device == "cuda" and self.all_gpu
-                        else self.model.core.state_dict(),
+                        "model_state_dict": unwrap_model(self.model).core.state_dict(),
                         "optimizer_state_dict": self.optimizer.state_dict(),
                         "loss_train_history": self.loss_train_history,
                         "loss_valid_history": self.loss_valid_history,
@@ -1029,9 +1513,7 @@ class BasedSelfPretrainer(object):
                     }
                 else:
                     self.log = {
-                        "model_state_dict": self.model.module.state_dict()
-                        if self.device == "cuda" and self.all_gpu
-                        else self.model.state_dict(),
+                        "model_state_dict": unwrap_model(self.model).state_dict(),
                         "optimizer_state_dict": self.optimizer.state_dict(),
                         "loss_train_history": self.loss_train_history,
                         "loss_valid_history": self.loss_valid_history,
@@ -1057,11 +1539,18 @@ class BasedSelfPretrainer(object):
 
         return
 
+    def autocast(self):
+        """
+        Public function : autocast context of model forward passes (see precision)
+        """
+        return autocast_context(self.device, self.precision)
+
     def save(self):
         """
-        Public function : save log
+        Public function : save log (rank 0 only in distributed training)
         """
-        torch.save(self.log, self.path_checkpoint + ".pt")
+        if is_main_process():
+            torch.save(self.log, self.path_checkpoint + ".pt")
         return
 
     def plot_history(self):
@@ -1094,36 +1583,47 @@ class BasedSelfPretrainer(object):
         """
         loss_train = 0
         iters = len(self.train_loader)
+        step = 0
 
-        for i, ts in enumerate(self.train_loader):
-            self.model.train()
-            # ===================variables=================== #
-            ts = torch.Tensor(ts.float()).to(self.device)
-            if self.mask is not None:
-                mask_loss, ts_masked = self.mask(ts)
-            # ===================forward===================== #
-            self.optimizer.zero_grad()
-            if self.mask is not None:
-                outputs = self.model(ts_masked.to(self.device))
-                loss = self.criterion(
-                    outputs, ts.to(self.device), mask_loss.to(self.device)
-                )
-            else:
-                if self.loss_in_model:
-                    outputs, loss = self.model(ts.to(self.device))
-                    loss = loss.mean()
-                else:
-                    outputs = self.model(ts.to(self.device))
-                    loss = self.criterion(outputs, ts.to(self.device))
-            # ===================backward==================== #
-            loss.backward()
-            self.optimizer.step()
-            loss_train += loss.item()
-
-            if self.name_scheduler == "CosineAnnealingWarmRestarts":
-                self.scheduler.step(epoch + i / iters)
+        with join_context(self.model):
+            for step, ts in enumerate(self.train_loader, 1):
+                self.model.train()
+                # ===================variables=================== #
+                ts = ts.float().to(self.device, non_blocking=True)
+                if self.mask is not None:
+                    mask_loss, ts_masked = self.mask(ts)
+                # ===================forward===================== #
+                self.optimizer.zero_grad()
+                with self.autocast():
+                    if self.mask is not None:
+                        outputs = self.model(ts_masked.to(self.device))
+                    elif self.loss_in_model:
+                        outputs, loss = self.model(ts.to(self.device))
+                    else:
+                        outputs = self.model(ts.to(self.device))
 
-        loss_train = loss_train / len(self.train_loader)
+                if self.mask is not None:
+                    loss = self.criterion(
+                        outputs.float(), ts.to(self.device), mask_loss.to(self.device)
+                    )
+                elif self.loss_in_model:
+                    loss = loss.float().mean()
+                else:
+                    loss = self.criterion(outputs.float(), ts.to(self.device))
+                # ===================backward==================== #
+                self.grad_scaler.scale(loss).backward()
+                self.grad_scaler.step(self.optimizer)
+                self.grad_scaler.update()
+                # Detached loss accumulated on device: no sync per step
+                loss_train += loss.detach().double()
+                log_step_loss(step, loss_train, self.log_interval)
+
+                if self.name_scheduler == "CosineAnnealingWarmRestarts":
+                    self.scheduler.step(epoch + (step - 1) / iters)
+
+        # Mean loss over the batches of all processes
+        loss_train, n_steps = all_reduce_sum(loss_train, step)
+        loss_train = loss_train / n_steps
         return loss_train
 
     def __evaluate(self):
@@ -1135,25 +1635,31 @@ class BasedSelfPretrainer(object):
             for ts in self.valid_loader:
                 self.model.eval()
                 # ===================variables=================== #
-                ts = torch.Tensor(ts.float()).to(self.device)
+                ts = ts.float().to(self.device, non_blocking=True)
                 if self.mask is not None:
                     mask_loss, ts_masked = self.mask(ts)
                 # ===================forward===================== #
+                with self.autocast():
+                    if self.mask is not None:
+                        outputs = self.model(ts_masked.to(self.device))
+                    elif self.loss_in_model:
+                        outputs, loss = self.model(ts.to(self.device))
+                    else:
+                        outputs = self.model(ts.to(self.device))
+
                 if self.mask is not None:
-                    outputs = self.model(ts_masked.to(self.device))
                     loss = self.criterion(
-                        outputs, ts.to(self.device), mask_loss.to(self.device)
+                        outputs.float(), ts.to(self.device), mask_loss.to(self.device)
                     )
+                elif self.loss_in_model:
+                    loss = loss.float().mean()
                 else:
-                    if self.loss_in_model:
-                        outputs, loss = self.model(ts.to(self.device))
-                        loss = loss.mean()
-                    else:
-                        outputs = self.model(ts.to(self.device))
-                        loss = self.criterion(outputs, ts.to(self.device))
-                loss_valid += loss.item()
+                    loss = self.criterion(outputs.float(), ts.to(self.device))
+                loss_valid += loss.detach().double()
 
-        loss_valid = loss_valid / len(self.valid_loader)
+        # Mean loss over the batches of all processes
+        loss_valid, n_steps = all_reduce_sum(loss_valid, len(self.valid_loader))
+        loss_valid = loss_valid / n_steps
         return loss_valid
 
 
@@ -1164,6 +1670,16 @@ class EarlyStopper:
         self.counter = 0
         self.min_validation_loss = np.inf
 
+    def state_dict(self):
+        return {
+            "counter": self.counter,
+            "min_validation_loss": self.min_validation_loss,
+        }
+
+    def load_state_dict(self, state_dict):
+        self.counter = state_dict["counter"]
+        self.min_validation_loss = state_dict["min_validation_loss"]
+
     def early_stop(self, validation_loss):
         if validation_loss < self.min_validation_loss:
             self.min_validation_loss = validation_loss
@@ -28,3 +28,8 @@ class NILMFormerConfig:
     pffn_ratio: int = 4
     n_head: int = 8
     norm_eps: float = 1e-5
+
+    # In-model calendar encoding from int64 start timestamps (input given as (load curve, timestamps))
+    timestamp_encoding: bool = False
+    list_exo_variables: List[str] = field(default_factory=lambda: ["minute", "hour", "dow", "month"])
+    freq: str = "1min"
@@ -0,0 +1,103 @@
+#################################################################################################################
+#
+# @copyright : ©2025 EDF
+# @author : Adrien Petralia
+# @description : NILMFormer - Timestamp Encoding Layer
+#
+#################################################################################################################
+
+import math
+from typing import List
+
+import pandas as pd
+import torch
+import torch.nn as nn
+
+from pandas.tseries.frequencies import to_offset
+
+NS_MINUTE = 60 * 10**9
+NS_HOUR = 60 * NS_MINUTE
+NS_DAY = 24 * NS_HOUR
+
+
+def civil_from_days(days: torch.Tensor):
+    """
+    Month (1-12) and day of month (1-31) of days since 1970-01-01 (proleptic Gregorian calendar, integer ops only).
+    """
+    z = days + 719468
+    era = torch.div(z, 146097, rounding_mode="floor")
+    doe = z - era * 146097
+    yoe = torch.div(
+        doe
+        - torch.div(doe, 1460, rounding_mode="floor")
+        + torch.div(doe, 36524, rounding_mode="floor")
+        - torch.div(doe, 146096, rounding_mode="floor"),
+        365,
+        rounding_mode="floor",
+    )
+    doy = doe - (
+        365 * yoe
+        + torch.div(yoe, 4, rounding_mode="floor")
+        - torch.div(yoe, 100, rounding_mode="floor")
+    )
+    mp = torch.div(5 * doy + 2, 153, rounding_mode="floor")
+    day = doy - torch.div(153 * mp + 2, 5, rounding_mode="floor") + 1
+    month = torch.where(mp < 10, mp + 3, mp - 9)
+
+    return month, day
+
+
+class TimestampEncoding(nn.Module):
+    """
+    Calendar sin/cos encoding of each timestep of a batch of windows, computed on device from
+    int64 start timestamps (ns since epoch, wall clock) and the sampling frequency.
+
+    Output matches the exogene channels of NILMDataset (cosinbase=True): [B, 2 * N_exo_variables, L]
+    """
+
+    # Calendar fields periods
+    PERIODS = {"month": 12.0, "dom": 31.0, "dow": 7.0, "hour": 24.0, "minute": 60.0}
+
+    def __init__(self, list_exo_variables: List[str], freq: str):
+        super().__init__()
+
+        for exo_var in list_exo_variables:
+            if exo_var not in self.PERIODS:
+                raise ValueError(
+                    "Embedding unknown for these Data. Only 'month', 'dow', 'dom', 'hour', 'minute' supported, received {}".format(
+                        exo_var
+                    )
+                )
+
+        self.list_exo_variables = list(list_exo_variables)
+        self.step = pd.Timedelta(to_offset(freq)).value
+
+    def forward(self, timestamps: torch.Tensor, window_size: int) -> torch.Tensor:
+        offsets = (
+            torch.arange(window_size, device=timestamps.device, dtype=torch.int64)
+            * self.step
+        )
+        t = timestamps.long().view(-1, 1) + offsets  # (B, L)
+
+        days = torch.div(t, NS_DAY, rounding_mode="floor")
+        if "month" in self.list_exo_variables or "dom" in self.list_exo_variables:
+            month, day = civil_from_days(days)
+
+        encoding = []
+        for exo_var in self.list_exo_variables:
+            if exo_var == "minute":
+                values = torch.div(t, NS_MINUTE, rounding_mode="floor") % 60
+            elif exo_var == "hour":
+                values = torch.div(t, NS_HOUR, rounding_mode="floor") % 24
+            elif exo_var == "dow":
+                # 1970-01-01 was a Thursday (dayofweek=3)
+                values = (days + 3) % 7
+            elif exo_var == "month":
+                values = month
+            else:
+                values = day
+
+            angle = values.float() * (2 * math.pi / self.PERIODS[exo_var])
+            encoding += [torch.sin(angle), torch.cos(angle)]
+
+        return torch.stack(encoding, dim=1)  # (B, 2 * N_exo_variables, L)
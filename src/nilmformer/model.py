@@ -11,6 +11,7 @@ import torch.nn as nn
 
 from src.nilmformer.layers.transformer import EncoderLayer
 from src.nilmformer.layers.embedding import DilatedBlock
+from src.nilmformer.layers.timestamp import TimestampEncoding
 
 from src.nilmformer.congif import NILMFormerConfig
 
@@ -49,6 +50,14 @@ class NILMFormer(nn.Module):
             in_channels=c_embedding, out_channels=d_model // 4, kernel_size=1
         )
 
+        if NFConfig.timestamp_encoding:
+            assert c_embedding == 2 * len(NFConfig.list_exo_variables), (
+                "c_embedding must be 2 * number of exogene variables with timestamp encoding."
+            )
+            self.TimestampEncoding = TimestampEncoding(
+                NFConfig.list_exo_variables, NFConfig.freq
+            )
+
         self.ProjStats1 = nn.Linear(2, d_model)
         self.ProjStats2 = nn.Linear(d_model, 2)
 
@@ -99,12 +108,18 @@ class NILMFormer(nn.Module):
           - 1: channel for load curve
           - e: # exogenous input channels
           - L: sequence length
+        or, with timestamp encoding, tuple ((B, 1, L) load curve, (B,) int64 start timestamps)
         """
-        # Separate the channels:
-        #   x[:, :1, :] => load curve
-        #   x[:, 1:, :] => exogenous input(s)
-        encoding = x[:, 1:, :]  # shape: (B, e, L)
-        x = x[:, :1, :]  # shape: (B, 1, L)
+        if isinstance(x, (tuple, list)):
+            # Exogenous input(s) computed from start timestamps
+            x, timestamps = x
+            encoding = self.TimestampEncoding(timestamps, x.shape[-1])  # (B, e, L)
+        else:
+            # Separate the channels:
+            #   x[:, :1, :] => load curve
+            #   x[:, 1:, :] => exogenous input(s)
+            encoding = x[:, 1:, :]  # shape: (B, e, L)
+            x = x[:, :1, :]  # shape: (B, 1, L)
 
         # === Instance Normalization === #
         inst_mean = torch.mean(x, dim=-1, keepdim=True).detach()